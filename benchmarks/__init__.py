@@ -0,0 +1,10 @@
+"""Benchmarks of the sleep I/O, preprocessing and detection paths.
+
+Benchmarks follow the airspeed velocity (asv) conventions and can either be
+run with asv (see asv.conf.json at the root of the repository) or with the
+standalone runner (python -m benchmarks.run), which exports the wall time
+and the peak memory of each benchmark as JSON.
+
+All of the benchmarks use deterministic synthetic whole nights (see
+benchmarks.synthetic).
+"""
@@ -0,0 +1,138 @@
+"""Benchmarks of the sleep detections on synthetic whole nights."""
+import numpy as np
+
+from visbrain.utils.sleep.engine import (detect_channel, FeatureCache,
+                                         DetectionEngine)
+from visbrain.utils.sleep.hypnoprocessing import sleepstats
+
+from .synthetic import (check_size, synthetic_night, synthetic_hypno,
+                        EPOCH_S)
+
+DURATIONS = [1, 8, 24]
+CHANNELS = [1, 16, 256]
+RATES = [100, 512, 2048]
+# Default settings of the Sleep module (the peaks lookahead is set in
+# seconds) :
+SETTINGS = {'REM': dict(threshold=3., rem_only=False),
+            'Spindles': dict(threshold=2., nrem_only=False),
+            'Slow waves': dict(threshold=.75),
+            'K-complexes': dict(proba_thr=.7, amp_thr=1., tmin=400.,
+                                tmax=4000., kc_min_amp=100.,
+                                kc_max_amp=600., nrem_only=False),
+            'Muscle twitches': dict(threshold=3., rem_only=False),
+            'Peaks': dict(lookahead=1., delta=1., threshold='auto',
+                          get='max')}
+# Threshold changed when a detection is run again :
+THRESHOLDS = {'REM': 'threshold', 'Spindles': 'threshold',
+              'Slow waves': 'threshold', 'K-complexes': 'proba_thr',
+              'Muscle twitches': 'threshold'}
+
+
+def _settings(method, sf):
+    """Get the settings of a detection."""
+    kwargs = SETTINGS[method].copy()
+    if method == 'Peaks':
+        kwargs['lookahead'] = int(kwargs['lookahead'] * sf)
+    return kwargs
+
+
+class Detection(object):
+    """Detections on a single channel."""
+
+    params = (list(SETTINGS), DURATIONS, RATES)
+    param_names = ('method', 'duration_h', 'sf')
+    timeout = 1800.
+
+    def setup(self, method, duration_h, sf):
+        """Generate a single channel night."""
+        check_size(duration_h, 1, sf)
+        data, self.hypno, _ = synthetic_night(duration_h, 1, sf)
+        self.x = data[0, :].astype(float)
+        self.time = np.arange(len(self.x)) / float(sf)
+        self.kwargs = _settings(method, sf)
+
+    def _detect(self, method, duration_h, sf):
+        detect_channel(method, self.x.copy(), float(sf), self.hypno,
+                       self.time, **self.kwargs)
+
+    def time_detect(self, *args):
+        """Time the detection."""
+        self._detect(*args)
+
+    def peakmem_detect(self, *args):
+        """Peak memory of the detection."""
+        self._detect(*args)
+
+
+class Rethreshold(object):
+    """Detections run again with another threshold (cached features)."""
+
+    params = (list(THRESHOLDS), DURATIONS, RATES)
+    param_names = ('method', 'duration_h', 'sf')
+    timeout = 1800.
+
+    def setup(self, method, duration_h, sf):
+        """Run the detection once and change the threshold."""
+        check_size(duration_h, 1, sf)
+        data, self.hypno, _ = synthetic_night(duration_h, 1, sf)
+        self.x = data[0, :].astype(float)
+        self.kwargs = _settings(method, sf)
+        self.cache = FeatureCache(max_bytes=2 ** 34)
+        detect_channel(method, self.x, float(sf), self.hypno,
+                       cache=self.cache, **self.kwargs)
+        self.kwargs[THRESHOLDS[method]] *= 1.1
+
+    def time_rethreshold(self, method, duration_h, sf):
+        """Time the detection with the new threshold."""
+        detect_channel(method, self.x, float(sf), self.hypno,
+                       cache=self.cache, **self.kwargs)
+
+
+class Engine(object):
+    """Spindles detection over all channels with the DetectionEngine."""
+
+    params = (DURATIONS, CHANNELS, ['thread', 'process'])
+    param_names = ('duration_h', 'n_channels', 'backend')
+    timeout = 3600.
+
+    def setup(self, duration_h, n_channels, backend):
+        """Generate a multi-channel night and the engine."""
+        check_size(duration_h, n_channels, 100.)
+        data, hypno, _ = synthetic_night(duration_h, n_channels, 100.)
+        self.engine = DetectionEngine(100., data, hypno, backend=backend)
+        self.chans = range(n_channels)
+
+    def teardown(self, *args):
+        """Cancel the running detections."""
+        self.engine.cancel()
+
+    def _detect(self):
+        self.engine.run('Spindles', self.chans, **_settings('Spindles', 100.))
+        self.engine.wait()
+
+    def time_spindles(self, *args):
+        """Time the detection over all channels."""
+        self._detect()
+
+    def peakmem_spindles(self, *args):
+        """Peak memory of the detection over all channels."""
+        self._detect()
+
+
+class Hypnogram(object):
+    """Sleep statistics of a synthetic hypnogram.
+
+    The hypnogram has one value per sample at 100 Hz, as in the Sleep module.
+    """
+
+    params = (DURATIONS,)
+    param_names = ('duration_h',)
+
+    def setup(self, duration_h):
+        """Generate the per-sample hypnogram."""
+        self.hypno = np.repeat(synthetic_hypno(duration_h),
+                               int(EPOCH_S * 100))
+
+    def time_sleepstats(self, duration_h):
+        """Time the sleep statistics."""
+        sleepstats(self.hypno, 100.)
@@ -0,0 +1,73 @@
+"""Benchmarks of the preprocessing of synthetic whole nights."""
+import numpy as np
+
+from visbrain.utils.filtering import (filt, morlet_power, welch_power,
+                                      PrepareData)
+from visbrain.utils.sigproc import smoothing
+
+from .synthetic import check_size, synthetic_night
+
+DURATIONS = [1, 8, 24]
+CHANNELS = [1, 16, 256]
+RATES = [100, 512, 2048]
+BANDS = [.5, 4., 8., 12., 16., 30.]
+
+
+class Preprocessing(object):
+    """Filtering and spectral features of a single channel."""
+
+    params = (DURATIONS, RATES)
+    param_names = ('duration_h', 'sf')
+    timeout = 1800.
+
+    def setup(self, duration_h, sf):
+        """Generate a single channel night."""
+        check_size(duration_h, 1, sf)
+        self.x = synthetic_night(duration_h, 1, sf)[0][0, :].astype(float)
+        self.sf = float(sf)
+
+    def time_filt(self, *args):
+        """Time the band-pass filtering."""
+        filt(self.sf, np.array([12., 14.]), self.x)
+
+    def time_smoothing(self, *args):
+        """Time the smoothing."""
+        smoothing(self.x, int(self.sf), 'hanning')
+
+    def time_morlet_power(self, *args):
+        """Time the wavelet band power."""
+        morlet_power(self.x, BANDS, self.sf)
+
+    def peakmem_morlet_power(self, *args):
+        """Peak memory of the wavelet band power."""
+        morlet_power(self.x, BANDS, self.sf)
+
+    def time_welch_power(self, *args):
+        """Time the Welch band power."""
+        welch_power(self.x, BANDS, self.sf)
+
+    def peakmem_welch_power(self, *args):
+        """Peak memory of the Welch band power."""
+        welch_power(self.x, BANDS, self.sf)
+
+
+class PrepareChannels(object):
+    """Data preparation of the Sleep module (100 Hz, all channels)."""
+
+    params = (DURATIONS, CHANNELS)
+    param_names = ('duration_h', 'n_channels')
+    timeout = 1800.
+
+    def setup(self, duration_h, n_channels):
+        """Generate a multi-channel night."""
+        check_size(duration_h, n_channels, 100.)
+        self.data = synthetic_night(duration_h, n_channels, 100.)[0]
+        self.prep = PrepareData(axis=1, demean=True, detrend=True, filt=True)
+
+    def time_prepare(self, *args):
+        """Time the data preparation."""
+        self.prep._prepare_data(100., self.data.copy(), None)
+
+    def peakmem_prepare(self, *args):
+        """Peak memory of the data preparation."""
+        self.prep._prepare_data(100., self.data.copy(), None)
@@ -0,0 +1,264 @@
+"""Standalone runner of the benchmarks, with JSON export.
+
+Run the benchmarks without asv and save the results::
+
+    python -m benchmarks.run --out results.json --select "Detection"
+
+Compare two results (e.g. from two commits)::
+
+    python -m benchmarks.run compare before.json after.json
+
+Benchmarks follow the asv conventions : methods starting with time_ are
+timed and methods starting with peakmem_ are profiled for memory. Here, the
+peak memory is the peak of the memory allocated during the call (traced with
+tracemalloc, numpy allocations included), instead of the peak resident
+memory of the process reported by asv.
+"""
+import argparse
+import datetime
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+MODULES = ('sleep_io', 'preprocessing', 'detection')
+
+
+def discover(select=None):
+    """Find the benchmarks.
+
+    Parameters
+    ----------
+    select : string | None
+        Regular expression used to select the benchmarks from their name
+        (module.Class.method).
+
+    Returns
+    -------
+    benchmarks : list
+        List of (name, class, method name).
+    """
+    out = []
+    for mod_name in MODULES:
+        mod = importlib.import_module('.' + mod_name, __package__)
+        for cls_name, cls in inspect.getmembers(mod, inspect.isclass):
+            if cls.__module__ != mod.__name__:
+                continue
+            for meth in sorted(vars(cls)):
+                if not meth.startswith(('time_', 'peakmem_')):
+                    continue
+                name = '%s.%s.%s' % (mod_name, cls_name, meth)
+                if (select is None) or re.search(select, name):
+                    out.append((name, cls, meth))
+    return out
+
+
+def run_benchmark(cls, meth, repeat=5):
+    """Run a benchmark for all of its parameters.
+
+    Parameters
+    ----------
+    cls : class
+        The benchmark class.
+    meth : string
+        Name of the method to run.
+    repeat : int | 5
+        Number of timings (time_ methods).
+
+    Returns
+    -------
+    results : list
+        List of dictionaries, one per combination of parameters, with the
+        parameters and either the times (in seconds), the peak memory (in
+        bytes), or the reason why the benchmark was skipped.
+    """
+    params = getattr(cls, 'params', ())
+    names = getattr(cls, 'param_names', ())
+    combinations = itertools.product(*params) if params else [()]
+    results = []
+    for args in combinations:
+        res = {'params': dict(zip(names, args))}
+        bench = cls()
+        try:
+            if hasattr(bench, 'setup'):
+                bench.setup(*args)
+        except NotImplementedError as e:
+            res['skipped'] = str(e)
+            results.append(res)
+            continue
+        fcn = getattr(bench, meth)
+        try:
+            if meth.startswith('time_'):
+                times = timeit.repeat(lambda: fcn(*args), repeat=repeat,
+                                      number=1)
+                res['time'] = {'min': min(times),
+                               'median': float(np.median(times)),
+                               'repeat': repeat}
+            else:
+                tracemalloc.start()
+                try:
+                    fcn(*args)
+                    res['peakmem'] = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+        except Exception as e:
+            res['error'] = '%s: %s' % (type(e).__name__, e)
+        finally:
+            if hasattr(bench, 'teardown'):
+                bench.teardown(*args)
+        results.append(res)
+    return results
+
+
+def _commit():
+    """Get the current commit of the repository (if any)."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _machine():
+    """Get a description of the machine and of the environment."""
+    import scipy
+    return {'platform': platform.platform(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__}
+
+
+def run(select=None, repeat=5, out=None):
+    """Run the benchmarks and export the results as JSON.
+
+    Parameters
+    ----------
+    select : string | None
+        Regular expression used to select the benchmarks (see discover).
+    repeat : int | 5
+        Number of timings.
+    out : string | None
+        Path to the JSON file.
+
+    Returns
+    -------
+    results : dict
+        The results of the benchmarks.
+    """
+    results = {'version': 1, 'commit': _commit(),
+               'date': datetime.datetime.now().isoformat(),
+               'machine': _machine(),
+               'max_samples': os.environ.get('VISBRAIN_BENCH_MAX_SAMPLES'),
+               'benchmarks': {}}
+    for name, cls, meth in discover(select):
+        print(name)
+        res = results['benchmarks'][name] = run_benchmark(cls, meth, repeat)
+        for r in res:
+            print('    %s : %s' % (_params_key(r['params']), _format(r)))
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def _params_key(params):
+    """Get a string describing the parameters of a benchmark."""
+    return ', '.join('%s=%s' % (k, v) for k, v in params.items())
+
+
+def _value(res):
+    """Get the compared value of a result (None if not available)."""
+    if 'time' in res:
+        return res['time']['min']
+    return res.get('peakmem')
+
+
+def _format(res):
+    """Format a result."""
+    if 'time' in res:
+        return '%.4g s' % res['time']['min']
+    elif 'peakmem' in res:
+        return '%.4g MB' % (res['peakmem'] / 2. ** 20)
+    return 'skipped' if 'skipped' in res else 'failed (%s)' % res['error']
+
+
+def compare(before, after, factor=1.1):
+    """Compare two JSON results.
+
+    Parameters
+    ----------
+    before, after : string
+        Paths to the JSON results.
+    factor : float | 1.1
+        Ratios (after / before) above factor are reported as regressions and
+        ratios below 1 / factor as improvements.
+
+    Returns
+    -------
+    n_regressions : int
+        Number of regressions.
+    """
+    with open(before) as f:
+        before = json.load(f)
+    with open(after) as f:
+        after = json.load(f)
+    print('before : %s\nafter : %s' % (before['commit'], after['commit']))
+    n_regressions = 0
+    for name, res_after in sorted(after['benchmarks'].items()):
+        res_before = {_params_key(r['params']): r for r in
+                      before['benchmarks'].get(name, [])}
+        for r in res_after:
+            key = _params_key(r['params'])
+            old, new = _value(res_before.get(key, {})), _value(r)
+            if (old is None) or (new is None) or not old:
+                continue
+            ratio = new / old
+            flag = ''
+            if ratio > factor:
+                flag, n_regressions = ' (regression)', n_regressions + 1
+            elif ratio < 1. / factor:
+                flag = ' (improvement)'
+            print('%s [%s] : %s -> %s, x%.2f%s' % (
+                name, key, _format(res_before[key]), _format(r), ratio,
+                flag))
+    return n_regressions
+
+
+def main(argv=None):
+    """Command line interface of the runner."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['compare']:
+        parser = argparse.ArgumentParser(prog='benchmarks.run compare')
+        parser.add_argument('before', help='JSON results of reference.')
+        parser.add_argument('after', help='JSON results to compare.')
+        parser.add_argument('--factor', type=float, default=1.1,
+                            help='Threshold ratio of the regressions.')
+        args = parser.parse_args(argv[1:])
+        return int(compare(args.before, args.after, args.factor) > 0)
+    parser = argparse.ArgumentParser(prog='benchmarks.run')
+    parser.add_argument('--select', default=None,
+                        help='Regular expression selecting the benchmarks.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timings.')
+    parser.add_argument('--max-samples', type=float, default=None,
+                        help='Skip sizes with more samples than this.')
+    parser.add_argument('--out', default=None, help='Output JSON file.')
+    args = parser.parse_args(argv)
+    if args.max_samples is not None:
+        os.environ['VISBRAIN_BENCH_MAX_SAMPLES'] = str(args.max_samples)
+    run(args.select, args.repeat, args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
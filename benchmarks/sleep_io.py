@@ -0,0 +1,54 @@
+"""Benchmarks of the sleep readers on synthetic whole nights."""
+import os
+
+from visbrain.io.read_sleep import sleep_switch
+from visbrain.io.sleep_index import read_sleep_header
+
+from .synthetic import check_size, synthetic_file, channel_names
+
+DURATIONS = [1, 8, 24]
+CHANNELS = [1, 16, 256]
+RATES = [100, 512, 2048]
+
+
+class ReadSleep(object):
+    """Read a synthetic night in each of the supported formats.
+
+    Data are down-sampled to 100 Hz, as in the Sleep module.
+    """
+
+    params = (['edf', 'vhdr', 'eeg', 'trc'], DURATIONS, CHANNELS, RATES)
+    param_names = ('format', 'duration_h', 'n_channels', 'sf')
+    timeout = 3600.
+
+    def setup(self, fmt, duration_h, n_channels, sf):
+        """Write the synthetic file (if not cached)."""
+        check_size(duration_h, n_channels, sf)
+        self.path = synthetic_file(fmt, duration_h, n_channels, sf)
+        self.file, self.ext = os.path.splitext(self.path)
+
+    def _read(self, preload=True, picks=None):
+        return sleep_switch(self.file, self.ext, 100., preload=preload,
+                            picks=picks)
+
+    def time_header(self, *args):
+        """Time the header reading."""
+        read_sleep_header(self.path)
+
+    def time_read(self, *args):
+        """Time the reading of the whole file."""
+        self._read()
+
+    def peakmem_read(self, *args):
+        """Peak memory of the reading of the whole file."""
+        self._read()
+
+    def time_read_channel(self, *args):
+        """Time the reading of a single channel."""
+        self._read(picks=channel_names(1))
+
+    def time_read_epoch(self, *args):
+        """Time the lazy reading of a 30 seconds epoch."""
+        data = self._read(preload=False)[3]
+        middle = data.shape[1] // 2
+        data[:, middle:middle + 3000]
@@ -0,0 +1,442 @@
+"""Deterministic synthetic whole nights and synthetic sleep files.
+
+This file contains :
+- synthetic_hypno : hypnogram of a synthetic night (one stage per epoch)
+- iter_night : generate a synthetic night, block by block
+- synthetic_night : generate a synthetic night in memory
+- write_edf, write_brainvision, write_elan, write_trc : write a synthetic
+  night in one of the formats read by the Sleep module
+- synthetic_file : get the path to a synthetic file, written once and
+  cached on disk
+- check_size : skip the sizes above the memory budget of the benchmarks
+
+The background activity is made of 30 seconds segments generated with
+visbrain.utils.generate_eeg. Each epoch picks and shifts segments from this
+bank and adds the transients of its sleep stage (alpha, spindles,
+K-complexes, slow waves, rapid eye movements and muscle twitches). Every
+epoch only depends on the seed and on its position, so that a night is the
+same whatever the size of the generated blocks.
+"""
+import io
+import os
+import shutil
+import struct
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+
+from visbrain.utils.physio import generate_eeg
+from visbrain.io.read_sleep import TRC_ELECTRODE
+
+__all__ = ('synthetic_hypno', 'iter_night', 'synthetic_night', 'write_edf',
+           'write_brainvision', 'write_elan', 'write_trc', 'synthetic_file',
+           'check_size', 'n_points', 'channel_names')
+
+VERSION = 1  # increment when the generated nights change
+EPOCH_S = 30.
+SCALE = 1000  # physical range of the files (+/- SCALE uV)
+START = (2017, 1, 1, 22, 30, 0)
+LABELS = ['Cz', 'Fz', 'Pz', 'C3', 'C4', 'F3', 'F4', 'P3', 'P4', 'O1', 'O2',
+          'Fp1', 'Fp2', 'F7', 'F8', 'T3', 'T4', 'T5', 'T6']
+# Sleep cycle, as (stage, number of epochs), and amplitude (uV) of the
+# background activity of each stage :
+CYCLE = [(1, 6), (2, 50), (3, 40), (2, 20), (4, 64)]
+BACKGROUND = {0: 10., 1: 15., 2: 20., 3: 25., 4: 12.}
+
+
+###############################################################################
+#                               NIGHTS
+###############################################################################
+
+def n_points(duration_h, sf):
+    """Get the number of time points of a night."""
+    return int(round(duration_h * 3600. * sf))
+
+
+def channel_names(n_channels):
+    """Get the names of the channels (10-20 names first)."""
+    return [LABELS[k] if k < len(LABELS) else 'E%03i' % k
+            for k in range(n_channels)]
+
+
+def check_size(duration_h, n_channels, sf):
+    """Skip the sizes above the budget of the benchmarks.
+
+    The maximum number of samples (n_channels * n_points) is read from the
+    VISBRAIN_BENCH_MAX_SAMPLES environment variable (2 ** 28 by default).
+    Larger sizes are skipped by raising NotImplementedError, as expected by
+    asv.
+    """
+    max_samples = float(os.environ.get('VISBRAIN_BENCH_MAX_SAMPLES',
+                                       2 ** 28))
+    n = n_points(duration_h, sf) * n_channels
+    if n > max_samples:
+        raise NotImplementedError("%i samples is above the budget of the "
+                                  "benchmarks (%i)" % (n, max_samples))
+
+
+def synthetic_hypno(duration_h, seed=0):
+    """Get the hypnogram of a synthetic night.
+
+    Parameters
+    ----------
+    duration_h : float
+        Duration of the night (in hours).
+    seed : int | 0
+        Seed of the night.
+
+    Returns
+    -------
+    hypno : array_like
+        Stage of each 30 seconds epoch (0: wake, 1: N1, 2: N2, 3: N3,
+        4: REM).
+    """
+    n_epochs = int(np.ceil(duration_h * 3600. / EPOCH_S))
+    rng = np.random.RandomState(seed)
+    hypno, cycle = [np.zeros((20,), dtype=int)], 0
+    while sum(len(k) for k in hypno) < n_epochs:
+        # Less deep sleep and more REM sleep along the night :
+        scale = {3: max(1. - .25 * cycle, .1), 4: min(.3 + .2 * cycle, 1.)}
+        for stage, n in CYCLE + [(0, 2)]:
+            n *= scale.get(stage, 1.) * rng.uniform(.8, 1.2)
+            hypno.append(np.full((max(int(n), 1),), stage, dtype=int))
+        cycle += 1
+    return np.concatenate(hypno)[:n_epochs]
+
+
+@lru_cache(maxsize=4)
+def _background(sf, seed, n_bank=8):
+    """Get the bank of background segments (read-only, float32)."""
+    state = np.random.get_state()
+    try:
+        np.random.seed(seed)
+        bank, _ = generate_eeg(sf=sf, n_pts=int(round(EPOCH_S * sf)),
+                               n_trials=n_bank, f_min=.5,
+                               f_max=min(30., sf / 2. - 1.),
+                               smooth=max(int(sf / 20.), 1))
+    finally:
+        np.random.set_state(state)
+    bank = bank.astype(np.float32)
+    bank.setflags(write=False)
+    return bank
+
+
+def _transients(rng, stage, sf, n):
+    """Get the transients of an epoch (common to all channels)."""
+    x = np.zeros((n,))
+    t = np.arange(n) / sf
+
+    def _add(n_events, dur_s, wave):
+        for _ in range(n_events):
+            n_ev = min(max(int(rng.uniform(*dur_s) * sf), 2), n)
+            onset = rng.randint(n - n_ev + 1)
+            x[onset:onset + n_ev] += wave(t[:n_ev]) * np.hanning(n_ev)
+
+    if stage == 0:  # alpha
+        x += 10. * np.sin(2 * np.pi * rng.uniform(9., 11.) * t +
+                          rng.uniform(0., 2 * np.pi))
+    elif stage == 2:  # spindles and K-complexes
+        f, a = rng.uniform(12., 14.), rng.uniform(30., 60.)
+        _add(rng.poisson(3), (.5, 2.),
+             lambda t: a * np.sin(2 * np.pi * f * t))
+        a = rng.uniform(150., 300.)
+        _add(rng.poisson(1), (.8, 1.2),
+             lambda t: -a * np.sin(2 * np.pi * t / t[-1]))
+    elif stage == 3:  # slow waves
+        a = rng.uniform(75., 150.)
+        _add(rng.poisson(15), (.6, 2.),
+             lambda t: -a * np.sin(2 * np.pi * t / t[-1]))
+    elif stage == 4:  # rapid eye movements and muscle twitches
+        a = rng.uniform(50., 100.)
+        _add(rng.poisson(3), (.2, .5), lambda t: a * np.ones_like(t))
+        _add(rng.poisson(1), (.1, .3),
+             lambda t: 40. * rng.randn(len(t)))
+    return x
+
+
+def _night_epoch(i_epoch, stage, n_channels, sf, seed):
+    """Generate an epoch of a synthetic night (float32 in uV)."""
+    bank = _background(sf, seed)
+    n_bank, n = bank.shape
+    rng = np.random.RandomState([seed, i_epoch])
+    gain = np.random.RandomState(seed).uniform(.5, 1.5, (n_channels, 1))
+    which = rng.randint(n_bank, size=(n_channels, 1))
+    shift = rng.randint(n, size=(n_channels, 1))
+    x = bank[which, (np.arange(n) + shift) % n]
+    x *= BACKGROUND[stage]
+    x += _transients(rng, stage, sf, n).astype(np.float32)
+    x *= gain.astype(np.float32)
+    return x
+
+
+def iter_night(duration_h, n_channels, sf, seed=0, block_size=2 ** 24):
+    """Generate a synthetic night, block by block.
+
+    Parameters
+    ----------
+    duration_h : float
+        Duration of the night (in hours).
+    n_channels : int
+        Number of channels.
+    sf : float
+        The sampling frequency.
+    seed : int | 0
+        Seed of the night.
+    block_size : int | 2 ** 24
+        Approximative number of samples (n_channels * n_points) per block.
+        Blocks contain whole epochs.
+
+    Returns
+    -------
+    blocks : generator
+        Generator of (data, hypno) where data is a float32 array of shape
+        (n_channels, n_block) in uV and hypno the stage of each time point.
+    """
+    n, n_epoch = n_points(duration_h, sf), int(round(EPOCH_S * sf))
+    hypno = synthetic_hypno(duration_h, seed)
+    per_block = max(int(block_size // (n_channels * n_epoch)), 1)
+    for start in range(0, len(hypno), per_block):
+        epochs = range(start, min(start + per_block, len(hypno)))
+        data = np.concatenate([_night_epoch(k, hypno[k], n_channels, sf,
+                                            seed) for k in epochs], axis=1)
+        stop = min(n - start * n_epoch, data.shape[1])
+        yield data[:, :stop], np.repeat(hypno[epochs], n_epoch)[:stop]
+
+
+def synthetic_night(duration_h, n_channels, sf, seed=0):
+    """Generate a synthetic night in memory.
+
+    Parameters
+    ----------
+    duration_h : float
+        Duration of the night (in hours).
+    n_channels : int
+        Number of channels.
+    sf : float
+        The sampling frequency.
+    seed : int | 0
+        Seed of the night.
+
+    Returns
+    -------
+    data : array_like
+        Data of shape (n_channels, n_points) (float32, in uV).
+    hypno : array_like
+        Hypnogram of shape (n_points,).
+    channels : list
+        Names of the channels.
+    """
+    n = n_points(duration_h, sf)
+    data = np.empty((n_channels, n), dtype=np.float32)
+    hypno = np.empty((n,), dtype=np.float32)
+    start = 0
+    for block, hyp in iter_night(duration_h, n_channels, sf, seed):
+        data[:, start:start + block.shape[1]] = block
+        hypno[start:start + block.shape[1]] = hyp
+        start += block.shape[1]
+    return data, hypno, channel_names(n_channels)
+
+
+###############################################################################
+#                               FILES
+###############################################################################
+
+def _quantize(x, gain, dtype, vmin, vmax, offset=0):
+    """Convert uV into the integers stored on file."""
+    q = np.rint(x / gain)
+    q += offset
+    np.clip(q, vmin, vmax, out=q)
+    return q.astype(dtype)
+
+
+def _field(values, width):
+    """Pad or crop the values of an EDF header field."""
+    return ''.join(str(k)[:width].ljust(width) for k in values)
+
+
+def write_edf(path, duration_h, n_channels, sf, seed=0):
+    """Write a synthetic night in a European Data Format (edf) file.
+
+    Data records last one second so the sampling frequency must be an
+    integer.
+    """
+    n, sf_rec = n_points(duration_h, sf), int(sf)
+    if (sf_rec != sf) or (n % sf_rec):
+        raise ValueError("EDF files need an integer sampling frequency and "
+                         "a whole number of seconds.")
+    chan = channel_names(n_channels)
+    year, month, day, hour, minute, sec = START
+    header = ('0'.ljust(8) + _field(['X X X X'], 80) +
+              _field(['Startdate X X X X'], 80) +
+              '%02i.%02i.%02i' % (day, month, year % 100) +
+              '%02i.%02i.%02i' % (hour, minute, sec) +
+              _field([256 * (n_channels + 1)], 8) + ' ' * 44 +
+              _field([n // sf_rec], 8) + _field([1], 8) +
+              _field([n_channels], 4) + _field(chan, 16) +
+              _field(['AgAgCl electrode'] * n_channels, 80) +
+              _field(['uV'] * n_channels, 8) +
+              _field([-SCALE] * n_channels, 8) +
+              _field([SCALE] * n_channels, 8) +
+              _field([-32767] * n_channels, 8) +
+              _field([32767] * n_channels, 8) +
+              _field([''] * n_channels, 80) +
+              _field([sf_rec] * n_channels, 8) +
+              _field([''] * n_channels, 32))
+    gain = SCALE / 32767.
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        for data, _ in iter_night(duration_h, n_channels, sf, seed):
+            # Records contain one second of each channel :
+            raw = _quantize(data, gain, '<i2', -32767, 32767)
+            raw.reshape(n_channels, -1, sf_rec).transpose(1, 0, 2).tofile(f)
+
+
+def write_brainvision(path, duration_h, n_channels, sf, seed=0):
+    """Write a synthetic night in a BrainVision file (.vhdr, .vmrk, .eeg).
+
+    Data are stored as multiplexed 16-bit integers.
+    """
+    base = os.path.splitext(path)[0]
+    name = os.path.basename(base)
+    resolution = SCALE / 32767.
+    with io.open(base + '.vhdr', 'w') as f:
+        f.write("Brain Vision Data Exchange Header File Version 1.0\n"
+                "[Common Infos]\nDataFile=%s.eeg\nMarkerFile=%s.vmrk\n"
+                "DataFormat=BINARY\nDataOrientation=MULTIPLEXED\n"
+                "NumberOfChannels=%i\nSamplingInterval=%r\n"
+                "[Binary Infos]\nBinaryFormat=INT_16\n[Channel Infos]\n" % (
+                    name, name, n_channels, 1e6 / sf))
+        for k, c in enumerate(channel_names(n_channels)):
+            f.write("Ch%i=%s,,%r,uV\n" % (k + 1, c, resolution))
+    with io.open(base + '.vmrk', 'w') as f:
+        f.write("Brain Vision Data Exchange Marker File, Version 1.0\n"
+                "[Marker Infos]\nMk1=New Segment,,1,1,0,"
+                "%04i%02i%02i%02i%02i%02i000000\n" % START)
+    with open(base + '.eeg', 'wb') as f:
+        for data, _ in iter_night(duration_h, n_channels, sf, seed):
+            raw = _quantize(data, resolution, '<i2', -32767, 32767)
+            raw.T.tofile(f)
+
+
+def write_elan(path, duration_h, n_channels, sf, seed=0):
+    """Write a synthetic night in an ELAN file (.eeg and .eeg.ent).
+
+    Data are stored as multiplexed 16-bit integers (version 2), followed by
+    the two channels that do not contain data.
+    """
+    n_chan = n_channels + 2
+    year, month, day, hour, minute, sec = START
+    ent = (['V2', 'Synthetic night', 'visbrain benchmarks',
+            '%02i:%02i:%04i' % (day, month, year),
+            '%02i:%02i:%02i' % (hour, minute, sec), '-1', 'reserved', '-1',
+            repr(1. / sf), str(n_chan)] +
+           channel_names(n_channels) + ['Trigger', 'Status'] +
+           ['EEG'] * n_channels + ['OTHER'] * 2 + ['uV'] * n_chan +
+           [str(-SCALE)] * n_chan + [str(SCALE)] * n_chan +
+           ['-32767'] * n_chan + ['32767'] * n_chan)
+    with io.open(path + '.ent', 'w') as f:
+        f.write('\n'.join(ent) + '\n')
+    gain = SCALE / 32767.
+    with open(path, 'wb') as f:
+        for data, _ in iter_night(duration_h, n_channels, sf, seed):
+            raw = np.zeros((data.shape[1], n_chan), dtype='>i2')
+            raw[:, :n_channels] = _quantize(data, gain, '>i2', -32767,
+                                            32767).T
+            raw.tofile(f)
+
+
+def write_trc(path, duration_h, n_channels, sf, seed=0):
+    """Write a synthetic night in a Micromed file (trc, version 4).
+
+    Data are stored as multiplexed unsigned 16-bit integers.
+    """
+    if int(sf) != sf:
+        raise ValueError("TRC files need an integer sampling frequency.")
+    # Electrodes definitions :
+    elec = np.zeros((n_channels,), dtype=TRC_ELECTRODE)
+    elec['positive_input'] = [k[:6].encode('utf-8') for k in
+                              channel_names(n_channels)]
+    elec['logical_min'], elec['logical_max'] = 0, 65535
+    elec['logical_ground'] = 32768
+    elec['physical_min'], elec['physical_max'] = -SCALE, SCALE
+    gain = 2. * SCALE / 65536.
+    # Header, followed by the ORDER and LABCOD zones :
+    order_pos = 640
+    labcod_pos = order_pos + 2 * n_channels
+    data_offset = labcod_pos + elec.nbytes
+    header = bytearray(order_pos)
+    year, month, day, hour, minute, sec = START
+    header[128:134] = struct.pack('<bbbbbb', day, month, year - 1900, hour,
+                                  minute, sec)
+    header[138:150] = struct.pack('<IHHHH', data_offset, n_channels,
+                                  n_channels, int(sf), 2)
+    header[175] = 4
+    header[176:208] = (struct.pack('<8sII', b'ORDER   ', order_pos,
+                                   2 * n_channels) +
+                       struct.pack('<8sII', b'LABCOD  ', labcod_pos,
+                                   elec.nbytes))
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        np.arange(n_channels, dtype='<u2').tofile(f)
+        elec.tofile(f)
+        for data, _ in iter_night(duration_h, n_channels, sf, seed):
+            raw = _quantize(data, gain, '<u2', 0, 65535, offset=32768)
+            raw.T.tofile(f)
+
+
+WRITERS = {'edf': write_edf, 'vhdr': write_brainvision, 'eeg': write_elan,
+           'trc': write_trc}
+
+
+def bench_dir():
+    """Get the folder of the synthetic files.
+
+    Defined by the VISBRAIN_BENCH_DIR environment variable (a folder in the
+    temporary directory by default).
+    """
+    return os.environ.get('VISBRAIN_BENCH_DIR', os.path.join(
+        tempfile.gettempdir(), 'visbrain_benchmarks'))
+
+
+def synthetic_file(fmt, duration_h, n_channels, sf, seed=0):
+    """Get the path to a synthetic file.
+
+    Files are written once, in their own folder, and are then reused.
+
+    Parameters
+    ----------
+    fmt : {'edf', 'vhdr', 'eeg', 'trc'}
+        The format of the file (extension). 'eeg' is an ELAN file.
+    duration_h : float
+        Duration of the night (in hours).
+    n_channels : int
+        Number of channels.
+    sf : float
+        The sampling frequency.
+    seed : int | 0
+        Seed of the night.
+
+    Returns
+    -------
+    path : string
+        Path to the file.
+    """
+    if fmt not in WRITERS:
+        raise ValueError("fmt should be one of %s" % ', '.join(WRITERS))
+    name = 'night_v%i_%gh_%ich_%ghz_s%i' % (VERSION, duration_h, n_channels,
+                                            sf, seed)
+    folder = os.path.join(bench_dir(), fmt, name)
+    file = 'night.' + fmt
+    if not os.path.isdir(folder):
+        # Write in a temporary folder, then move it :
+        tmp = '%s.%i.tmp' % (folder, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        WRITERS[fmt](os.path.join(tmp, file), duration_h, n_channels, sf,
+                     seed)
+        try:
+            os.rename(tmp, folder)
+        except OSError:  # written meanwhile by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+    return os.path.join(folder, file)
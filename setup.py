@@ -52,7 +52,7 @@ REQS = [str(ir.req) for ir in install_reqs]
 setup(
     name=NAME,
     version=__version__,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_dir={'visbrain': 'visbrain'},
     package_data=PACKAGE_DATA,
     include_package_data=True,
@@ -80,6 +80,8 @@ setup(
     entry_points='''
         [console_scripts]
         visbrain_sleep=visbrain.cli:cli_sleep
+        visbrain_index=visbrain.cli:cli_index
+        visbrain_detect=visbrain.cli:cli_detect
         visbrain_fig_hyp=visbrain.cli:cli_fig_hyp
         visbrain_sleep_stats=visbrain.cli:cli_sleep_stats
     ''')
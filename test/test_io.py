@@ -3,15 +3,22 @@ import shutil
 import numpy as np
 
 from visbrain.io.download import get_data_url_file, download_file
+from visbrain.io.lazy_sleep import (LazySleepData, memmap_reader,
+                                   multiplexed_reader)
 from visbrain.io.read_annotations import (annotations_to_array,
                                           merge_annotations)
+from visbrain.io.read_sleep import read_eeg, read_edf
 from visbrain.io.rw_config import save_config_json, load_config_json
 from visbrain.io.dependencies import is_mne_installed, is_nibabel_installed
 from visbrain.io.rw_hypno import (oversample_hypno, write_hypno_txt,
                                   write_hypno_hyp, read_hypno, read_hypno_hyp,
                                   read_hypno_txt)
 from visbrain.io.rw_utils import get_file_ext, safety_save
+from visbrain.io.sleep_cache import SleepCache
+from visbrain.io.sleep_index import read_sleep_header, SleepIndex
+from visbrain.io.batch_detection import BatchDetection
 from visbrain.io.write_data import (write_csv, write_txt)
+from visbrain.utils.sleep.hypnoprocessing import HypnoRuns
 
 
 # Create a tmp/ directory :
@@ -95,6 +102,309 @@ class TestIO(object):
         """Test function merge_annotations."""
         merge_annotations(*(None, *self._get_annotation_type()))
 
+    ###########################################################################
+    #                            LAZY SLEEP DATA
+    ###########################################################################
+
+    @staticmethod
+    def _get_lazy_data(dsf=3, chunk=100):
+        from scipy.signal import resample_poly
+        raw = np.random.randint(-1000, 1000, (5, 1007)).astype(np.int16)
+        gain, offset = np.random.rand(5), np.random.rand(5)
+        data = raw * gain[:, np.newaxis] + offset[:, np.newaxis]
+        if dsf > 1:
+            data = resample_poly(data, 1, dsf, axis=1)
+        lazy = LazySleepData(memmap_reader(raw, gain, offset), 5, 1007, dsf,
+                             chunk=chunk)
+        return data.astype(np.float32), lazy
+
+    def test_lazy_sleep_data_indexing(self):
+        """Test indexing of LazySleepData."""
+        data, lazy = self._get_lazy_data()
+        assert lazy.shape == data.shape
+        mask = np.array([True, False, True, True, False])
+        keys = [(slice(None), slice(None)), (2, slice(None)), (0, Ellipsis),
+                (mask, slice(10, 200)), ([1, 3], slice(5, 300, 4)),
+                (slice(None), slice(None, None, -3)), (2, 17),
+                (3, np.array([5, 1, 300, 2, 1])), (1, slice(-50, None))]
+        for k in keys:
+            assert np.allclose(lazy[k], data[k], atol=1e-2)
+        assert np.allclose(np.asarray(lazy), data, atol=1e-2)
+
+    def test_lazy_sleep_data_decimation(self):
+        """Test that the down-sampling does not depend on the chunk size."""
+        for dsf in [1, 2, 7]:
+            data, lazy = self._get_lazy_data(dsf=dsf, chunk=50)
+            assert lazy.shape == (5, len(range(0, 1007, dsf)))
+            assert np.allclose(lazy[:, :], data, atol=1e-2)
+
+    def test_lazy_sleep_data_reductions(self):
+        """Test min / max / mean / std of LazySleepData."""
+        data, lazy = self._get_lazy_data()
+        for k in ['min', 'max', 'mean', 'std']:
+            assert np.allclose(getattr(lazy, k)(1), getattr(data, k)(1),
+                               rtol=1e-4)
+        stats = lazy.stats(1)
+        for k, ref in zip(['min', 'max', 'mean', 'std'], stats):
+            assert np.allclose(ref, getattr(data, k)(1), rtol=1e-4)
+
+    def test_lazy_sleep_data_montage(self):
+        """Test scaling and montage of LazySleepData."""
+        data, lazy = self._get_lazy_data()
+        montage = np.eye(5) - np.eye(5)[[0], :]
+        lazy *= 2.
+        lazy.montage = montage
+        assert np.allclose(lazy[:, :], montage.dot(2. * data), atol=1e-2)
+
+    def test_multiplexed_reader(self):
+        """Test the reader of multiplexed data."""
+        raw = np.random.randint(0, 65535, (1007, 5)).astype(np.uint16)
+        gain, offset = np.random.rand(5), np.random.rand(5)
+        data = raw.T * gain[:, np.newaxis] + offset[:, np.newaxis]
+        reader = multiplexed_reader(raw, gain, offset, block=100)
+        chan = np.array([3, 0, 4])
+        assert np.allclose(reader(chan, 17, 950), data[chan, 17:950],
+                           rtol=1e-5)
+        lazy = LazySleepData(reader, 5, 1007)
+        assert np.allclose(np.asarray(lazy), data, rtol=1e-5)
+
+    ###########################################################################
+    #                              READ SLEEP
+    ###########################################################################
+
+    def _write_brainvision(self, orientation, fmt, dtype, n_pts=1000):
+        """Write a small BrainVision file."""
+        raw = np.random.randint(-3000, 3000, (3, n_pts))
+        with open(self._path_to_tmp('bv.vhdr'), 'w') as f:
+            f.write("Brain Vision Data Exchange Header File Version 1.0\n"
+                    "[Common Infos]\nDataFile=bv.eeg\nMarkerFile=bv.vmrk\n"
+                    "DataFormat=BINARY\nDataOrientation=%s\n"
+                    "NumberOfChannels=3\nSamplingInterval=1000\n"
+                    "[Binary Infos]\nBinaryFormat=%s\n[Channel Infos]\n"
+                    "; Each entry: Ch<n>=<Name>,<Ref>,<Resolution>,<Unit>\n"
+                    "Ch1=Cz,,0.1,uV\nCh2=Fz,,0.5,uV\nCh3=Oz,,,uV\n" % (
+                        orientation, fmt))
+        with open(self._path_to_tmp('bv.vmrk'), 'w') as f:
+            f.write("[Marker Infos]\n"
+                    "Mk1=New Segment,,1,1,0,20170101223000000000\n"
+                    "Mk2=Stimulus,S1,101,50,0\n")
+        data = raw if orientation == 'VECTORIZED' else raw.T
+        data.astype(dtype).tofile(self._path_to_tmp('bv.eeg'))
+        return raw * np.array([[.1], [.5], [1.]])
+
+    def test_read_eeg(self):
+        """Test function read_eeg."""
+        for orientation in ['MULTIPLEXED', 'VECTORIZED']:
+            for fmt, dtype in [('INT_16', '<i2'), ('INT_32', '<i4'),
+                               ('IEEE_FLOAT_32', '<f4')]:
+                data = self._write_brainvision(orientation, fmt, dtype)
+                sf, _, _, dat, chan, n, start_time, anot = read_eeg(
+                    self._path_to_tmp('bv.vhdr'), None, read_markers=True)
+                assert (sf, n, chan) == (1000., 1000, ['Cz', 'Fz', 'Oz'])
+                assert np.allclose(dat, data, rtol=1e-5)
+                assert str(start_time) == '22:30:00'
+                assert np.allclose(anot[1, 0:2].astype(float), [.1, .15])
+
+    def _write_bdf(self, labels=('Cz', 'Fz', 'Status'), n_records=4):
+        """Write a small BDF file (100 samples per 1 second record)."""
+        n_chan = len(labels)
+
+        def _field(values, length):
+            return b''.join(str(k).ljust(length).encode() for k in values)
+
+        hdr = b'\xffBIOSEMI' + b'subject'.ljust(80) + b'recording'.ljust(80)
+        hdr += b'01.01.17' + b'22.30.00' + _field([256 * (n_chan + 1)], 8)
+        hdr += b' ' * 44 + _field([n_records], 8) + _field([1], 8)
+        hdr += _field([n_chan], 4) + _field(labels, 16) + b' ' * 80 * n_chan
+        # Physical and digital ranges are the same (gain of 1) :
+        hdr += _field(['uV'] * n_chan, 8)
+        hdr += (_field([-2 ** 23] * n_chan, 8) +
+                _field([2 ** 23 - 1] * n_chan, 8)) * 2
+        hdr += b' ' * 80 * n_chan
+        hdr += _field([100] * n_chan, 8) + b' ' * 32 * n_chan
+        raw = np.random.randint(-1000, 1000, (n_records, n_chan, 100))
+        with open(self._path_to_tmp('test.bdf'), 'wb') as f:
+            f.write(hdr)
+            f.write(raw.astype('<i4').view(np.uint8).reshape(
+                -1, 4)[:, 0:3].tobytes())
+        return raw.transpose(1, 0, 2).reshape(n_chan, -1)
+
+    def test_read_edf(self):
+        """Test function read_edf (the BioSemi Status channel is dropped)."""
+        raw = self._write_bdf()
+        sf, _, _, dat, chan, n, _, _ = read_edf(self._path_to_tmp('test.bdf'),
+                                                None)
+        assert (sf, chan, n) == (100., ['Cz', 'Fz'], 400)
+        assert np.allclose(dat, raw[0:2, :], atol=1e-3)
+        hdr = read_sleep_header(self._path_to_tmp('test.bdf'))
+        assert hdr['channels'] == ['Cz', 'Fz'] and hdr['duration'] == 4.
+
+    def _write_elan(self):
+        """Write a small ELAN file (2 channels, 100 Hz)."""
+        ent = (['V2', 'subject', 'recording', '01:01:2017', '22:30:00', '-1',
+                'reserved', '-1', '0.01', '4', 'Cz', 'Fz', 'Trigger',
+                'Status'] + ['EEG'] * 2 + ['OTHER'] * 2 + ['uV'] * 4 +
+               ['-3276.7'] * 4 + ['3276.7'] * 4 + ['-32767'] * 4 +
+               ['32767'] * 4)
+        with open(self._path_to_tmp('test.eeg.ent'), 'w') as f:
+            f.write('\n'.join(ent) + '\n')
+        raw = np.random.randint(-1000, 1000, (500, 4))
+        raw.astype('>i2').tofile(self._path_to_tmp('test.eeg'))
+        return raw[:, 0:2].T * .1
+
+    def test_read_sleep_header(self):
+        """Test function read_sleep_header."""
+        self._write_brainvision('MULTIPLEXED', 'INT_16', '<i2')
+        hdr = read_sleep_header(self._path_to_tmp('bv.vhdr'))
+        assert (hdr['format'], hdr['sf'], hdr['n']) == ('vhdr', 1000., 1000)
+        assert hdr['channels'] == ['Cz', 'Fz', 'Oz']
+        assert hdr['duration'] == 1. and hdr['start_time'] == '22:30:00'
+        self._write_elan()
+        hdr = read_sleep_header(self._path_to_tmp('test.eeg'))
+        assert (hdr['format'], hdr['sf'], hdr['n']) == ('eeg', 100., 500)
+        assert hdr['channels'] == ['Cz', 'Fz']
+
+    ###########################################################################
+    #                              SLEEP INDEX
+    ###########################################################################
+
+    def test_sleep_index(self):
+        """Test scanning and searching with SleepIndex."""
+        folder = self._path_to_tmp('index')
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(os.path.join(folder, 'sub'))
+        self._write_brainvision('MULTIPLEXED', 'INT_16', '<i2')
+        for sub in ['', 'sub']:
+            for ext in ['.vhdr', '.vmrk', '.eeg']:
+                shutil.copy(self._path_to_tmp('bv' + ext),
+                            os.path.join(folder, sub, 'bv' + ext))
+        index_file = self._path_to_tmp('sleep_index.json')
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+        index = SleepIndex(index_file)
+        assert index.scan(folder, n_workers=2) == 2
+        assert index.scan(folder) == 0  # nothing changed
+        # Indexed files are persistent :
+        index = SleepIndex(index_file)
+        assert len(index) == 2
+        assert len(index.search(channels=['cz', 'F*'], min_duration=.5)) == 2
+        assert not index.search(channels=['Pz'])
+        assert not index.search(max_duration=.5)
+        assert len(index.search(pattern='*sub*')) == 1
+        # Sub-directories are kept when they are not scanned :
+        assert index.scan(folder, recursive=False) == 0
+        assert len(index) == 2
+        # Removed files are removed from the index :
+        os.remove(os.path.join(folder, 'sub', 'bv.vhdr'))
+        index.scan(folder)
+        assert len(index) == 1
+
+    ###########################################################################
+    #                            BATCH DETECTION
+    ###########################################################################
+
+    def test_batch_detection(self):
+        """Test BatchDetection (outputs and resume)."""
+        import csv
+        folder = self._path_to_tmp('batch')
+        shutil.rmtree(folder, ignore_errors=True)
+        self._write_brainvision('MULTIPLEXED', 'INT_16', '<i2', n_pts=60000)
+        for sub in ['s1', 's2']:
+            os.makedirs(os.path.join(folder, 'data', sub))
+            for ext in ['.vhdr', '.vmrk', '.eeg']:
+                shutil.copy(self._path_to_tmp('bv' + ext),
+                            os.path.join(folder, 'data', sub, 'bv' + ext))
+        files = os.path.join(folder, 'data', '*', '*.vhdr')
+        out = os.path.join(folder, 'out')
+        batch = BatchDetection(out, ['spindles', 'peaks'], n_jobs=2)
+        assert batch.run(files) == 2
+        with open(os.path.join(out, 's1', 'bv_summary.csv')) as f:
+            rows = list(csv.reader(f))
+        assert len(rows) == 1 + 3 * 2
+        assert [k[:2] for k in rows[1:3]] == [['Cz', 'Spindles'],
+                                             ['Cz', 'Peaks']]
+        assert all([k[-1] == 'ok' for k in rows[1:]])
+        with open(os.path.join(out, 's2', 'bv_events.csv')) as f:
+            events = list(csv.reader(f))
+        n_events = sum([int(k[2]) for k in rows[1:]])
+        assert len(events) == 1 + n_events
+        # Processed files are skipped, unless removed or if settings change :
+        assert batch.run(files) == 0
+        os.remove(os.path.join(out, 's2', 'bv_done.json'))
+        assert batch.run(files) == 1
+        batch = BatchDetection(out, ['spindles'], n_jobs=2)
+        assert batch.run(files) == 2
+
+    ###########################################################################
+    #                              SLEEP CACHE
+    ###########################################################################
+
+    def _get_cache_args(self):
+        import datetime
+        file = self._path_to_tmp('cache.npy')
+        data = np.random.rand(3, 1000).astype(np.float32)
+        np.save(file, data)
+        annot = np.c_[[1., 2.], [1.5, 3.], ['a', 'b']]
+        args = (1000., 100., 10, data, ['Cz', 'Fz', 'Oz'], 10000,
+                datetime.time(22, 30, 0), annot)
+        return file, args
+
+    def test_sleep_cache_load_save(self):
+        """Test saving / loading data in SleepCache."""
+        file, args = self._get_cache_args()
+        shutil.rmtree(self._path_to_tmp('cache-load'), ignore_errors=True)
+        cache = SleepCache(folder=self._path_to_tmp('cache-load'),
+                           max_size=1e6)
+        key = cache.key(file, 100.)
+        assert key != cache.key(file, 200.)
+        assert cache.load(key) is None
+        cache.save(key, args, file=file)
+        for preload in [True, False]:
+            out = cache.load(key, preload=preload)
+            assert np.array_equal(np.asarray(out[3]), args[3])
+            assert out[0:3] == args[0:3] and out[4:7] == args[4:7]
+            assert np.array_equal(out[7], args[7])
+        stats = cache.stats
+        assert (stats['hits'], stats['misses']) == (2, 1)
+        assert stats['entries'] == 1 and stats['size'] == 12000
+
+    def test_sleep_cache_eviction(self):
+        """Test the LRU eviction of SleepCache."""
+        file, args = self._get_cache_args()
+        cache = SleepCache(folder=self._path_to_tmp('cache'), max_size=30000)
+        cache.clear()
+        n_evictions = cache.stats['evictions']
+        keys = [cache.key(file, k) for k in [100., 200., 300.]]
+        cache.save(keys[0], args)
+        cache.save(keys[1], args)
+        cache.load(keys[0])
+        cache.save(keys[2], args)  # keys[1] is the least recently used
+        assert (keys[0] in cache) and (keys[2] in cache)
+        assert keys[1] not in cache
+        assert cache.stats['evictions'] == n_evictions + 1
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_sleep_cache_shared(self):
+        """Test SleepCache with lazy data and concurrent writers."""
+        from concurrent.futures import ThreadPoolExecutor
+        file, args = self._get_cache_args()
+        cache = SleepCache(folder=self._path_to_tmp('cache-shared'),
+                           max_size=1e6)
+        cache.clear()
+        # Lazy data are not cached :
+        data = LazySleepData(memmap_reader(args[3], np.ones(3)), 3, 1000)
+        key = cache.key(file, 100.)
+        cache.save(key, args[0:3] + (data,) + args[4:])
+        assert key not in cache
+        # Entries saved at once by several writers are all indexed :
+        keys = [cache.key(file, k) for k in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda k: cache.save(k, args), keys))
+        assert len(cache) == 8
+        assert not os.path.isfile(cache._lock_file)
+        cache.clear()
+
     ###########################################################################
     #                                CONFIG
     ###########################################################################
@@ -144,6 +454,12 @@ class TestIO(object):
         """Test function write_hypno_txt."""
         hyp = self._get_hypno()
         write_hypno_txt(self._path_to_tmp('hyp.txt'), hyp, 100., 1000., 5000)
+        # Run-length encoded hypnogram :
+        runs = HypnoRuns.from_epochs(hyp, 50)
+        write_hypno_txt(self._path_to_tmp('hyp_runs.txt'), runs, 100., 1000.,
+                        5000)
+        assert np.array_equal(np.loadtxt(self._path_to_tmp('hyp.txt')),
+                              np.loadtxt(self._path_to_tmp('hyp_runs.txt')))
 
     def test_write_hypno_hyp(self):
         """Test function write_hypno_hyp."""
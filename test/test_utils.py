@@ -3,6 +3,7 @@ import numpy as np
 from itertools import product
 from PyQt5 import QtWidgets, QtCore
 import math
+import threading
 import pytest
 
 from visbrain.utils.cameras import FixedCam
@@ -10,7 +11,8 @@ from visbrain.utils.color import (color2vb, array2colormap, dynamic_color,
                                   color2faces, type_coloring, mpl_cmap,
                                   color2tuple, mpl_cmap_index, colorclip)
 from visbrain.utils.filtering import (filt, morlet, ndmorlet, morlet_power,
-                                      welch_power, PrepareData)
+                                      morlet_bank, welch_power, PrepareData,
+                                      _morlet_wlt)
 from visbrain.utils.gui.popup import (ShortcutPopup, ScreenshotPopup, HelpMenu)
 from visbrain.utils.guitools import (slider2opacity, textline2color,
                                      color2json, ndsubplot,
@@ -26,21 +28,41 @@ from visbrain.utils.mesh import (add_brain_template, remove_brain_template,
                                  mesh_edges, smoothing_matrix)
 from visbrain.utils.others import (set_log_level, get_dsf, set_if_not_none,
                                    get_data_path)
-from visbrain.utils.physio import (find_non_eeg, rereferencing, bipolarization,
-                                   commonaverage, tal2mni, mni2tal,
-                                   generate_eeg)
+from visbrain.utils.physio import (find_non_eeg, pick_channels, rereferencing,
+                                   bipolarization, commonaverage, tal2mni,
+                                   mni2tal, generate_eeg)
 from visbrain.utils.picture import (piccrop, picresize)
 from visbrain.utils.sigproc import (normalize, derivative, tkeo, zerocrossing,
                                     power_of_ten, averaging, normalization,
                                     smoothing, smooth_3d)
+from visbrain.utils.sleep.chunk import (_iter_chunks, _RunningStats,
+                                        _streaming_kth, _stitch_intervals,
+                                        _chunked_extrema)
 from visbrain.utils.sleep.detection import (kcdetect, spindlesdetect,
                                             remdetect, slowwavedetect,
-                                            mtdetect, peakdetect)
+                                            mtdetect, peakdetect,
+                                            _peaks_search, _detrend)
+from visbrain.utils.sleep.edf import Edf
+from visbrain.utils.sleep.engine import (detect_channel, DetectionEngine,
+                                         FeatureCache)
 from visbrain.utils.sleep.event import (_events_duration, _events_removal,
                                         _events_distance_fill,
                                         _events_mean_freq, _events_amplitude,
-                                        _events_to_index, _index_to_events)
-from visbrain.utils.sleep.hypnoprocessing import (transient, sleepstats)
+                                        _events_proximity, _events_to_index,
+                                        _index_to_events,
+                                        _events_to_intervals,
+                                        _intervals_to_events,
+                                        _mask_to_intervals,
+                                        _intervals_to_mask, _intervals_merge,
+                                        _intervals_duration,
+                                        _intervals_amplitude,
+                                        _intervals_extrema, _intervals_mean)
+from visbrain.utils.sleep.hypnoprocessing import (transient, sleepstats,
+                                                  HypnoRuns)
+from visbrain.utils.sleep.navigation import time_to_index, WindowCache
+from visbrain.utils.sleep.preparation import (prepare_recording,
+                                              PreparedRecording)
+from visbrain.utils.sleep.pyramid import MinMaxPyramid
 from visbrain.utils.transform import (vprescale, vprecenter, vpnormalize,
                                       array_to_stt)
 
@@ -145,6 +167,62 @@ class TestColor(object):
         assert isinstance(r2[0], np.int64) and r2[1]
         assert r == r3
 
+###############################################################################
+###############################################################################
+#                                chunk.py
+###############################################################################
+###############################################################################
+
+
+class TestChunk(object):
+    """Test functions in chunk.py."""
+
+    @staticmethod
+    def _stream(x, chunk=1000):
+        """Get a function returning the chunks of x."""
+        return lambda: (x[start:stop] for start, stop, _, _ in
+                        _iter_chunks(len(x), chunk))
+
+    def test_iter_chunks(self):
+        """Test function _iter_chunks."""
+        chunks = list(_iter_chunks(25, 10, overlap=3))
+        assert chunks == [(0, 10, 0, 13), (10, 20, 7, 23), (20, 25, 17, 25)]
+
+    def test_running_stats(self):
+        """Test class _RunningStats."""
+        x = 1e6 + np.random.rand(10001)
+        stats = _RunningStats()
+        for k in self._stream(x)():
+            stats.update(k)
+        assert stats.n == x.size
+        assert np.allclose([stats.mean, stats.std], [x.mean(), x.std()])
+
+    def test_streaming_kth(self):
+        """Test function _streaming_kth."""
+        x = np.r_[np.random.randn(10000), np.zeros(10), np.full(10, -2.)]
+        ks = [0, 5000, 5001, x.size - 1]
+        for max_candidates in [10, 2 ** 20]:
+            kth = _streaming_kth(self._stream(x), ks,
+                                 max_candidates=max_candidates)
+            assert np.array_equal(kth, np.sort(x)[ks])
+
+    def test_stitch_intervals(self):
+        """Test function _stitch_intervals."""
+        mask = np.random.rand(10000) > .3
+        pieces = [_mask_to_intervals(mask[start:stop]) + start for start,
+                  stop, _, _ in _iter_chunks(mask.size, 100)]
+        assert np.array_equal(_stitch_intervals(pieces),
+                              _mask_to_intervals(mask))
+
+    def test_chunked_extrema(self):
+        """Test function _chunked_extrema."""
+        x = np.round(np.random.randn(10000), 1)
+        iv = _mask_to_intervals(np.random.rand(10000) > .1)
+        ext = _chunked_extrema(lambda start, stop: x[start:stop], x.size, iv,
+                               100)
+        for k, i in zip(ext, _intervals_extrema(x, iv)):
+            assert np.array_equal(k, i)
+
 ###############################################################################
 ###############################################################################
 #                                detection.py
@@ -225,6 +303,225 @@ class TestDetections(object):
         peakdetect(sf, data, get='min')
         peakdetect(sf, data, get='max')
         peakdetect(sf, data, get='minmax', threshold=.6)
+        # Closed-form detrending used for the threshold :
+        from scipy.signal import detrend
+        ref = detrend(data)
+        assert np.allclose(_detrend(data), ref - ref.mean())
+
+    @staticmethod
+    def _peakdetect_loop(index, y_axis, lookahead, delta):
+        """Reference (sample by sample) search of peakdetect."""
+        max_peaks, min_peaks, dump = [], [], []
+        mn, mx = np.inf, -np.inf
+        for i in index:
+            y = y_axis[i]
+            mx, mn = max(mx, y), min(mn, y)
+            if y < mx - delta and mx != np.inf:
+                if y_axis[i:i + lookahead].max() < mx:
+                    max_peaks.append(i)
+                    dump.append(True)
+                    mx = mn = np.inf
+                    if i + lookahead >= len(y_axis):
+                        break
+                    continue
+            if y > mn + delta and mn != -np.inf:
+                if y_axis[i:i + lookahead].min() > mn:
+                    min_peaks.append(i)
+                    dump.append(False)
+                    mn = mx = -np.inf
+                    if i + lookahead >= len(y_axis):
+                        break
+        return max_peaks, min_peaks, dump
+
+    def test_peaks_search(self):
+        """Test the vectorized peak search against the reference loop."""
+        rng = np.random.RandomState(0)
+        for k in range(200):
+            n = rng.randint(1, 1000)
+            y = [rng.randn(n), np.round(3 * rng.randn(n)),
+                 np.sin(np.arange(n) / rng.uniform(1, 20)),
+                 np.cumsum(rng.randn(n)).astype(np.float32)][k % 4]
+            lookahead = int(rng.choice([1, 2, 5, 20, 300]))
+            delta = float(rng.choice([0., .1, 1.]))
+            if k % 2:
+                index = np.arange(max(n - lookahead, 0))
+            else:
+                index = np.flatnonzero(np.abs(y) >= rng.uniform(0, 1.5))
+            ref = self._peakdetect_loop(index, y, lookahead, delta)
+            for n_steps in [1, 3, 16, 256]:
+                out = _peaks_search(index, y, lookahead, delta, n_steps)
+                assert out == ref
+
+    def test_chunked_detections(self):
+        """Test the chunked detections against the in-memory ones."""
+        data, sf = self._get_eeg_dataset(n=30000, amp=20.)
+        hypno = np.repeat([0, 2, 3, 4, 2], 6000)
+        for fcn, args in [(spindlesdetect, (sf, 2., hypno, True)),
+                          (remdetect, (sf, hypno, True, 1.)),
+                          (remdetect, (sf, hypno, False, 1.)),
+                          (slowwavedetect, (sf, .3)),
+                          (mtdetect, (sf, 1., hypno, False)),
+                          (kcdetect, (sf, .5, 1., hypno, True, 100, 2000,
+                                      10, 400))]:
+            ref = fcn(data, *args)
+            for chunk in [3000, 7777]:
+                out = fcn(data, *args, chunk=chunk)
+                assert np.array_equal(ref[0], out[0])
+                assert ref[1] == out[1] and np.isclose(ref[2], out[2])
+        with pytest.raises(ValueError):
+            spindlesdetect(data, sf, 2., hypno, True, method='hilbert',
+                           chunk=3000)
+
+###############################################################################
+###############################################################################
+#                                engine.py
+###############################################################################
+###############################################################################
+
+
+class TestDetectionEngine(object):
+    """Test functions in engine.py."""
+
+    @staticmethod
+    def _get_data(n_chan=4, n=2000, sf=128.):
+        """Get a multi-channel dataset."""
+        time = np.arange(n) / sf
+        data = np.sin(2 * np.pi * np.arange(1, n_chan + 1).reshape(-1, 1) *
+                      time.reshape(1, -1))
+        return data, sf, time
+
+    def test_detect_channel(self):
+        """Test function detect_channel."""
+        data, sf, time = self._get_data()
+        index, nb, _ = detect_channel('Peaks', data[0, :], sf, time=time,
+                                      lookahead=10, get='max')
+        ref = peakdetect(sf, data[0, :], time, lookahead=10, get='max')[0]
+        assert index.shape == (nb, 2)
+        assert np.array_equal(index[:, 0], ref)
+        with pytest.raises(ValueError):
+            detect_channel('Spindles', data[0, :], sf, threshold=2.)
+
+    @pytest.mark.parametrize('backend', ['thread', 'process'])
+    def test_engine(self, backend):
+        """Test the DetectionEngine."""
+        data, sf, time = self._get_data()
+        eng = DetectionEngine(sf, data, time=time, n_jobs=2, backend=backend)
+        eng.run('Peaks', range(4), lookahead=10, get='max')
+        res = {k[0]: k[1:] for k in eng.results()}
+        assert sorted(res.keys()) == [0, 1, 2, 3]
+        assert eng.progress == (4, 4) and not eng.running
+        for k in range(4):
+            index = detect_channel('Peaks', data[k, :], sf, time=time,
+                                   lookahead=10, get='max')[0]
+            assert np.array_equal(res[k][0], index)
+        # Failed channels :
+        eng.run('REM', [0], threshold=2.)
+        assert eng.wait(60.)
+        assert eng.poll()[0][1] is None
+        # Cancellation :
+        eng.run('Peaks', range(4), lookahead=10, get='max')
+        eng.cancel()
+        assert not eng.running and not eng.poll()
+
+    def test_feature_cache(self):
+        """Test the detections with cached feature traces."""
+        x = 20. * np.random.RandomState(0).randn(20000)
+        sf, hypno = 100., np.repeat([0, 2, 3, 4], 5000)
+        cache = FeatureCache()
+        for method, kw, new_kw in [
+                ('REM', dict(threshold=2., rem_only=True), dict(threshold=1.)),
+                ('Spindles', dict(threshold=2., nrem_only=True),
+                 dict(threshold=1., tmax=1500)),
+                ('Slow waves', dict(threshold=.3), dict(threshold=.2)),
+                ('K-complexes', dict(proba_thr=.5, amp_thr=1., tmin=100,
+                                     tmax=2000, kc_min_amp=10,
+                                     kc_max_amp=400, nrem_only=True),
+                 dict(proba_thr=.4)),
+                ('Muscle twitches', dict(threshold=2., rem_only=False),
+                 dict(threshold=1.))]:
+            n_cached = len(cache)
+            for kwargs in [kw, dict(kw, **new_kw)]:
+                ref = detect_channel(method, x, sf, hypno, **kwargs)
+                out = detect_channel(method, x, sf, hypno, cache=cache,
+                                     **kwargs)
+                assert np.array_equal(ref[0], out[0]) and ref[1:] == out[1:]
+            # Thresholds do not change the feature traces :
+            assert len(cache) == n_cached + 1
+        # Least recently used traces are dropped :
+        cache.max_bytes = cache.nbytes - 1
+        detect_channel('REM', x, sf, hypno, cache=cache, threshold=2.,
+                       rem_only=True, smoothing_ms=100)
+        assert cache.nbytes <= cache.max_bytes or len(cache) == 1
+        cache.clear()
+        assert not len(cache)
+
+###############################################################################
+###############################################################################
+#                                edf.py
+###############################################################################
+###############################################################################
+
+
+class TestEdf(object):
+    """Test the Edf class in edf.py."""
+
+    @staticmethod
+    def _write_edf(path, n_samples=(100, 100, 100, 10), n_records=12,
+                   bdf=False):
+        """Write a small EDF (or BDF) file with random data."""
+        n_chan = len(n_samples)
+        dig = 2 ** 23 if bdf else 2 ** 15
+
+        def _field(values, length):
+            return b''.join(str(k).ljust(length).encode() for k in values)
+
+        hdr = b'\xffBIOSEMI' if bdf else b'0       '
+        hdr += b'subject'.ljust(80) + b'recording'.ljust(80)
+        hdr += b'01.01.17' + b'22.30.00' + _field([256 * (n_chan + 1)], 8)
+        hdr += b' ' * 44 + _field([n_records], 8) + _field([1], 8)
+        hdr += _field([n_chan], 4)
+        hdr += _field(['Chan' + str(k) for k in range(n_chan)], 16)
+        hdr += b' ' * 80 * n_chan + _field(['uV'] * n_chan, 8)
+        hdr += _field([-200 - k for k in range(n_chan)], 8)
+        hdr += _field([200 + k for k in range(n_chan)], 8)
+        hdr += _field([-dig] * n_chan, 8) + _field([dig - 1] * n_chan, 8)
+        hdr += b' ' * 80 * n_chan + _field(n_samples, 8)
+        hdr += b' ' * 32 * n_chan
+        raw = np.random.randint(-dig, dig - 1, (n_records, sum(n_samples)))
+        with open(path, 'wb') as f:
+            f.write(hdr)
+            if bdf:  # 24-bit little-endian
+                f.write(raw.astype('<i4').view(np.uint8).reshape(
+                    -1, 4)[:, 0:3].tobytes())
+            else:
+                f.write(raw.astype('<i2').tobytes())
+        return raw
+
+    @pytest.mark.parametrize('bdf', [False, True])
+    def test_return_dat(self, tmpdir, bdf):
+        """Test method return_dat against a per-record decoding."""
+        path = str(tmpdir.join('test.bdf' if bdf else 'test.edf'))
+        raw = self._write_edf(path, bdf=bdf)
+        edf = Edf(path)
+        hdr = edf.hdr
+        for chan, begsam, endsam in [([0, 1, 2], 0, 1200),
+                                     (['Chan2', 'Chan0'], 150, 1077),
+                                     ([1], 99, 101), ([3], 5, 95)]:
+            dat = edf.return_dat(chan, begsam, endsam)
+            assert dat.dtype == np.float32
+            assert dat.shape == (len(chan), endsam - begsam)
+            for i, c in enumerate(edf._chan_index(chan)):
+                pos = sum(hdr['n_samples_per_record'][:c])
+                n_sam = hdr['n_samples_per_record'][c]
+                d = raw[:, pos:pos + n_sam].ravel()[begsam:endsam]
+                gain = ((hdr['physical_max'][c] - hdr['physical_min'][c]) /
+                        (hdr['digital_max'][c] - hdr['digital_min'][c]))
+                ref = (d - hdr['digital_min'][c]) * gain + \
+                    hdr['physical_min'][c]
+                assert np.allclose(dat[i, :], ref, rtol=1e-5, atol=1e-3)
+        # Channels with different sampling frequencies :
+        with pytest.raises(ValueError):
+            edf.return_dat([0, 3], 0, 10)
 
 ###############################################################################
 ###############################################################################
@@ -272,6 +569,69 @@ class TestEvent(object):
         data, idx_sup_thr, idx_start, idx_stop = self._get_data()
         _events_amplitude(data, idx_sup_thr, idx_start, idx_stop, 100.)
 
+    def test_events_proximity(self):
+        """Test function events_proximity."""
+        sf = 100.
+        data, _ = generate_eeg(sf=sf, n_pts=20000)
+        # Supra-threshold indices, used as "spindles" and "K-complexes" :
+        idx_spin = np.where(data >= data.mean() + 2. * data.std())[0]
+        idx_sup_thr = np.where(data <= data.mean() - 1. * data.std())[0]
+        _, _, idx_start, _ = _events_duration(idx_sup_thr, sf)
+        for step in [.5 * sf, .5 * 20 * sf, 0.]:
+            # Loop-based version :
+            spin_bool = np.array([], dtype=bool)
+            for j in idx_start:
+                st_spin = idx_sup_thr[j]
+                is_spin = np.isin(np.arange(st_spin - step, st_spin + step,
+                                            1), idx_spin, assume_unique=True)
+                spin_bool = np.append(spin_bool, any(is_spin))
+            is_close = _events_proximity(idx_spin, idx_sup_thr[idx_start],
+                                         step)
+            assert np.array_equal(is_close, spin_bool)
+        assert not _events_proximity([], [1, 2], 10.).any()
+
+    def test_intervals(self):
+        """Test conversions from / to intervals."""
+        index = self._get_index()
+        intervals = _events_to_intervals(index)
+        assert np.array_equal(intervals, [[0, 5], [7, 11], [14, 20]])
+        assert np.array_equal(_intervals_to_events(intervals), index)
+        mask = np.zeros((25,), dtype=bool)
+        mask[index] = True
+        assert np.array_equal(_mask_to_intervals(mask), intervals)
+        assert np.array_equal(_intervals_to_mask(intervals, 25), mask)
+        assert np.array_equal(_events_to_index(index), intervals - [0, 1])
+        assert np.array_equal(_index_to_events(intervals - [0, 1]), index)
+        assert not _mask_to_intervals(np.zeros((10,), dtype=bool)).size
+        assert not _intervals_to_events(np.zeros((0, 2), dtype=int)).size
+
+    def test_intervals_merge(self):
+        """Test function intervals_merge."""
+        intervals = _events_to_intervals(self._get_index())
+        # Distances between events are 30ms and 40ms :
+        merged = _intervals_merge(intervals, 30., 100.)
+        assert np.array_equal(merged, intervals)
+        merged = _intervals_merge(intervals, 40., 100.)
+        assert np.array_equal(merged, [[0, 11], [14, 20]])
+        assert np.array_equal(_intervals_to_events(merged),
+                              _events_distance_fill(self._get_index(), 40.,
+                                                    100.))
+        assert np.array_equal(_intervals_duration(merged, 100.), [110., 60.])
+        assert np.array_equal(_intervals_merge(intervals, 41., 100.),
+                              [[0, 20]])
+
+    def test_intervals_amplitude(self):
+        """Test functions intervals_amplitude and intervals_mean."""
+        x = np.random.rand(100)
+        intervals = np.array([[0, 10], [20, 21], [50, 100]])
+        amp, dist = _intervals_amplitude(x, intervals, 100.)
+        mean = _intervals_mean(x, intervals)
+        for k, (i, j) in enumerate(intervals):
+            assert math.isclose(amp[k], np.ptp(x[i:j]))
+            d = np.abs(np.argmax(x[i:j]) - np.argmin(x[i:j])) * 10.
+            assert math.isclose(dist[k], d)
+            assert math.isclose(mean[k], x[i:j].mean())
+
     def test_event_to_index(self):
         """Test function event_to_index."""
         _events_to_index(self._get_index())
@@ -324,6 +684,28 @@ class TestFiltering(object):
         for k in [None, 'amplitude', 'phase', 'power']:
             ndmorlet(x, sf, f, get=k)
 
+    def test_morlet_bank(self):
+        """Test morlet_bank function."""
+        x, _, sf = self._get_data(True)
+        x = np.c_[x, x[::-1]].T
+        freqs = [.5, 3., 40.]
+        # Reference : convolution with each wavelet :
+        ref = np.zeros((len(freqs),) + x.shape, dtype=complex)
+        for i, f in enumerate(freqs):
+            m = _morlet_wlt(sf, f)
+            sl = slice(int(np.ceil(len(m) / 2)) - 1, -int(np.floor(
+                len(m) / 2)) or None)
+            for c in range(x.shape[0]):
+                ref[i, c, :] = np.convolve(x[c, :], m)[sl]
+        for chunk in [100, 2 ** 16]:
+            xout = morlet_bank(x, sf, freqs, chunk=chunk)
+            assert xout.shape == ref.shape
+            np.testing.assert_allclose(xout, ref, atol=1e-9)
+        # Time along the first axis :
+        xout = morlet_bank(x.T, sf, freqs, get='power', axis=0, chunk=100)
+        np.testing.assert_allclose(xout, np.abs(ref.transpose(0, 2, 1)) ** 2,
+                                   atol=1e-9)
+
     def test_morlet_power(self):
         """Test morlet_power function."""
         x, _, sf = self._get_data(True)
@@ -336,6 +718,14 @@ class TestFiltering(object):
         x, _, sf = self._get_data(True)
         f = [5, 10., 15]
         assert math.isclose(welch_power(x, f, sf, norm=True).sum(0).max(), 1.)
+        # Epoch-level power of several signals at once :
+        xs = np.random.rand(3, 2 * int(sf) * 10 + 7)
+        xpow = welch_power(xs, f, sf, oversample=False)
+        assert xpow.shape == (3, 2, 2)
+        for k in range(3):
+            x_k = welch_power(xs[k, :], f, sf)
+            assert x_k.shape == (2, xs.shape[1])
+            assert np.allclose(x_k[:, ::int(sf) * 10][:, :2], xpow[k, ...])
 
     def test_prepare_data(self):
         """Test class PrepareData."""
@@ -721,6 +1111,16 @@ class TestPhysio(object):
         bool_vec = find_non_eeg(['cz', 'eog', 'emg'])
         assert np.array_equal(bool_vec, (False, True, True))
 
+    def test_pick_channels(self):
+        """Test function pick_channels."""
+        chans = ['Cz', 'C3', 'Fz', 'EOG1', 'EMG']
+        assert np.array_equal(pick_channels(chans), np.arange(5))
+        assert np.array_equal(pick_channels(chans, 'eeg'), [0, 1, 2])
+        assert np.array_equal(pick_channels(chans, ['c*', 4]), [0, 1, 4])
+        assert np.array_equal(pick_channels(chans, 'Fz'), [2])
+        with pytest.raises(ValueError):
+            pick_channels(chans, ['Oz'])
+
     def test_rereferencing(self):
         """Test function rereferencing."""
         data, channels, ignore = self._generate_eeg_dataset('eeg')
@@ -860,6 +1260,19 @@ class TestSigproc(object):
         for w in window:
             x_ns = smoothing(x_n, window=w)
             assert len(x_ns) == len(x_n)
+        # Test against the direct convolution and along an axis :
+        x_2d = np.random.rand(3, 1000)
+        for w, n_window in product(window, [5, 301]):
+            ref = np.r_[2 * x_2d[0, 0] - x_2d[0, n_window:1:-1], x_2d[0, :],
+                        2 * x_2d[0, -1] - x_2d[0, -1:-n_window:-1]]
+            win = np.ones((n_window,)) if w == 'flat' else getattr(np, w)(
+                n_window)
+            ref = np.convolve(win / win.sum(), ref, mode='same')
+            ref = ref[n_window - 1:-n_window + 1]
+            assert np.allclose(smoothing(x_2d[0, :], n_window, w), ref)
+            x_s = smoothing(x_2d, n_window, w)
+            assert np.allclose(x_s[0, :], ref)
+            assert np.allclose(smoothing(x_2d.T, n_window, w, axis=0), x_s.T)
 
     def test_smooth_3d(self):
         """Test function smooth_3d."""
@@ -893,6 +1306,197 @@ class TestHypnoprocessing(object):
         """Test function sleepstats."""
         hypno = np.random.randint(-1, 3, (2000,))
         sleepstats(hypno, 100.)
+        hypno = np.repeat([0, 0, 1, 2, 0, 2, 3, 4, 0], 300)
+        stats = sleepstats(HypnoRuns.from_array(hypno), 10.)
+        assert stats['TIB'] == 4.5 and stats['TDT'] == 239 / 60.
+        assert stats['W'] == 2. and stats['LatN1'] == 1.
+        assert stats['WASO'] == .5 and stats['TST'] == 149 / 60.
+
+    def test_hypno_runs(self):
+        """Test function hypno_runs."""
+        hypno = np.array([0, 0, 1, 1, 1, 4, 4, 2, 2, 2], dtype=np.float32)
+        runs = HypnoRuns.from_array(hypno)
+        assert np.array_equal(runs.onset, [0, 2, 5, 7])
+        assert np.array_equal(runs.duration, [2, 3, 2, 3])
+        assert np.array_equal(runs.stage, [0, 1, 4, 2])
+        assert np.array_equal(np.asarray(runs), hypno) and len(runs) == 10
+        assert runs[3] == 1 and runs[-1] == 2
+        assert np.array_equal(runs[1::3], hypno[1::3])
+        # Stage edition :
+        runs.set_stage(1, 6, 2)
+        hypno[1:6] = 2
+        assert np.array_equal(runs.to_array(), hypno)
+        assert np.array_equal(runs.stage, [0, 2, 4, 2])
+        assert np.array_equal(runs.decimate(3).to_array(), hypno[::3])
+        with pytest.raises(ValueError):
+            runs.decimate(1. / 30.)
+        # The cached vector is read-only :
+        with pytest.raises(ValueError):
+            runs.to_array()[0] = 4
+        hyp = np.array(runs)
+        hyp[0] = 4
+        assert runs[0] == 0
+        # Epochs :
+        runs = HypnoRuns.from_epochs(np.array([0, 1, 2]), 10, step=2)
+        assert np.array_equal(runs.to_array(), [0, 0, 1, 2, 2])
+
+###############################################################################
+###############################################################################
+#                                pyramid.py
+###############################################################################
+###############################################################################
+
+
+class TestPyramid(object):
+    """Test functions in pyramid.py."""
+
+    @staticmethod
+    def _get_data():
+        return np.random.rand(3, 10003).astype(np.float32)
+
+    def test_pyramid_levels(self):
+        """Test function pyramid_levels."""
+        data = self._get_data()
+        pyr = MinMaxPyramid(data, factor=4, chunk=1000)
+        assert pyr.ready and len(pyr) == 7
+        mn, mx = pyr.levels[1]
+        assert np.array_equal(mn[:, 0], data[:, 0:16].min(1))
+        assert np.array_equal(mx[:, -1], data[:, 16 * 625:].max(1))
+        # Background building :
+        pyr_bck = MinMaxPyramid(data, factor=4, chunk=1000, background=True)
+        assert pyr_bck.wait(10.)
+        for (mn, mx), (mn_b, mx_b) in zip(pyr.levels, pyr_bck.levels):
+            assert np.array_equal(mn, mn_b) and np.array_equal(mx, mx_b)
+
+    def test_pyramid_envelope(self):
+        """Test function pyramid_envelope."""
+        data = self._get_data()
+        pyr = MinMaxPyramid(data, chunk=1000)
+        chan = np.array([0, 2])
+        # Short windows use the raw data :
+        assert pyr.envelope(chan, 10, 100, 200) == (None, None)
+        for start, stop, n_max in [(0, 10003, 500), (17, 9000, 100),
+                                   (5, 70, 10)]:
+            index, env = pyr.envelope(chan, start, stop, n_max)
+            assert len(index) <= n_max
+            assert env.shape == (len(chan), len(index))
+            edges = np.r_[index[::2], stop]
+            for k in range(len(edges) - 1):
+                dat = data[chan, edges[k]:edges[k + 1]]
+                assert np.array_equal(env[:, 2 * k], dat.min(1))
+                assert np.array_equal(env[:, 2 * k + 1], dat.max(1))
+
+###############################################################################
+###############################################################################
+#                                navigation.py
+###############################################################################
+###############################################################################
+
+
+class TestNavigation(object):
+    """Test functions in navigation.py."""
+
+    def test_time_to_index(self):
+        """Test function time_to_index."""
+        time = np.arange(1003) / 100. + 2.
+        for x in [-1., 2., 2.004, 2.006, 5.5, 12.02, 20.]:
+            assert time_to_index(x, time) == np.abs(time - x).argmin()
+        x = np.array([0., 3.333, 30.])
+        assert np.array_equal(time_to_index(x, time), [0, 133, 1002])
+
+    def test_window_cache(self):
+        """Test function window_cache."""
+        cache = WindowCache(lambda x: x ** 2, max_size=2)
+        assert cache.get('a', 2) == 4 and cache.misses == 1
+        assert cache.get('a', 2) == 4 and cache.hits == 1
+        cache.get('b', 3)
+        cache.get('c', 4)
+        assert ('a' not in cache) and len(cache) == 2
+        # Prefetching (the worker is blocked on 'd') :
+        gate, calls = threading.Event(), []
+
+        def fcn(x):
+            calls.append(x)
+            if x == 5:
+                gate.wait(10.)
+            return x ** 2
+        cache = WindowCache(fcn, max_size=4)
+        cache.prefetch([('d', (5,)), ('e', (6,))])
+        assert cache.get('e', 6) == 36
+        gate.set()
+        assert cache.get('d', 5) == 25
+        assert cache.wait(10.) and not cache.busy
+        assert sorted(calls) == [5, 6]
+        cache.prefetch([('f', (7,))])
+        assert cache.wait(10.) and ('f' in cache)
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_spectrogram_cache(self):
+        """Test the cache of spectral estimates of the Sleep spectrogram."""
+        from vispy.scene.cameras import PanZoomCamera
+        from visbrain.sleep.visuals.visuals import Spectrogram
+        sf, data = 100., np.random.rand(2, 60000).astype(np.float32)
+        time = np.arange(data.shape[1]) / sf
+        spec = Spectrogram(PanZoomCamera())
+        spec.set_data(sf, data, time, nfft=4., chan=0)
+        assert (spec.powers.misses, spec.powers.hits) == (1, 0)
+        # Display-only changes don't recompute the spectral estimate :
+        spec.set_data(sf, data, time, nfft=4., chan=0, cmap='viridis')
+        spec.set_data(sf, data, time, nfft=4., chan=0, contrast=.8)
+        spec.set_data(sf, data, time, nfft=4., chan=0, fstart=2., fend=10.)
+        assert (spec.powers.misses, spec.powers.hits) == (1, 3)
+        assert 1.5 < spec.freq.min() and spec.freq.max() < 10.5
+        # Spectral settings do :
+        spec.set_data(sf, data, time, nfft=2., chan=0)
+        spec.set_data(sf, data, time, nfft=2., chan=1)
+        assert (spec.powers.misses, spec.powers.hits) == (3, 3)
+
+###############################################################################
+###############################################################################
+#                                preparation.py
+###############################################################################
+###############################################################################
+
+
+class TestPreparation(object):
+    """Test functions in preparation.py."""
+
+    @staticmethod
+    def _get_data():
+        data = np.random.rand(3, 20000) + np.linspace(0., 2., 20000)
+        return data.astype(np.float32)
+
+    def test_prepare_recording(self):
+        """Test function prepare_recording."""
+        x = self._get_data()[0, :]
+        for kw in [{'demean': True}, {'detrend': True},
+                   {'filt': True, 'way': 'lfilter', 'demean': True},
+                   {'filt': True, 'way': 'filtfilt'},
+                   {'filt': True, 'dispas': 'amplitude', 'detrend': True}]:
+            prep = PrepareData(axis=0, **kw)
+            ref = prep._prepare_data(100., x.astype(float), None)
+            xprep = prepare_recording(100., x, prep, chunk=3000)
+            assert xprep.dtype == np.float32
+            assert np.allclose(xprep, ref, atol=1e-5)
+
+    def test_prepared_recording(self):
+        """Test function prepared_recording."""
+        data = self._get_data()
+        pr = PreparedRecording(100., data, chunk=3000)
+        prep = PrepareData(axis=1, filt=True, way='lfilter')
+        assert pr.get(prep, [0, 2], 0, 10) is None
+        assert not pr.request(prep, [0, 2])
+        assert pr.wait(10.) and pr.request(prep, [0, 2])
+        ref = prep._prepare_data(100., data[[0, 2], :].astype(float), None)
+        assert np.allclose(pr.get(prep, [0, 2], 100, 300), ref[:, 100:300],
+                           atol=1e-5)
+        # Changing the settings only prepares the missing channels :
+        prep.fstart = 10.
+        assert not pr.request(prep, [0])
+        assert pr.wait(10.) and len(pr) == 3
+        pr.set_data(data)
+        assert len(pr) == 0
 
 ###############################################################################
 ###############################################################################
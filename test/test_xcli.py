@@ -7,7 +7,8 @@ from PyQt5 import QtWidgets
 from click.testing import CliRunner
 
 from visbrain.io import download_file
-from visbrain.cli import cli_fig_hyp, cli_sleep_stats, cli_sleep
+from visbrain.cli import (cli_fig_hyp, cli_sleep_stats, cli_sleep, cli_index,
+                          cli_detect)
 
 # Create a tmp/ directory :
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -78,6 +79,31 @@ class TestCli(object):
         app.quit()
         del app
 
+    def test_cli_index(self):
+        """Test function cli_index."""
+        runner = CliRunner()
+        index_file = self._path_to_tmp('cli_index.json')
+        r1 = runner.invoke(cli_index, [path_to_tmp, '-i', index_file,
+                                       '--n_workers', 2, '--channels', '*'])
+        assert r1.exit_code == 0
+        assert 'files found' in r1.output
+
+    def test_cli_detect(self):
+        """Test function cli_detect."""
+        runner = CliRunner()
+        data = self._path_to_tmp('excerpt2.edf')
+        hypno = self._path_to_tmp('Hypnogram_excerpt2.txt')
+        out = self._path_to_tmp('detect')
+        args = [data, '-h', hypno, '-o', out, '-m', 'spindles,sw',
+                '--n_jobs', 2]
+        r1 = runner.invoke(cli_detect, args)
+        assert r1.exit_code == 0
+        assert '1 files processed' in r1.output
+        assert os.path.isfile(os.path.join(out, 'excerpt2_summary.csv'))
+        # Already processed :
+        r2 = runner.invoke(cli_detect, args)
+        assert '0 files processed' in r2.output
+
     def test_delete_tmp_folder(self):
         """Delete tmp/folder."""
         shutil.rmtree(path_to_tmp)
@@ -6,7 +6,8 @@ import numpy as np
 
 from visbrain import Sleep
 from visbrain.io import (write_fig_hyp, read_hypno, oversample_hypno,
-                         write_csv)
+                         write_csv, SleepIndex, BatchDetection,
+                         load_config_json)
 from visbrain.utils import sleepstats
 
 ###############################################################################
@@ -36,10 +37,16 @@ from visbrain.utils import sleepstats
               type=bool)
 @click.option('--preload', default=True,
               help='Preload data in memory. Default is True', type=bool)
+@click.option('--use_cache', default=False,
+              help='Use the on-disk cache of decoded data. Default is False',
+              type=bool)
+@click.option('--picks', default=None,
+              help="Comma separated list of channels to load (names, glob "
+              "patterns or 'eeg'). Default is all channels.")
 @click.option('--show', default=True,
               help='Display GUI. Default is True', type=bool)
 def cli_sleep(data, hypno, config_file, annotations, downsample, use_mne,
-              preload, show):
+              preload, use_cache, picks, show):
     """Open the graphical user interface of Sleep."""
     # File conversion :
     if data is not None:
@@ -50,12 +57,118 @@ def cli_sleep(data, hypno, config_file, annotations, downsample, use_mne,
         config_file = click.format_filename(config_file)
     if annotations is not None:
         annotations = click.format_filename(annotations)
+    if picks is not None:
+        picks = [k.strip() for k in picks.split(',')]
+        picks = picks[0] if picks == ['eeg'] else picks
     s = Sleep(data=data, hypno=hypno, downsample=downsample,
               use_mne=use_mne, preload=preload, config_file=config_file,
-              annotations=annotations)
+              annotations=annotations, use_cache=use_cache, picks=picks)
     if show:
         s.show()
 
+# -------------------- SLEEP INDEX --------------------
+
+
+@click.command()
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('-i', '--index_file', default=None,
+              help='Path to the json index file. Default is in the '
+              'visbrain_data folder.', type=click.Path(exists=False))
+@click.option('--n_workers', default=8,
+              help='Number of threads used to read headers. Default is 8.',
+              type=int)
+@click.option('--channels', default=None,
+              help='Comma separated list of channels (names or glob '
+              'patterns) that the files must contain.')
+@click.option('--min_duration', default=None,
+              help='Minimum duration of the files (in hours).', type=float)
+def cli_index(folder, index_file, n_workers, channels, min_duration):
+    """Index the sleep files of a folder and list the matching files."""
+    folder = click.format_filename(folder)
+    if index_file is not None:
+        index_file = click.format_filename(index_file)
+    if channels is not None:
+        channels = [k.strip() for k in channels.split(',')]
+    if min_duration is not None:
+        min_duration *= 3600.
+    index = SleepIndex(index_file)
+    index.scan(folder, n_workers=n_workers)
+    found = index.search(channels=channels, min_duration=min_duration,
+                         pattern=os.path.join(os.path.abspath(folder), '*'))
+    for hdr in found:
+        print('%s (%s, %i channels, %.1f Hz, %.2f hours, start %s)' % (
+            hdr['path'], hdr['format'], len(hdr['channels']), hdr['sf'],
+            hdr['duration'] / 3600., hdr['start_time']))
+    print('%i files found' % len(found))
+
+# -------------------- BATCH DETECTIONS --------------------
+
+
+@click.command()
+@click.argument('files', nargs=-1, required=True)
+@click.option('-h', '--hypno', default=None, multiple=True,
+              help="Hypnogram files (one per recording, in the same order) "
+              "or a single template such as '{dir}/{name}_hypno.txt' where "
+              "{dir} is the folder of the recording and {name} its name "
+              "without extension. Default is no hypnogram.")
+@click.option('-o', '--outdir', required=True,
+              help='Output folder.', type=click.Path(file_okay=False))
+@click.option('-m', '--methods', default='spindles,sw',
+              help='Comma separated list of detections (rem, spindles, sw, '
+              'kc, mt, peaks). Default is spindles,sw.')
+@click.option('-c', '--config_file', default=None,
+              help="JSON file with the settings of the detections (e.g. "
+              "{\"spindles\": {\"threshold\": 3}}).",
+              type=click.Path(exists=True))
+@click.option('--picks', default=None,
+              help="Comma separated list of channels to process (names, glob "
+              "patterns or 'eeg'). Default is all channels.")
+@click.option('--downsample', default=100.,
+              help='Down-sampling frequency. Default is 100.')
+@click.option('--n_jobs', default=None, type=int,
+              help='Number of processes. Default is the number of '
+              'processors.')
+@click.option('--max_memory', default=None, type=float,
+              help='Memory budget of the running detections (in Gb). Default '
+              'is half of the available memory.')
+@click.option('--fmt', default='csv', type=click.Choice(['csv', 'parquet']),
+              help='Format of the tables. Default is csv.')
+@click.option('--overwrite', default=False, type=bool,
+              help='Process again the files already processed. Default is '
+              'False.')
+def cli_detect(files, hypno, outdir, methods, config_file, picks, downsample,
+               n_jobs, max_memory, fmt, overwrite):
+    """Run sleep detections over many recordings (paths or glob patterns).
+
+    For each recording, the events and a summary (number, density and mean
+    duration of the events of each channel and detection) are saved in the
+    output folder. Recordings already processed with the same settings are
+    skipped, so an interrupted batch can be resumed by running the same
+    command again.
+    """
+    files = [click.format_filename(k) for k in files]
+    if not hypno:
+        hypno = None
+    elif (len(hypno) == 1) and ('{' in hypno[0]):
+        hypno = hypno[0]
+    else:
+        hypno = [click.format_filename(k) for k in hypno]
+    settings = None
+    if config_file is not None:
+        settings = load_config_json(click.format_filename(config_file))
+    if picks is not None:
+        picks = [k.strip() for k in picks.split(',')]
+        picks = picks[0] if picks == ['eeg'] else picks
+    if max_memory is not None:
+        max_memory *= 2. ** 30
+    batch = BatchDetection(outdir, [k.strip() for k in methods.split(',')],
+                           settings=settings, downsample=downsample,
+                           picks=picks, n_jobs=n_jobs, max_memory=max_memory,
+                           fmt=fmt, overwrite=overwrite)
+    n_processed = batch.run(files, hypno)
+    print('%i files processed, results saved in %s' % (n_processed,
+                                                       batch.outdir))
+
 # -------------------- HYPNOGRAM TO FIGURE --------------------
 
 
@@ -2,10 +2,14 @@
 from .dependencies import *
 from .dialog import *
 from .download import *
+from .lazy_sleep import *
 from .mneio import *
 from .read_annotations import *
 from .read_data import *
 from .read_sleep import *
+from .sleep_cache import *
+from .sleep_index import *
+from .batch_detection import *
 from .rw_utils import *
 from .rw_hypno import *
 from .rw_config import *
@@ -0,0 +1,404 @@
+"""Headless sleep detections over many recordings.
+
+This file contains :
+- DETECTION_SETTINGS : default settings of the detections
+- BatchDetection : run detections over the channels of many files, using a
+  pool of processes
+"""
+import os
+import glob
+import json
+import shutil
+import hashlib
+import logging
+import datetime
+from concurrent.futures import (ProcessPoolExecutor, wait, FIRST_COMPLETED)
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from .dependencies import is_pandas_installed
+from .read_sleep import sleep_switch
+from .rw_hypno import read_hypno
+from .rw_utils import get_file_ext
+from .sleep_index import read_sleep_header, _is_sleep_file
+from .write_data import write_csv
+from ..utils import HypnoRuns, get_dsf, pick_channels
+from ..utils.sleep.engine import detect_channel
+
+logger = logging.getLogger('visbrain')
+
+__all__ = ['DETECTION_SETTINGS', 'BatchDetection']
+
+# Detection methods (see detect_channel) :
+DETECTION_METHODS = {'rem': 'REM', 'spindles': 'Spindles', 'sw': 'Slow waves',
+                     'kc': 'K-complexes', 'mt': 'Muscle twitches',
+                     'peaks': 'Peaks'}
+# Default settings of the detections (same as the Sleep interface). The
+# lookahead of the peaks detection is in seconds :
+DETECTION_SETTINGS = {
+    'rem': dict(threshold=3., rem_only=False),
+    'spindles': dict(threshold=2., fmin=12., fmax=14., tmin=500, tmax=2000,
+                     nrem_only=False),
+    'sw': dict(threshold=.75),
+    'kc': dict(proba_thr=.7, amp_thr=1., tmin=400., tmax=4000.,
+               kc_min_amp=100., kc_max_amp=600., nrem_only=False),
+    'mt': dict(threshold=3., rem_only=False),
+    'peaks': dict(lookahead=1., delta=1., threshold='auto', get='max')}
+# Approximative peak memory of a detection, in number of float64 copies of
+# the channel :
+MEMORY_FACTOR = 32
+STAGES = ['Wake', 'N1', 'N2', 'N3', 'REM', 'ART']
+EVENTS_COLUMNS = ['channel', 'method', 'start_s', 'end_s', 'duration_ms',
+                  'stage']
+SUMMARY_COLUMNS = ['channel', 'method', 'number', 'density_per_min',
+                   'mean_duration_ms', 'status']
+
+
+def _available_memory():
+    """Get the available memory in bytes (4Gb if unknown)."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 2 ** 32
+
+
+def _find_files(files):
+    """Get the sleep files from a list of paths and / or glob patterns."""
+    found = []
+    for k in [files] if isinstance(files, str) else files:
+        paths = [k] if os.path.isfile(k) else sorted(glob.glob(
+            k, recursive=True))
+        if not paths:
+            logger.warning("No file found for %s" % k)
+        found += [os.path.abspath(p) for p in paths if _is_sleep_file(p)]
+    # Remove duplicates (keep the order) :
+    return list(dict.fromkeys(found))
+
+
+def _match_hypnos(files, hypnos):
+    """Get the hypnogram of each file.
+
+    hypnos is either None, a list of paths (one per file) or a template such
+    as '{dir}/{name}_hypno.txt' ({dir} is the folder of the file and {name}
+    its name without extension).
+    """
+    if hypnos is None:
+        return [None] * len(files)
+    if isinstance(hypnos, str):
+        out = []
+        for path in files:
+            name = os.path.splitext(os.path.basename(path))[0]
+            hyp = hypnos.format(dir=os.path.dirname(path), name=name)
+            if not os.path.isfile(hyp):
+                logger.warning("No hypnogram found for %s (%s)" % (path, hyp))
+                hyp = None
+            out.append(hyp)
+        return out
+    if len(hypnos) != len(files):
+        raise ValueError("%i hypnograms for %i files" % (
+            len(hypnos), len(files)))
+    return [None if k is None else os.path.abspath(k) for k in hypnos]
+
+
+def _output_stems(files):
+    """Get the output names, relatively to the common folder of the files."""
+    if not files:
+        return []
+    root = os.path.commonpath([os.path.dirname(k) for k in files])
+    return [os.path.splitext(os.path.relpath(k, root))[0] for k in files]
+
+
+def _file_stat(path):
+    """Get the (size, modification time) of a file (None if no file)."""
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _write_table(path, columns, rows, fmt):
+    """Write a table as a csv or parquet file (atomic)."""
+    tmp = path + '.tmp%i' % os.getpid()
+    if fmt == 'csv':
+        write_csv(tmp, [columns] + rows)
+    else:
+        import pandas as pd
+        pd.DataFrame(rows, columns=columns).to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def _save_partial(partial, sf, dsf, results):
+    """Save the results of a channel (atomic)."""
+    tmp = partial + '.tmp%i.npz' % os.getpid()
+    np.savez(tmp, sf=sf, dsf=dsf, **results)
+    os.replace(tmp, partial)
+
+
+def _detect_channel(path, chan, hypno, methods, downsample, partial):
+    """Run the detections of a channel and save them (run in the pool).
+
+    Results are saved in the partial file (npz) : for the i-th method, the
+    (start, end) indices of the events (index{i}), their sleep stage
+    (stage{i}), the number of events (number{i}), the density (density{i})
+    and the error message (error{i}, empty if the detection succeeded).
+    """
+    file, ext = get_file_ext(path)
+    sf, downsample, dsf, data, _, n, _, _ = sleep_switch(
+        file, ext, downsample, preload=False, picks=[chan])
+    sf_down = float(downsample) if downsample is not None else float(sf)
+    x = np.asarray(data[0, :])
+    if hypno is not None:
+        hypno, _ = read_hypno(hypno)
+        hypno = HypnoRuns.from_epochs(hypno, n, dsf).to_array()
+    else:
+        hypno = np.zeros((len(x),), dtype=np.float32)
+    time = np.arange(len(x)) / sf_down
+    out = {}
+    for i, (method, kwargs) in enumerate(methods):
+        kwargs = kwargs.copy()
+        if method == 'Peaks':
+            kwargs['lookahead'] = int(kwargs['lookahead'] * sf_down)
+        index, number, density = np.zeros((0, 2), dtype=int), 0, 0.
+        error = ''
+        try:
+            index, number, density = detect_channel(method, x.copy(), sf_down,
+                                                    hypno, time, **kwargs)
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+        out.update({'index%i' % i: index, 'number%i' % i: number,
+                    'density%i' % i: density, 'error%i' % i: error,
+                    'stage%i' % i: hypno[index[:, 0]].astype(int)})
+    _save_partial(partial, sf, dsf, out)
+    return partial
+
+
+class BatchDetection(object):
+    """Run sleep detections over the channels of many recordings.
+
+    Files and channels are dispatched to a pool of processes. The number of
+    channels processed at once is limited by a memory budget. Each channel
+    is saved as soon as it is processed, so that an interrupted batch
+    resumes where it stopped. Once all of the channels of a file are
+    processed, two tables are written in the output folder :
+
+        * {name}_events.{fmt} : one row per event, with the channel, the
+          method, the start and end (in seconds since the beginning of the
+          recording), the duration (in ms) and the sleep stage.
+        * {name}_summary.{fmt} : one row per channel and method, with the
+          number of events, the density (events per minute), the mean
+          duration (in ms) and the status of the detection.
+
+    and {name}_done.json which marks the file as processed. Files already
+    processed with the same settings are skipped.
+
+    Parameters
+    ----------
+    outdir : string
+        Output folder.
+    methods : list | ['spindles', 'sw']
+        Detections to run, among 'rem', 'spindles', 'sw' (slow waves), 'kc'
+        (K-complexes), 'mt' (muscle twitches) and 'peaks'.
+    settings : dict | None
+        Settings of the detections, e.g. {'spindles': {'threshold': 3.}}.
+        Missing settings are taken from DETECTION_SETTINGS.
+    downsample : float | 100.
+        Down-sampling frequency of the data before the detections.
+    picks : string, list | None
+        Channels to process (see visbrain.utils.pick_channels).
+    n_jobs : int | None
+        Number of processes. By default, the number of processors.
+    max_memory : float | None
+        Memory budget (in bytes) of the running detections. By default, half
+        of the available memory.
+    fmt : {'csv', 'parquet'}
+        Format of the tables. The parquet format requires pandas.
+    overwrite : bool | False
+        Run again the files that are already processed.
+    """
+
+    def __init__(self, outdir, methods=('spindles', 'sw'), settings=None,
+                 downsample=100., picks=None, n_jobs=None, max_memory=None,
+                 fmt='csv', overwrite=False):
+        """Init."""
+        methods = [methods] if isinstance(methods, str) else list(methods)
+        settings = {} if settings is None else settings
+        for k in methods + list(settings):
+            if k not in DETECTION_METHODS:
+                raise ValueError("Unknown detection %s. Use %s" % (
+                    k, ', '.join(DETECTION_METHODS)))
+        if fmt not in ('csv', 'parquet'):
+            raise ValueError("fmt should either be 'csv' or 'parquet'")
+        if (fmt == 'parquet') and not is_pandas_installed():
+            raise ImportError("In order to work properly, pandas package "
+                              "should be installed using *pip install pandas*")
+        self.outdir = os.path.abspath(outdir)
+        self.methods = methods
+        self.settings = {k: dict(DETECTION_SETTINGS[k], **settings.get(k, {}))
+                         for k in methods}
+        self.downsample = downsample
+        self.picks = picks
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.max_memory = max_memory or _available_memory() / 2.
+        self.fmt = fmt
+        self.overwrite = overwrite
+
+    def _paths(self, stem, key):
+        """Get the output paths of a file."""
+        base = os.path.join(self.outdir, stem)
+        return {'events': base + '_events.' + self.fmt,
+                'summary': base + '_summary.' + self.fmt,
+                'done': base + '_done.json',
+                'partial': '%s.%s.partial' % (base, key[:16])}
+
+    def _prepare(self, path, hypno, stem):
+        """Get the job of a file (None if the file is already processed)."""
+        hdr = read_sleep_header(path)
+        idx = pick_channels(hdr['channels'], self.picks)
+        dsf, _ = get_dsf(self.downsample, hdr['sf'])
+        key = json.dumps([self.methods, self.settings, self.downsample,
+                          [int(k) for k in idx], _file_stat(path), hypno,
+                          _file_stat(hypno)], sort_keys=True)
+        key = hashlib.sha1(key.encode()).hexdigest()
+        paths = self._paths(stem, key)
+        if not self.overwrite and os.path.isfile(paths['done']):
+            with open(paths['done']) as f:
+                if json.load(f)['key'] == key:
+                    return None
+        # Remove the outputs and the partial results of other settings :
+        for k in [paths['events'], paths['summary'], paths['done']]:
+            if os.path.isfile(k):
+                os.remove(k)
+        base = os.path.join(self.outdir, stem)
+        for k in glob.glob(glob.escape(base) + '.*.partial'):
+            if k != paths['partial']:
+                shutil.rmtree(k, ignore_errors=True)
+        os.makedirs(paths['partial'], exist_ok=True)
+        partials = [os.path.join(paths['partial'], 'chan%04i.npz' % k)
+                    for k in idx]
+        return {'path': path, 'hypno': hypno, 'key': key, 'paths': paths,
+                'chans': [int(k) for k in idx],
+                'names': [hdr['channels'][k] for k in idx],
+                'partials': partials,
+                'n_left': sum([not os.path.isfile(k) for k in partials]),
+                'memory': MEMORY_FACTOR * 8. * np.ceil(hdr['n'] / dsf)}
+
+    def _finish(self, job):
+        """Write the tables of a processed file."""
+        events, summary = [], []
+        names = [DETECTION_METHODS[k] for k in self.methods]
+        for name, partial in zip(job['names'], job['partials']):
+            res = np.load(partial)
+            to_s = float(res['dsf']) / float(res['sf'])
+            for i, method in enumerate(self.methods):
+                index = res['index%i' % i]
+                start, end = index[:, 0] * to_s, index[:, 1] * to_s
+                duration = (end - start) * 1000.
+                stages = [STAGES[k] if job['hypno'] is not None else '' for
+                          k in res['stage%i' % i]]
+                events += [[name, names[i], s, e, d, st] for s, e, d, st in
+                           zip(start, end, duration, stages)]
+                error = str(res['error%i' % i])
+                summary.append([name, names[i], int(res['number%i' % i]),
+                                float(res['density%i' % i]),
+                                duration.mean() if len(index) else np.nan,
+                                error if error else 'ok'])
+        paths = job['paths']
+        _write_table(paths['events'], EVENTS_COLUMNS, events, self.fmt)
+        _write_table(paths['summary'], SUMMARY_COLUMNS, summary, self.fmt)
+        done = {'key': job['key'], 'path': job['path'],
+                'hypno': job['hypno'], 'methods': self.methods,
+                'settings': self.settings, 'downsample': self.downsample,
+                'channels': job['names'], 'n_events': len(events),
+                'date': datetime.datetime.now().isoformat()}
+        tmp = paths['done'] + '.tmp%i' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(done, f)
+        os.replace(tmp, paths['done'])
+        shutil.rmtree(paths['partial'], ignore_errors=True)
+        logger.info("Detections of %s saved to %s" % (job['path'],
+                                                      paths['summary']))
+
+    def run(self, files, hypnos=None):
+        """Run the detections.
+
+        Parameters
+        ----------
+        files : string, list
+            Paths to the files and / or glob patterns (e.g.
+            'cohort/**/*.edf').
+        hypnos : list, string | None
+            Paths to the hypnograms (one per file, in the same order) or a
+            template such as '{dir}/{name}_hypno.txt' where {dir} is the
+            folder of the file and {name} its name without extension. Without
+            hypnogram, every time point is considered as wake.
+
+        Returns
+        -------
+        n_processed : int
+            Number of processed files (files already processed are not
+            counted).
+        """
+        files = _find_files(files)
+        hypnos = _match_hypnos(files, hypnos)
+        jobs = []
+        for path, hypno, stem in zip(files, hypnos, _output_stems(files)):
+            try:
+                job = self._prepare(path, hypno, stem)
+            except Exception as e:
+                logger.warning("%s can not be processed (%s)" % (path, e))
+                continue
+            if job is not None:
+                jobs.append(job)
+        logger.info("%i files to process (%i already processed)" % (
+            len(jobs), len(files) - len(jobs)))
+
+        settings = [(DETECTION_METHODS[k], self.settings[k]) for k in
+                    self.methods]
+        running, memory = {}, [0.]
+
+        def _collect(futures):
+            for future in futures:
+                job, chan, partial = running.pop(future)
+                memory[0] -= job['memory']
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    # Failure of the whole channel (e.g. reading error) :
+                    error = '%s: %s' % (type(e).__name__, e)
+                    logger.warning("Channel %i of %s can not be processed "
+                                   "(%s)" % (chan, job['path'], error))
+                    out = {}
+                    for i in range(len(settings)):
+                        out.update({'index%i' % i: np.zeros((0, 2), int),
+                                    'number%i' % i: 0, 'density%i' % i: 0.,
+                                    'error%i' % i: error,
+                                    'stage%i' % i: np.zeros((0,), int)})
+                    _save_partial(partial, 1., 1, out)
+                job['n_left'] -= 1
+                if not job['n_left']:
+                    self._finish(job)
+
+        with ProcessPoolExecutor(self.n_jobs) as pool:
+            for job in jobs:
+                if not job['n_left']:  # interrupted before its tables
+                    self._finish(job)
+                    continue
+                for chan, partial in zip(job['chans'], job['partials']):
+                    if os.path.isfile(partial):
+                        continue
+                    # Wait for running detections to free memory :
+                    while running and ((len(running) >= 2 * self.n_jobs) or (
+                            memory[0] + job['memory'] > self.max_memory)):
+                        _collect(wait(running,
+                                      return_when=FIRST_COMPLETED).done)
+                    future = pool.submit(_detect_channel, job['path'], chan,
+                                         job['hypno'], settings,
+                                         self.downsample, partial)
+                    running[future] = (job, chan, partial)
+                    memory[0] += job['memory']
+            while running:
+                _collect(wait(running, return_when=FIRST_COMPLETED).done)
+        return len(jobs)
@@ -0,0 +1,362 @@
+"""Lazy, memory-mapped access to sleep data.
+
+This file contains :
+- LazySleepData : array-like object that decodes and down-samples sleep data
+  on demand
+- memmap_reader : build a reader for channels stored in a memory-map
+- multiplexed_reader : build a reader for multiplexed samples stored in a
+  memory-map
+"""
+import numpy as np
+from scipy.signal import firwin, upfirdn
+
+__all__ = ['LazySleepData', 'memmap_reader', 'multiplexed_reader']
+
+
+def _decimation_filter(dsf):
+    """Get the anti-aliasing FIR filter used for down-sampling.
+
+    This is the same filter as in scipy.signal.resample_poly(x, 1, dsf).
+
+    Parameters
+    ----------
+    dsf : int
+        Down-sampling factor.
+
+    Returns
+    -------
+    h : array_like
+        Filter coefficients (float32) of length 2 * half_len + 1.
+    half_len : int
+        Half length of the filter.
+    """
+    half_len = 10 * dsf
+    h = firwin(2 * half_len + 1, 1. / dsf, window=('kaiser', 5.0))
+    return h.astype(np.float32), half_len
+
+
+def memmap_reader(raw, gain, offset=None):
+    """Get a reader of calibrated data from a (n_channels, n_points) memmap.
+
+    Parameters
+    ----------
+    raw : array_like
+        Memory-mapped array (or any view of it) of shape
+        (n_channels, n_points) containing the data as written on file.
+    gain : array_like
+        Gain to apply to each channel. Must be a vector of length n_channels.
+    offset : array_like | None
+        Offset to add to each channel, after applying the gain.
+
+    Returns
+    -------
+    reader : function
+        Function reader(chan, start, stop) that returns the float32
+        calibrated data of channels chan between samples start and stop.
+    """
+    gain = np.asarray(gain, dtype=np.float32).ravel()
+    if offset is not None:
+        offset = np.asarray(offset, dtype=np.float32).ravel()
+
+    def reader(chan, start, stop):
+        dat = np.multiply(raw[chan, start:stop], gain[chan, np.newaxis],
+                          dtype=np.float32)
+        if offset is not None:
+            dat += offset[chan, np.newaxis]
+        return dat
+    return reader
+
+
+def multiplexed_reader(raw, gain, offset=None, block=4096):
+    """Get a reader of calibrated data from a (n_points, n_channels) memmap.
+
+    Multiplexed files store the samples of every channel one time point
+    after the other. Data are calibrated in their multiplexed layout then
+    transposed, by blocks of time points small enough to stay in the CPU
+    cache. This is several times faster than transposing the memmap first.
+
+    Parameters
+    ----------
+    raw : array_like
+        Memory-mapped array of shape (n_points, n_channels) containing the
+        data as written on file.
+    gain : array_like
+        Gain to apply to each channel. Must be a vector of length n_channels.
+    offset : array_like | None
+        Offset to add to each channel, after applying the gain.
+    block : int | 4096
+        Number of time points calibrated and transposed at once.
+
+    Returns
+    -------
+    reader : function
+        Function reader(chan, start, stop) that returns the float32
+        calibrated data of channels chan between samples start and stop.
+    """
+    gain = np.asarray(gain, dtype=np.float32).ravel()
+    if offset is not None:
+        offset = np.asarray(offset, dtype=np.float32).ravel()
+
+    def reader(chan, start, stop):
+        dat = np.empty((len(chan), stop - start), dtype=np.float32)
+        for k in range(start, stop, block):
+            sub = raw[k:min(k + block, stop), :][:, chan]
+            sub = np.multiply(sub, gain[chan], dtype=np.float32)
+            if offset is not None:
+                sub += offset[chan]
+            dat[:, k - start:k - start + sub.shape[0]] = sub.T
+        return dat
+    return reader
+
+
+class LazySleepData(object):
+    """Array-like object for reading sleep data on demand.
+
+    The data are never fully loaded in memory. Instead, slicing the object
+    (e.g. data[:, sl]) only decodes, calibrates and down-samples the requested
+    window, in chunks of bounded size. Down-sampling uses a polyphase FIR
+    anti-aliasing filter (equivalent to scipy.signal.resample_poly) and each
+    chunk is read with the overlap required by the filter, so that the
+    result does not depend on the chunk size. Use np.asarray(data) to load
+    the full down-sampled data.
+
+    Parameters
+    ----------
+    reader : function
+        Function reader(chan, start, stop) returning the float32 calibrated
+        data of shape (len(chan), stop - start) for an array of channel
+        indices chan, between the samples start and stop of the original
+        recording.
+    n_channels : int
+        Number of channels.
+    n_points : int
+        Number of time points in the original recording.
+    dsf : int | 1
+        Down-sampling factor. The object has the same shape as
+        data[:, ::dsf].
+    chunk : int | 2 ** 20
+        Maximum number of original samples per channel to decode at once.
+    """
+
+    def __init__(self, reader, n_channels, n_points, dsf=1, chunk=2 ** 20):
+        """Init."""
+        self._reader = reader
+        self._n_channels = int(n_channels)
+        self._n_points = int(n_points)
+        self._dsf = int(dsf)
+        self._chunk = int(max(chunk // self._dsf, 1))
+        self._scale = 1.
+        self._montage = None
+        if self._dsf > 1:
+            self._filter = _decimation_filter(self._dsf)
+
+    def __repr__(self):
+        """Representation of the object."""
+        return "<LazySleepData | %i channels x %i points (dsf=%i)>" % (
+            self.shape + (self._dsf,))
+
+    def __len__(self):
+        """Return the number of channels."""
+        return self._n_channels
+
+    def __array__(self, dtype=None, copy=None):
+        """Load the full (down-sampled) data in memory."""
+        data = self[:, :]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+    def __imul__(self, value):
+        """Scale the data."""
+        self._scale *= value
+        return self
+
+    def __getitem__(self, key):
+        """Read a selection of the (down-sampled) data."""
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        cols = slice(None) if cols is Ellipsis else cols
+        chan = np.arange(self._n_channels)[rows]
+        squeeze_row = chan.ndim == 0
+        chan = np.atleast_1d(chan)
+
+        if isinstance(cols, slice):
+            start, stop, step = cols.indices(self.shape[1])
+            if step > 0:
+                n_out = len(range(start, stop, step))
+                if not n_out:
+                    data = np.empty((len(chan), 0), dtype=np.float32)
+                else:
+                    data = self._read(chan, start,
+                                      start + (n_out - 1) * step + 1, step)
+            else:
+                data = self._read_index(chan, np.arange(start, stop, step))
+        else:
+            index = np.arange(self.shape[1])[cols]
+            if (index.ndim > 1) or (index.ndim and np.ndim(rows)):
+                raise IndexError("LazySleepData only supports indexing "
+                                 "channels and time points independently.")
+            data = self._read_index(chan, np.atleast_1d(index))
+            if not index.ndim:
+                data = data[:, 0]
+
+        return data[0, ...] if squeeze_row else data
+
+    # ----------- READ -----------
+    def _read_raw(self, chan, start, stop):
+        """Read calibrated data at the original sampling rate."""
+        if self._montage is None:
+            data = self._reader(chan, start, stop)
+        else:
+            montage = self._montage[chan, :]
+            src = np.flatnonzero(np.any(montage != 0., axis=0))
+            data = montage[:, src].dot(self._reader(src, start, stop))
+        if self._scale != 1.:
+            data *= self._scale
+        return data.astype(np.float32, copy=False)
+
+    def _read_down(self, chan, start, stop):
+        """Read the down-sampled samples between start and stop.
+
+        The original samples are read with the margin needed by the
+        anti-aliasing filter (zero-padded outside of the recording).
+        """
+        if self._dsf == 1:
+            return self._read_raw(chan, start, stop)
+        h, half_len = self._filter
+        first = start * self._dsf - half_len
+        last = (stop - 1) * self._dsf + half_len + 1
+        x = np.zeros((len(chan), last - first), dtype=np.float32)
+        sta, end = max(first, 0), min(last, self._n_points)
+        x[:, sta - first:end - first] = self._read_raw(chan, sta, end)
+        # upfirdn output k is centered on the original sample
+        # first + k * dsf - half_len :
+        k = 2 * half_len // self._dsf
+        return upfirdn(h, x, 1, self._dsf)[:, k:k + stop - start]
+
+    def _read(self, chan, start, stop, step):
+        """Read chunks of data between start and stop every step samples."""
+        n_out = len(range(start, stop, step))
+        data = np.empty((len(chan), n_out), dtype=np.float32)
+        chunk = max(step, (self._chunk // step) * step)
+        for k in range(start, stop, chunk):
+            end = min(k + chunk, stop)
+            block = self._read_down(chan, k, end)[:, ::step]
+            first = (k - start) // step
+            data[:, first:first + block.shape[1]] = block
+        return data
+
+    def _read_index(self, chan, index):
+        """Read data at specific (down-sampled) time indices."""
+        data = np.empty((len(chan), len(index)), dtype=np.float32)
+        if not len(index):
+            return data
+        order = np.argsort(index, kind='mergesort')
+        index_sorted = index[order]
+        groups = index_sorted // self._chunk
+        bounds = np.flatnonzero(np.diff(groups)) + 1
+        for sl in np.split(np.arange(len(index)), bounds):
+            first, last = index_sorted[sl[0]], index_sorted[sl[-1]]
+            block = self._read_down(chan, first, last + 1)
+            data[:, order[sl]] = block[:, index_sorted[sl] - first]
+        return data
+
+    def _iter_chunks(self):
+        """Iterate over (down-sampled) chunks of the full data."""
+        for k in range(0, self.shape[1], self._chunk):
+            yield self[:, k:k + self._chunk]
+
+    # ----------- REDUCTIONS -----------
+    @staticmethod
+    def _check_axis(axis):
+        if axis not in [1, -1]:
+            raise NotImplementedError("Reductions of LazySleepData are only "
+                                      "supported across time (axis=1).")
+
+    def min(self, axis=1):
+        """Minimum of each channel."""
+        self._check_axis(axis)
+        return np.min([k.min(1) for k in self._iter_chunks()], axis=0)
+
+    def max(self, axis=1):
+        """Maximum of each channel."""
+        self._check_axis(axis)
+        return np.max([k.max(1) for k in self._iter_chunks()], axis=0)
+
+    def mean(self, axis=1):
+        """Mean of each channel."""
+        self._check_axis(axis)
+        total = np.sum([k.sum(1, dtype=np.float64)
+                        for k in self._iter_chunks()], axis=0)
+        return (total / self.shape[1]).astype(np.float32)
+
+    def std(self, axis=1):
+        """Standard deviation of each channel."""
+        return self.stats(axis)[3]
+
+    def stats(self, axis=1):
+        """Minimum, maximum, mean and standard deviation of each channel.
+
+        The four statistics are computed in a single pass over the data.
+        Chunk statistics are merged using the parallel algorithm of Chan et
+        al., which is numerically stable.
+
+        Returns
+        -------
+        dmin, dmax, mean, std : array_like
+            Statistics (float32) of each channel.
+        """
+        self._check_axis(axis)
+        n_chan = self.shape[0]
+        dmin = np.full((n_chan,), np.inf, dtype=np.float32)
+        dmax = np.full((n_chan,), -np.inf, dtype=np.float32)
+        n, mean, m2 = 0, np.zeros((n_chan,)), np.zeros((n_chan,))
+        for k in self._iter_chunks():
+            np.minimum(dmin, k.min(1), out=dmin)
+            np.maximum(dmax, k.max(1), out=dmax)
+            n_k, mean_k = k.shape[1], k.mean(1, dtype=np.float64)
+            m2_k = np.square(k - mean_k[:, np.newaxis]).sum(1)
+            delta, n_tot = mean_k - mean, n + n_k
+            mean += delta * n_k / n_tot
+            m2 += m2_k + delta ** 2 * n * n_k / n_tot
+            n = n_tot
+        std = np.sqrt(m2 / n)
+        return dmin, dmax, mean.astype(np.float32), std.astype(np.float32)
+
+    # ----------- MONTAGE -----------
+    @property
+    def montage(self):
+        """Get the montage value.
+
+        The montage is a (n_channels, n_channels) matrix applied to the
+        channels on reading (e.g. for re-referencing). None means identity.
+        """
+        return self._montage
+
+    @montage.setter
+    def montage(self, value):
+        """Set montage value."""
+        if value is not None:
+            value = np.asarray(value, dtype=np.float32)
+            if value.shape != (self._n_channels,) * 2:
+                raise ValueError("The montage must be a (n_channels, "
+                                 "n_channels) matrix.")
+        self._montage = value
+
+    # ----------- PROPERTIES -----------
+    @property
+    def shape(self):
+        """Get the (n_channels, n_points) shape of the down-sampled data."""
+        return (self._n_channels, len(range(0, self._n_points, self._dsf)))
+
+    @property
+    def ndim(self):
+        """Get the number of dimensions."""
+        return 2
+
+    @property
+    def size(self):
+        """Get the number of elements."""
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def dtype(self):
+        """Get the data type."""
+        return np.dtype(np.float32)
@@ -1,11 +1,14 @@
 """Utility functions for MNE."""
 import datetime
-from ..utils import get_dsf
+import numpy as np
+
+from .lazy_sleep import LazySleepData, memmap_reader
+from ..utils import get_dsf, pick_channels
 
 __all__ = ['mne_switch']
 
 
-def mne_switch(file, ext, downsample, preload=True, **kwargs):
+def mne_switch(file, ext, downsample, preload=True, picks=None, **kwargs):
     """Read sleep datasets using mne.io.
 
     Parameters
@@ -16,6 +19,8 @@ def mne_switch(file, ext, downsample, preload=True, **kwargs):
         File extension (e.g. '.edf'').
     preload : bool | True
         Preload data in memory.
+    picks : string, list | None
+        Channels to load. See visbrain.utils.pick_channels.
     kwargs : dict | {}
         Further arguments to pass to the mne.io.read function.
 
@@ -41,14 +46,15 @@ def mne_switch(file, ext, downsample, preload=True, **kwargs):
     # Get full path :
     path = file + ext
 
-    # Preload :
+    # Preload (when channels are selected, the data are only loaded after
+    # the selection) :
     if preload is False:
         preload = 'temp.dat'
-    kwargs['preload'] = preload
+    kwargs['preload'] = preload if picks is None else False
 
     if ext.lower() in ['.edf', '.bdf', '.gdf']:  # EDF / BDF / GDF
         raw = io.read_raw_edf(path, **kwargs)
-    elif ext.lower == '.set':   # EEGLAB
+    elif ext.lower() == '.set':   # EEGLAB
         raw = io.read_raw_eeglab(path, **kwargs)
     elif ext.lower() in ['.egi', '.mff']:  # EGI / MFF
         raw = io.read_raw_egi(path, **kwargs)
@@ -60,12 +66,19 @@ def mne_switch(file, ext, downsample, preload=True, **kwargs):
         raise IOError("File not supported by mne-python.")
 
     raw.pick_types(meg=True, eeg=True, ecg=True, emg=True)  # Remove stim lines
+    if picks is not None:
+        idx = pick_channels(raw.info['ch_names'], picks)
+        raw.pick_channels([raw.info['ch_names'][k] for k in idx])
+        raw.load_data()
     sf = raw.info['sfreq']
     dsf, downsample = get_dsf(downsample, sf)
     channels = raw.info['ch_names']
-    data = raw._data
-    n = data.shape[1]
+    n = raw._data.shape[1]
     start_time = datetime.time(0, 0, 0)  # raw.info['meas_date']
     anot = raw.annotations
 
-    return sf, downsample, dsf, data[:, ::dsf], channels, n, start_time, anot
+    # Anti-aliased down-sampling, chunk by chunk :
+    data = np.asarray(LazySleepData(memmap_reader(raw._data, np.ones(
+        len(channels))), len(channels), n, dsf))
+
+    return sf, downsample, dsf, data, channels, n, start_time, anot
@@ -2,6 +2,7 @@
 
 This file contain functions to load :
 - European Data Format (*.edf)
+- BioSemi Data Format (*.bdf)
 - Micromed (*.trc)
 - BrainVision (*.vhdr)
 - ELAN (*.eeg)
@@ -15,11 +16,13 @@ from warnings import warn
 import logging
 
 from .rw_utils import get_file_ext
-from .rw_hypno import (read_hypno, oversample_hypno)
+from .rw_hypno import read_hypno
 from .dialog import dialogLoad
 from .mneio import mne_switch
 from .dependencies import is_mne_installed
-from ..utils import get_dsf, vispy_array
+from .lazy_sleep import LazySleepData, memmap_reader, multiplexed_reader
+from .sleep_cache import SleepCache
+from ..utils import get_dsf, vispy_array, pick_channels, HypnoRuns
 from ..io import merge_annotations
 from ..config import profiler
 
@@ -27,12 +30,26 @@ logger = logging.getLogger('visbrain')
 
 __all__ = ['ReadSleepData']
 
+# Micromed electrode definition (LABCOD zone, 128 bytes per electrode) :
+TRC_ELECTRODE = np.dtype([
+    ('status', 'u1'), ('type', 'u1'), ('positive_input', 'S6'),
+    ('negative_input', 'S6'), ('logical_min', '<i4'),
+    ('logical_max', '<i4'), ('logical_ground', '<i4'),
+    ('physical_min', '<i4'), ('physical_max', '<i4'),
+    ('measurement_unit', '<i2'), ('prefiltering', '<u2', (4,)),
+    ('rate_coefficient', '<u2'), ('reserved', 'V82')])
+
+# EDF / BDF channels that do not contain data (BioSemi trigger channel and
+# EDF+ / BDF+ annotations) :
+EDF_NON_DATA = ('status', 'edf annotations', 'bdf annotations')
+
 
 class ReadSleepData(object):
     """Main class for reading sleep data."""
 
     def __init__(self, data, channels, sf, hypno, href, preload, use_mne,
-                 downsample, kwargs_mne, annotations):
+                 downsample, kwargs_mne, annotations, use_cache=False,
+                 picks=None):
         """Init."""
         # ========================== LOAD DATA ==========================
         # Dialog window if data is None :
@@ -50,10 +67,8 @@ class ReadSleepData(object):
             # ---------- USE SLEEP or MNE ----------
             # Find file extension :
             file, ext = get_file_ext(data)
-            # Force to use MNE if preload is False :
-            use_mne = True if not preload else use_mne
             # Get if the file has to be loaded using Sleep or MNE python :
-            sleep_ext = ['.eeg', '.vhdr', '.edf', '.trc', '.rec']
+            sleep_ext = ['.eeg', '.vhdr', '.edf', '.bdf', '.trc', '.rec']
             use_mne = True if ext not in sleep_ext else use_mne
 
             if not is_mne_installed() and use_mne:
@@ -61,13 +76,32 @@ class ReadSleepData(object):
                               "installed.")
 
             # ---------- LOAD THE FILE ----------
-            if use_mne:  # Load using MNE functions
+            # Try to load the file from the cache :
+            args = None
+            if use_cache:
+                cache = SleepCache()
+                kw = sorted([(k, i) for k, i in kwargs_mne.items()
+                             if k != 'preload'])
+                reader = 'mne %s' % kw if use_mne else 'sleep'
+                key = cache.key(file + ext, downsample, channels=picks,
+                                reader=reader)
+                args = cache.load(key, preload)
+            from_cache = args is not None
+
+            if from_cache:  # Load from the cache
+                logger.debug("Load file from the cache")
+            elif use_mne:  # Load using MNE functions
                 logger.debug("Load file using MNE-python")
                 kwargs_mne['preload'] = preload
-                args = mne_switch(file, ext, downsample, **kwargs_mne)
+                args = mne_switch(file, ext, downsample, picks=picks,
+                                  **kwargs_mne)
             else:  # Load using Sleep functions
                 logger.debug("Load file using Sleep")
-                args = sleep_switch(file, ext, downsample)
+                args = sleep_switch(file, ext, downsample, preload, picks)
+
+            # Save the decoded and down-sampled data into the cache :
+            if use_cache and not from_cache:
+                cache.save(key, args, file=file + ext)
             # Get output arguments :
             (sf, downsample, dsf, data, channels, n, offset, annot) = args
             logger.info("File successfully loaded (%s)" % (file + ext))
@@ -82,7 +116,14 @@ class ReadSleepData(object):
             offset = datetime.time(0, 0, 0)
             dsf, downsample = get_dsf(downsample, sf)
             n = data.shape[1]
-            data = data[:, ::dsf]
+            # Channel selection :
+            if picks is not None:
+                if (channels is None) or (len(channels) != len(data)):
+                    channels = ['chan' + str(k) for k in range(len(data))]
+                idx = pick_channels(channels, picks)
+                data, channels = data[idx, :], [channels[k] for k in idx]
+            data = np.asarray(LazySleepData(memmap_reader(data, np.ones(
+                data.shape[0])), data.shape[0], n, dsf))
         else:
             raise IOError("The data should either be a string which refer to "
                           "the path of a file or an array of raw data of shape"
@@ -114,8 +155,8 @@ class ReadSleepData(object):
                                  "same as raw data")
         if isinstance(hypno, str):  # (*.hyp / *.txt / *.csv)
             hypno, _ = read_hypno(hypno)
-            # Oversample then downsample :
-            hypno = oversample_hypno(hypno, self._N)[::dsf]
+            # Oversample then downsample (as runs) :
+            hypno = HypnoRuns.from_epochs(hypno, self._N, dsf)
             profiler("Hypnogram file loaded", level=1)
 
         # ========================== CHECKING ==========================
@@ -171,27 +212,32 @@ class ReadSleepData(object):
 
         # ---------- HYPNOGRAM ----------
         if hypno is None:
-            hypno = np.zeros((npts,), dtype=np.float32)
+            hypno = HypnoRuns.zeros(npts)
         else:
+            hypno = HypnoRuns.from_array(hypno)
             n = len(hypno)
             # Check hypno values :
-            if (hypno.min() < -1.) or (hypno.max() > 4) or (n != npts):
+            if (hypno.stage.min() < -1.) or (hypno.stage.max() > 4) or (
+                    n != npts):
                 warn("\nHypnogram values must be comprised between -1 and 4 "
                      "(see Iber et al. 2007). Use:\n-1 -> Art (optional)\n 0 "
                      "-> Wake\n 1 -> N1\n 2 -> N2\n 3 -> N4\n 4 -> REM\nEmpty "
                      "hypnogram will be used instead")
-                hypno = np.zeros((npts,), dtype=np.float32)
+                hypno = HypnoRuns.zeros(npts)
 
         # ---------- SCALING ----------
-        # Check amplitude of the data and if necessary apply re-scaling
-        if np.abs(np.ptp(data, 0).mean()) < 0.1:
+        # Check amplitude of the data and if necessary apply re-scaling (only
+        # on the first minutes for lazy data) :
+        is_lazy = isinstance(data, LazySleepData)
+        data_amp = data[:, 0:int(600 * self._sf)] if is_lazy else data
+        if np.abs(np.ptp(data_amp, 0).mean()) < 0.1:
             warn("Wrong data amplitude for Sleep software.")
             data *= 1e6
 
         # ---------- CONVERSION ----------=
         # Convert data and hypno to be contiguous and float 32 (for vispy):
-        self._data = vispy_array(data)
-        self._hypno = vispy_array(hypno)
+        self._data = data if is_lazy else vispy_array(data)
+        self._hypno = hypno
         self._time = vispy_array(time)
         self._channels = chanc
         self._href = href
@@ -199,7 +245,7 @@ class ReadSleepData(object):
         profiler("Check data", level=1)
 
 
-def sleep_switch(file, ext, downsample):
+def sleep_switch(file, ext, downsample, preload=True, picks=None):
     """Switch between sleep data files.
 
     Parameters
@@ -210,6 +256,12 @@ def sleep_switch(file, ext, downsample):
         Extension name (e.g. '.eeg')
     downsample : int
         Down-sampling frequency.
+    preload : bool | True
+        Preload data in memory. If False, data are memory-mapped and returned
+        as a LazySleepData object.
+    picks : string, list | None
+        Channels to load (only the selected channels are read and decoded).
+        See visbrain.utils.pick_channels.
 
     Returns
     -------
@@ -220,7 +272,8 @@ def sleep_switch(file, ext, downsample):
     dsf : int
         The down-sampling factor.
     data : array_like
-        The raw data of shape (n_channels, n_points)
+        The raw data of shape (n_channels, n_points) (LazySleepData if preload
+        is False).
     channels : list
         List of channel names.
     n : int
@@ -234,16 +287,16 @@ def sleep_switch(file, ext, downsample):
     path = file + ext
 
     if ext == '.vhdr':  # BrainVision
-        return read_eeg(path, downsample)
+        return read_eeg(path, downsample, preload=preload, picks=picks)
 
     if ext == '.eeg':  # Elan
-        return read_elan(path, downsample)
+        return read_elan(path, downsample, preload=preload, picks=picks)
 
-    elif ext in ['.edf', '.rec']:  # European Data Format
-        return read_edf(path, downsample)
+    elif ext in ['.edf', '.bdf', '.rec']:  # European / BioSemi Data Format
+        return read_edf(path, downsample, preload=preload, picks=picks)
 
     elif ext == '.trc':  # Micromed
-        return read_trc(path, downsample)
+        return read_trc(path, downsample, preload=preload, picks=picks)
 
     else:  # None
         raise ValueError("*" + ext + " files are currently not supported.")
@@ -255,8 +308,8 @@ def sleep_switch(file, ext, downsample):
 ###############################################################################
 ###############################################################################
 
-def read_edf(path, downsample):
-    """Read data from a European Data Format (edf) file.
+def read_edf(path, downsample, preload=True, picks=None):
+    """Read data from a European Data Format (edf) or BioSemi (bdf) file.
 
     Use phypno class for reading EDF files:
         http: // phypno.readthedocs.io / api / phypno.ioeeg.edf.html
@@ -264,9 +317,15 @@ def read_edf(path, downsample):
     Parameters
     ----------
     path: str
-        Filename(with full path) to EDF file
+        Filename(with full path) to EDF or BDF file
     downsample : int
         Down-sampling frequency.
+    preload : bool | True
+        Preload data in memory. If False, data are memory-mapped and returned
+        as a LazySleepData object.
+    picks : string, list | None
+        Channels to load (only the selected channels are read and decoded).
+        See visbrain.utils.pick_channels.
 
     Returns
     -------
@@ -283,40 +342,26 @@ def read_edf(path, downsample):
     annotations : array_like
         Array of annotations.
     """
-    assert os.path.isfile(path)
-
-    from ..utils.sleep.edf import Edf
-
-    edf = Edf(path)
-
-    # Return header informations
-    _, start_time, sf, chan, n_samples, _ = edf.return_hdr()
-    start_time = start_time.time()
-
-    # Keep only data channels (e.g excludes marker chan)
-    freqs = np.unique(edf.hdr['n_samples_per_record'])
-    sf = freqs.max()
-
-    if len(freqs) != 1:
-        bad_chans = np.where(edf.hdr['n_samples_per_record'] < sf)
-        chan = np.delete(chan, bad_chans)
-
-    # Load all samples of selected channels
-    np.seterr(divide='ignore', invalid='ignore')
-    data = edf.return_dat(chan, 0, n_samples)
-
-    # Get original signal length :
-    n = data.shape[1]
+    hdr = _edf_header(path)
+    sf, n, start_time, edf = hdr['sf'], hdr['n'], hdr['start_time'], hdr['edf']
 
     # Get down-sample factor :
-    sf = float(sf)
-    chan = list(chan)
+    chan = hdr['channels']
+    chan = [chan[k] for k in pick_channels(chan, picks)]
     dsf, downsample = get_dsf(downsample, sf)
 
-    return sf, downsample, dsf, data[:, ::dsf], chan, n, start_time, None
+    # Decode and down-sample selected channels, chunk by chunk :
+    np.seterr(divide='ignore', invalid='ignore')
+    i_chan = edf._chan_index(chan)
+    data = LazySleepData(lambda c, start, stop: edf.return_dat(
+        i_chan[c], start, stop), len(chan), n, dsf)
+    if preload:
+        data = np.asarray(data)
+
+    return sf, downsample, dsf, data, chan, n, start_time, None
 
 
-def read_trc(path, downsample):
+def read_trc(path, downsample, preload=True, picks=None):
     """Read data from a Micromed (trc) file (version 4).
 
     Poor man's version of micromedio.py from Neo package
@@ -328,6 +373,12 @@ def read_trc(path, downsample):
         Filename(with full path) to .trc file
     downsample : int
         Down-sampling frequency.
+    preload : bool | True
+        Preload data in memory. If False, data are memory-mapped and returned
+        as a LazySleepData object.
+    picks : string, list | None
+        Channels to load (only the selected channels are read and decoded).
+        See visbrain.utils.pick_channels.
 
     Returns
     -------
@@ -346,83 +397,37 @@ def read_trc(path, downsample):
     annotations : array_like
         Array of annotations.
     """
-    import struct
-
-    def read_f(f, fmt):
-        return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
-
-    with io.open(path, 'rb') as f:
-        # Read header
-        f.seek(175, 0)
-        header_version, = read_f(f, 'b')
-        assert header_version == 4
-
-        f.seek(138, 0)
-        data_start_offset, n_chan, _, sf, nbytes = read_f(f, 'IHHHH')
-
-        f.seek(128, 0)
-        day, month, year, hour, minute, sec = read_f(f, 'bbbbbb')
-        start_time = datetime.time(hour, minute, sec)
-
-        # Raw data
-        f.seek(data_start_offset, 0)
-        m_raw = np.fromstring(f.read(), dtype='u' + str(nbytes))
-        m_raw = m_raw.reshape((int(m_raw.size / n_chan), n_chan)).transpose()
-
-        # Read label / gain
-        gain = []
-        chan = []
-        logical_ground = []
-        data = np.empty(shape=m_raw.shape, dtype=np.float32)
-
-        f.seek(176, 0)
-        zone_names = ['ORDER', 'LABCOD']
-        zones = {}
-        for zname in zone_names:
-            zname2, pos, length = read_f(f, '8sII')
-            zones[zname] = zname2, pos, length
-
-        zname2, pos, length = zones['ORDER']
-        f.seek(pos, 0)
-        code = np.fromfile(f, dtype='u2', count=n_chan)
-
-        for c in range(n_chan):
-            zname2, pos, length = zones['LABCOD']
-            f.seek(pos + code[c] * 128 + 2, 0)
-
-            chan = np.append(chan, f.read(6).decode('utf-8').strip())
-            logical_min, logical_max, logic_ground_chan, physical_min, \
-                physical_max = read_f(f, 'iiiii')
-
-            logical_ground = np.append(logical_ground, logic_ground_chan)
-
-            gain = np.append(gain, float(physical_max - physical_min) /
-                             float(logical_max - logical_min + 1))
-
-    # Multiply by gain
-    m_raw = m_raw - logical_ground[:, np.newaxis]
-    data = m_raw * gain[:, np.newaxis].astype(np.float32)
-
-    # Get original signal length :
-    n = data.shape[1]
+    hdr = _trc_header(path)
+    sf, chan, n, start_time = [hdr[k] for k in ['sf', 'channels', 'n',
+                                                'start_time']]
 
     # Get down-sample factor :
-    sf = float(sf)
-    chan = list(chan)
     dsf, downsample = get_dsf(downsample, sf)
 
-    return sf, downsample, dsf, data[:, ::dsf], chan, n, start_time, None
+    # Raw multiplexed data (memory-mapped). Subtract the ground, multiply by
+    # gain and down-sample the selected channels chunk by chunk :
+    idx = pick_channels(chan, picks)
+    chan = [chan[k] for k in idx]
+    m_raw = np.memmap(path, dtype='<u' + str(hdr['nbytes']), mode='r',
+                      offset=hdr['data_offset'], shape=(n, len(hdr['gain'])))
+    reader = multiplexed_reader(m_raw, hdr['gain'], hdr['offset'])
+    data = LazySleepData(lambda c, start, stop: reader(idx[c], start, stop),
+                         len(idx), n, dsf)
+    if preload:
+        data = np.asarray(data)
+
+    return sf, downsample, dsf, data, chan, n, start_time, None
 
 
-def read_eeg(path, downsample, read_markers=False):
+def read_eeg(path, downsample, read_markers=False, preload=True,
+             picks=None):
     """Read data from a BrainVision (*.vhdr) file.
 
     Poor man's version of https: // gist.github.com / breuderink / 6266871
 
-    Assumes that data are saved with the following parameters:
-        - Data format: Binary
-        - Orientation: Multiplexed
-        - Format: int16
+    Supports binary data files with the following parameters:
+        - Orientation: Multiplexed or Vectorized
+        - Format: int16, int32 or float32
 
     Parameters
     ----------
@@ -432,7 +437,14 @@ def read_eeg(path, downsample, read_markers=False):
     downsample : int
         Down-sampling frequency.
     read_markers : bool | False
-        Import markers from the .vmrk files as annotations
+        Import markers from the .vmrk files as annotations (start and end in
+        seconds, description).
+    preload : bool | True
+        Preload data in memory. If False, data are memory-mapped and returned
+        as a LazySleepData object.
+    picks : string, list | None
+        Channels to load (only the selected channels are read and decoded).
+        See visbrain.utils.pick_channels.
 
     Returns
     -------
@@ -449,106 +461,34 @@ def read_eeg(path, downsample, read_markers=False):
     annotations : array_like
         Array of annotations.
     """
-    import re
-
-    assert os.path.isfile(path)
-
-    # Read header
-    ent = np.genfromtxt(path, delimiter='\n', usecols=[0],
-                        dtype=None, skip_header=0)
-
-    ent = np.char.decode(ent, "utf-8")
-
-    for item in ent:
-        if 'DataFile=' in item:
-            data_file = item.split('=')[1]
-            data_path = os.path.join(os.path.dirname(path), data_file)
-            assert os.path.isfile(data_path)
-        elif 'MarkerFile=' in item:
-            marker_file = item.split('=')[1]
-            marker_path = os.path.join(os.path.dirname(path), marker_file)
-        elif 'NumberOfChannels=' in item:
-            n_chan = int(re.findall('\d+', item)[0])
-        elif 'SamplingInterval=' in item:
-            si = float(re.findall("[-+]?\d*\.\d+|\d+", item)[0])
-            sf = 1 / (si * 0.000001)
-        elif 'DataFormat' in item:
-            data_format = item.split('=')[1]
-        elif 'BinaryFormat' in item:
-            binary_format = item.split('=')[1]
-        elif 'DataOrientation' in item:
-            data_orient = item.split('=')[1]
-
-    # Check binary format
-    assert "BINARY" in data_format
-    assert "INT_16" in binary_format
-    assert "MULTIPLEXED" in data_orient
-
-    # Extract channel labels and resolution
-    start_label = np.array(np.where(np.char.find(ent, 'Ch1=') == 0)).min()
-    chan = {}
-    resolution = np.empty(shape=n_chan)
-
-    for i, j in enumerate(range(start_label, start_label + n_chan)):
-        chan[i] = re.split('\W+', ent[j])[1]
-        resolution[i] = float(ent[j].split(",")[2])
-
-    chan = np.array(list(chan.values())).flatten()
-
-    # Read marker file (if present) to extract recording time
-    if os.path.isfile(marker_path):
-        vmrk = np.genfromtxt(marker_path, delimiter='\n', usecols=[0],
-                             dtype=None, skip_header=0)
-
-        vmrk = np.char.decode(vmrk)
-        # Read start-time
-        for item in vmrk:
-            if 'New Segment' in item:
-                st = re.split('\W+', item)[-1]
-                start_time = datetime.time(int(st[8:10]), int(st[10:12]),
-                                           int(st[12:14]))
-                break
-            else:
-                start_time = datetime.time(0, 0, 0)
-
-        # Read markers
-        if read_markers:
-            onsets = np.array([], dtype=float)
-            durations = np.array([], dtype=float)
-            descriptions = np.array([], dtype=str)
-            for item in vmrk:
-                if 'Mk' in item and ';' not in item:
-                    onsets = np.append(onsets, int(
-                        re.sub(r'\s', '', item).split(',')[2]))
-                    durations = np.append(durations, int(
-                        re.sub(r'\s', '', item).split(',')[3]))
-                    descriptions = np.append(descriptions, re.sub(
-                        r'\s', '', item).split(',')[1])
-                    anot = np.c_[onsets, durations, descriptions]
-        else:
-            anot = None
-
-    with io.open(data_path, 'rb') as f:
-        raw = f.read()
-        size = int(len(raw) / 2)
-
-        ints = np.ndarray((n_chan, int(size / n_chan)),
-                          dtype='<i2', order='F', buffer=raw)
-
-        data = np.float32(np.diag(resolution)).dot(ints)
-
-    # Get original signal length :
-    n = data.shape[1]
+    hdr = _eeg_header(path, read_markers)
+    sf, chan, n, start_time, anot = [hdr[k] for k in [
+        'sf', 'channels', 'n', 'start_time', 'annotations']]
+    n_chan = len(chan)
 
     # Get down-sample factor :
-    sf = float(sf)
-    chan = list(chan)
     dsf, downsample = get_dsf(downsample, sf)
 
-    return sf, downsample, dsf, data[:, ::dsf], chan, n, start_time, anot
+    # Memory-map the data, apply resolution and down-sample the selected
+    # channels chunk by chunk :
+    idx = pick_channels(chan, picks)
+    chan = [chan[k] for k in idx]
+    data_path, dtype = hdr['data_path'], hdr['dtype']
+    if hdr['orientation'] == 'MULTIPLEXED':
+        raw = np.memmap(data_path, dtype=dtype, mode='r', shape=(n, n_chan))
+        reader = multiplexed_reader(raw, hdr['resolution'])
+    else:
+        raw = np.memmap(data_path, dtype=dtype, mode='r', shape=(n_chan, n))
+        reader = memmap_reader(raw, hdr['resolution'])
+    data = LazySleepData(lambda c, start, stop: reader(idx[c], start, stop),
+                         len(idx), n, dsf)
+    if preload:
+        data = np.asarray(data)
 
+    return sf, downsample, dsf, data, chan, n, start_time, anot
 
-def read_elan(path, downsample):
+
+def read_elan(path, downsample, preload=True, picks=None):
     """Read data from a ELAN (eeg) file.
 
     Elan format specs: http: // elan.lyon.inserm.fr/
@@ -559,6 +499,12 @@ def read_elan(path, downsample):
         Filename(with full path) to Elan .eeg file
     downsample : int
         Down-sampling frequency.
+    preload : bool | True
+        Preload data in memory. If False, data are memory-mapped and returned
+        as a LazySleepData object.
+    picks : string, list | None
+        Channels to load (only the selected channels are read and decoded).
+        See visbrain.utils.pick_channels.
 
     Returns
     -------
@@ -575,6 +521,211 @@ def read_elan(path, downsample):
     annotations : array_like
         Array of annotations.
     """
+    hdr = _elan_header(path)
+    sf, chan, n, start_time = [hdr[k] for k in ['sf', 'channels', 'n',
+                                                'start_time']]
+
+    # Get down-sample factor :
+    dsf, downsample = get_dsf(downsample, sf)
+
+    # Multiply by gain and down-sample the selected channels chunk by chunk
+    # (the last two channels do not contain data) :
+    m_raw = np.memmap(path, dtype=hdr['dtype'], mode='r',
+                      shape=(n, hdr['n_chan']))
+    idx = pick_channels(chan, picks)
+    chan = [chan[k] for k in idx]
+    reader = multiplexed_reader(m_raw, hdr['gain'])
+    data = LazySleepData(lambda c, start, stop: reader(idx[c], start, stop),
+                         len(idx), n, dsf)
+    if preload:
+        data = np.asarray(data)
+
+    return sf, downsample, dsf, data, chan, n, start_time, None
+
+
+###############################################################################
+###############################################################################
+#                               READ HEADERS
+###############################################################################
+###############################################################################
+
+def _edf_header(path):
+    """Read the header of a European Data Format (edf / bdf) file."""
+    assert os.path.isfile(path)
+
+    from ..utils.sleep.edf import Edf
+
+    edf = Edf(path)
+
+    # Return header informations
+    _, start_time, sf, chan, _, _ = edf.return_hdr()
+    start_time = start_time.time()
+
+    # Keep only data channels (excludes the trigger, annotation and marker
+    # channels) :
+    n_per_record = np.asarray(edf.hdr['n_samples_per_record'])
+    is_data = np.array([k.strip().lower() not in EDF_NON_DATA for k in chan])
+    sf = n_per_record[is_data].max()
+    is_data &= n_per_record == sf
+    chan = [k for k, keep in zip(chan, is_data) if keep]
+    n_samples = int(sf * edf.hdr['n_records'])
+
+    return {'sf': float(sf), 'channels': chan, 'n': n_samples,
+            'start_time': start_time, 'annotations': None, 'edf': edf}
+
+
+def _trc_header(path):
+    """Read the header of a Micromed (trc) file (version 4)."""
+    import struct
+
+    def read_f(f, fmt):
+        return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+
+    with io.open(path, 'rb') as f:
+        # Read header
+        f.seek(175, 0)
+        header_version, = read_f(f, 'b')
+        assert header_version == 4
+
+        f.seek(138, 0)
+        data_start_offset, n_chan, _, sf, nbytes = read_f(f, 'IHHHH')
+
+        f.seek(128, 0)
+        day, month, year, hour, minute, sec = read_f(f, 'bbbbbb')
+        start_time = datetime.time(hour, minute, sec)
+
+        f.seek(176, 0)
+        zone_names = ['ORDER', 'LABCOD']
+        zones = {}
+        for zname in zone_names:
+            zname2, pos, length = read_f(f, '8sII')
+            zones[zname] = zname2, pos, length
+
+        # Order of the stored channels :
+        zname2, pos, length = zones['ORDER']
+        f.seek(pos, 0)
+        code = np.fromfile(f, dtype='<u2', count=n_chan)
+
+        # Electrodes definitions (parsed at once) :
+        zname2, pos, length = zones['LABCOD']
+        f.seek(pos, 0)
+        elec = np.frombuffer(f.read(length), dtype=TRC_ELECTRODE,
+                             count=length // TRC_ELECTRODE.itemsize)[code]
+
+    # Get label / gain / ground :
+    chan = [k.decode('utf-8', 'ignore').strip('\x00 ') for k in
+            elec['positive_input']]
+    logical_ground = elec['logical_ground'].astype(float)
+    gain = (elec['physical_max'] - elec['physical_min']).astype(float) / (
+        elec['logical_max'] - elec['logical_min'] + 1.)
+
+    # Get original signal length :
+    n = int((os.path.getsize(path) - data_start_offset) / (nbytes * n_chan))
+
+    return {'sf': float(sf), 'channels': chan, 'n': n,
+            'start_time': start_time, 'annotations': None, 'gain': gain,
+            'offset': -logical_ground * gain, 'nbytes': nbytes,
+            'data_offset': data_start_offset}
+
+
+def _read_brainvision_ini(path):
+    """Read a BrainVision header (.vhdr) or marker (.vmrk) file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+
+    Returns
+    -------
+    sections : dict
+        Dictionary of sections. Each section is a dictionary of
+        (key, value) strings.
+    """
+    sections, current = {}, {}
+    with io.open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(';'):
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                current = sections.setdefault(line[1:-1], {})
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                current[key.strip()] = value.strip()
+    return sections
+
+
+def _eeg_header(path, read_markers=False):
+    """Read the header (and markers) of a BrainVision (*.vhdr) file."""
+    assert os.path.isfile(path)
+    binary_formats = {'INT_16': 'i2', 'INT_32': 'i4', 'IEEE_FLOAT_32': 'f4'}
+
+    # Read header
+    hdr = _read_brainvision_ini(path)
+    common = hdr['Common Infos']
+    binary = hdr.get('Binary Infos', {})
+    data_path = os.path.join(os.path.dirname(path), common['DataFile'])
+    assert os.path.isfile(data_path)
+    marker_path = os.path.join(os.path.dirname(path),
+                               common.get('MarkerFile', ''))
+    n_chan = int(common['NumberOfChannels'])
+    sf = 1e6 / float(common['SamplingInterval'])
+    data_orient = common.get('DataOrientation', 'MULTIPLEXED')
+    binary_format = binary.get('BinaryFormat', 'INT_16')
+
+    # Check binary format
+    if common.get('DataFormat', 'BINARY') != 'BINARY':
+        raise IOError("Only binary BrainVision files are supported.")
+    if binary_format not in binary_formats:
+        raise IOError("%s BrainVision files are not supported. Use one of "
+                      "%s." % (binary_format, ', '.join(binary_formats)))
+    if data_orient not in ['MULTIPLEXED', 'VECTORIZED']:
+        raise IOError("%s data orientation is not supported." % data_orient)
+    endian = '>' if binary.get('UseBigEndianOrder') == 'YES' else '<'
+    dtype = np.dtype(endian + binary_formats[binary_format])
+
+    # Extract channel labels and resolution (Chn=name,ref,resolution,unit)
+    chan, resolution = [], np.ones((n_chan,), dtype=float)
+    for k in range(n_chan):
+        info = hdr['Channel Infos']['Ch%i' % (k + 1)].split(',')
+        chan.append(info[0].replace('\\1', ','))
+        if (len(info) > 2) and info[2]:
+            resolution[k] = float(info[2])
+
+    # Read marker file (if present) to extract recording time
+    start_time = datetime.time(0, 0, 0)
+    anot = None
+    if os.path.isfile(marker_path):
+        # Mkn=type,description,position,size,channel[,date]
+        markers = [k.split(',') for k in _read_brainvision_ini(
+            marker_path).get('Marker Infos', {}).values()]
+        # Read start-time
+        for mk in markers:
+            if (mk[0] == 'New Segment') and (len(mk) > 5) and mk[5]:
+                st = mk[5]
+                start_time = datetime.time(int(st[8:10]), int(st[10:12]),
+                                           int(st[12:14]))
+                break
+
+        # Read markers
+        if read_markers and markers:
+            onsets = np.array([float(k[2]) - 1. for k in markers]) / sf
+            durations = np.array([float(k[3]) for k in markers]) / sf
+            descriptions = [k[1] for k in markers]
+            anot = np.c_[onsets, onsets + durations, descriptions]
+
+    # Get original signal length :
+    n = int(os.path.getsize(data_path) / (dtype.itemsize * n_chan))
+
+    return {'sf': float(sf), 'channels': chan, 'n': n,
+            'start_time': start_time, 'annotations': anot,
+            'data_path': data_path, 'dtype': dtype,
+            'orientation': data_orient, 'resolution': resolution}
+
+
+def _elan_header(path):
+    """Read the header (.ent file) of an ELAN (eeg) file."""
     header = path + '.ent'
 
     assert os.path.isfile(path)
@@ -584,7 +735,8 @@ def read_elan(path, downsample):
     ent = np.genfromtxt(header, delimiter='\n', usecols=[0],
                         dtype=None, skip_header=0)
 
-    ent = np.char.decode(ent)
+    if ent.dtype.kind == 'S':  # bytes with numpy < 2
+        ent = np.char.decode(ent)
 
     # eeg file version
     eeg_version = ent[0]
@@ -608,12 +760,10 @@ def read_elan(path, downsample):
         start_time = datetime.time(0, 0, 0)
 
     # Channels
-    nb_chan = np.int(ent[9])
-    nb_chan = nb_chan
+    nb_chan = int(ent[9])
 
     # Last 2 channels do not contain data
     nb_chan_data = nb_chan - 2
-    chan_list = slice(nb_chan_data)
     chan = ent[10:10 + nb_chan_data]
 
     # Gain
@@ -634,23 +784,10 @@ def read_elan(path, downsample):
     if gain.dtype != np.float32:
         gain = gain.astype(np.float32, copy=False)
 
-    # Load memmap
-    nb_bytes = os.path.getsize(path)
-    nb_samples = int(nb_bytes / (nb_oct * nb_chan))
-
-    m_raw = np.memmap(path, dtype=formread, mode='r',
-                      shape=(nb_chan, nb_samples), order={'F'})
-
     # Get original signal length :
-    n = m_raw.shape[1]
-
-    # Get down-sample factor :
-    sf = float(sf)
-    chan = list(chan)
-    dsf, downsample = get_dsf(downsample, sf)
-
-    # Multiply by gain :
-    data = m_raw[chan_list, ::dsf] * \
-        gain[chan_list][..., np.newaxis]
+    nb_bytes = os.path.getsize(path)
+    n = int(nb_bytes / (nb_oct * nb_chan))
 
-    return sf, downsample, dsf, data, chan, n, start_time, None
+    return {'sf': float(sf), 'channels': list(chan), 'n': n,
+            'start_time': start_time, 'annotations': None, 'gain': gain,
+            'dtype': formread, 'n_chan': nb_chan}
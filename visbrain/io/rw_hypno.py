@@ -56,7 +56,7 @@ def write_hypno_txt(filename, hypno, sf, sfori, n, window=1.):
     ----------
     filename : str
         Filename (with full path) of the file to save
-    hypno : array_like
+    hypno : array_like | HypnoRuns
         Hypnogram array, same length as data
     sf : float
         Sampling frequency of the data (after downsampling)
@@ -74,9 +74,9 @@ def write_hypno_txt(filename, hypno, sf, sfori, n, window=1.):
     descript = os.path.join(dirname, os.path.splitext(
         base)[0] + '_description.txt')
 
-    # Save hypno
-    step = int(hypno.shape / np.round(n / sfori))
-    np.savetxt(filename, hypno[::step].astype(int), fmt='%s')
+    # Save hypno (only one value per window is read from the runs) :
+    step = int(len(hypno) / np.round(n / sfori))
+    np.savetxt(filename, np.asarray(hypno[::step]).astype(int), fmt='%s')
 
     # Save header file
     hdr = np.array([['time ' + str(window)], ['W 0'], ['N1 1'], ['N2 2'],
@@ -91,7 +91,7 @@ def write_hypno_hyp(filename, hypno, sf, sfori, n):
     ----------
     filename : str
         Filename (with full path) of the file to save
-    hypno : array_like
+    hypno : array_like | HypnoRuns
         Hypnogram array, same length as data
     sf : int
         Sampling frequency of the data (after downsampling)
@@ -102,9 +102,9 @@ def write_hypno_hyp(filename, hypno, sf, sfori, n):
     """
     # Check data format
     sf = int(sf)
-    hypno = hypno.astype(int)
+    step = int(len(hypno) / np.round(n / sfori))
+    hypno = np.asarray(hypno[::step]).astype(int)
     hypno[hypno == 4] = 5
-    step = int(hypno.shape / np.round(n / sfori))
 
     hdr = np.array([['time_base 1.000000'],
                     ['sampling_period ' + str(np.round(1 / sfori, 8))],
@@ -112,7 +112,7 @@ def write_hypno_hyp(filename, hypno, sf, sfori, n):
                     ['epoch_list']]).flatten()
 
     # Save
-    export = np.append(hdr, hypno[::step].astype(str))
+    export = np.append(hdr, hypno.astype(str))
     np.savetxt(filename, export, fmt='%s')
 
 
@@ -0,0 +1,310 @@
+"""Persistent cache of decoded sleep data.
+
+This file contains :
+- SleepCache : on-disk cache of decoded and down-sampled sleep recordings
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import datetime
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from .download import path_to_visbrain_data
+from .read_annotations import annotations_to_array
+from .lazy_sleep import LazySleepData, memmap_reader
+
+logger = logging.getLogger('visbrain')
+
+__all__ = ['SleepCache']
+
+
+class SleepCache(object):
+    """On-disk cache of decoded and down-sampled sleep recordings.
+
+    Each entry stores the float32 down-sampled data (as a .npy file, which
+    is memory-mapped on reading) and a json file with the channel names,
+    sampling frequencies, time offset and annotations. Entries are keyed on
+    the path, size and modification time of the file, the down-sampling
+    frequency, the channel selection and the reader used. When the total size
+    of the cache exceeds max_size, the least recently used entries are
+    removed. The index of the cache is protected by a lock file, so that
+    several processes can share the same cache.
+
+    Parameters
+    ----------
+    folder : string | None
+        Path to the cache folder. If None, the cache is stored in the
+        visbrain_data/cache folder.
+    max_size : float | 10e9
+        Maximum size of the cache (in bytes).
+    """
+
+    def __init__(self, folder=None, max_size=10e9):
+        """Init."""
+        if folder is None:
+            folder = path_to_visbrain_data(folder='cache')
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(self.folder, exist_ok=True)
+        self._index_file = os.path.join(self.folder, 'index.json')
+        self._lock_file = os.path.join(self.folder, 'index.lock')
+
+    def __len__(self):
+        """Return the number of entries in the cache."""
+        return len(self._read_index()['entries'])
+
+    def __contains__(self, key):
+        """Return if an entry is in the cache."""
+        return key in self._read_index()['entries']
+
+    # ----------- INDEX -----------
+    def _read_index(self):
+        """Read the index of the cache."""
+        index = {'entries': {}, 'stats': {'hits': 0, 'misses': 0,
+                                          'evictions': 0}}
+        if os.path.isfile(self._index_file):
+            try:
+                with open(self._index_file, 'r') as f:
+                    index.update(json.load(f))
+            except ValueError:
+                logger.warning("Corrupted cache index. The cache is reset.")
+        return index
+
+    def _write_index(self, index):
+        """Write the index of the cache (atomic)."""
+        tmp = self._index_file + '.tmp%i' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_file)
+
+    @contextmanager
+    def _lock(self, timeout=60.):
+        """Lock the cache (shared between processes).
+
+        Locks older than timeout seconds are considered to be left by a
+        process that crashed and are removed.
+        """
+        while True:
+            try:
+                fd = os.open(self._lock_file,
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(self._lock_file)
+                except OSError:  # the lock has just been released
+                    continue
+                if age > timeout:
+                    logger.warning("Stale lock of the cache removed")
+                    try:
+                        os.remove(self._lock_file)
+                    except OSError:
+                        pass
+                else:
+                    time.sleep(.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(self._lock_file)
+
+    def _update_index(self, fcn):
+        """Read, modify (with fcn(index)) and write the index (locked).
+
+        Returns the output of fcn.
+        """
+        with self._lock():
+            index = self._read_index()
+            out = fcn(index)
+            self._write_index(index)
+        return out
+
+    def _entry_path(self, key, file=''):
+        """Get the path to an entry of the cache."""
+        return os.path.join(self.folder, key, file)
+
+    # ----------- KEY / LOAD / SAVE -----------
+    @staticmethod
+    def key(path, downsample, channels=None, reader='sleep'):
+        """Get the key of a file.
+
+        Parameters
+        ----------
+        path : string
+            Path to the file.
+        downsample : float | None
+            Down-sampling frequency.
+        channels : list | None
+            List of selected channels (None for all channels).
+        reader : string | 'sleep'
+            Name (and parameters) of the reader used to load the file.
+
+        Returns
+        -------
+        key : string
+            The key of the file in the cache.
+        """
+        stat = os.stat(path)
+        desc = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                downsample, channels, reader]
+        return hashlib.sha1(json.dumps(desc, default=str).encode()).hexdigest()
+
+    def load(self, key, preload=True):
+        """Load an entry of the cache.
+
+        Parameters
+        ----------
+        key : string
+            The key of the file (see SleepCache.key).
+        preload : bool | True
+            If True, the data are returned as a copy-on-write memory-mapped
+            array. If False, a LazySleepData object is returned.
+
+        Returns
+        -------
+        args : tuple | None
+            Tuple (sf, downsample, dsf, data, channels, n, start_time,
+            annotations) as returned by the sleep readers or None if the key
+            is not in the cache.
+        """
+        data_file = self._entry_path(key, 'data.npy')
+
+        def check(index):
+            if (key in index['entries']) and os.path.isfile(data_file):
+                index['entries'][key]['last_access'] = time.time()
+                index['stats']['hits'] += 1
+                return True
+            index['entries'].pop(key, None)
+            index['stats']['misses'] += 1
+            return False
+        if not self._update_index(check):
+            return None
+        with open(self._entry_path(key, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if preload:
+            data = np.load(data_file, mmap_mode='c')
+        else:
+            data = np.load(data_file, mmap_mode='r')
+            data = LazySleepData(memmap_reader(data, np.ones(len(data))),
+                                 *data.shape)
+        annot = np.array(meta['annotations']) if meta['annotations'] else None
+        logger.info("Data loaded from the cache (%s)" % meta['file'])
+        return (meta['sf'], meta['downsample'], meta['dsf'], data,
+                meta['channels'], meta['n'],
+                datetime.time(*meta['start_time']), annot)
+
+    def save(self, key, args, file='', chunk=2 ** 20):
+        """Save data into the cache.
+
+        Parameters
+        ----------
+        key : string
+            The key of the file (see SleepCache.key).
+        args : tuple
+            Tuple (sf, downsample, dsf, data, channels, n, start_time,
+            annotations) as returned by the sleep readers.
+        file : string | ''
+            Name of the cached file (only used for information).
+        chunk : int | 2 ** 20
+            Number of time points written at once.
+
+        Notes
+        -----
+        Data loaded lazily (LazySleepData) are not cached : filling the cache
+        would decode the whole recording, while the lazy readers only decode
+        the displayed windows.
+        """
+        sf, downsample, dsf, data, channels, n, start_time, annot = args
+        if isinstance(data, LazySleepData):
+            logger.debug("Lazy data are not cached (%s)" % file)
+            return
+        n_bytes = 4 * data.shape[0] * data.shape[1]
+        if n_bytes > self.max_size:
+            logger.warning("Data are too large to be cached (%.1f Mo)" % (
+                n_bytes / 1e6))
+            return
+        self.evict(self.max_size - n_bytes)
+        # Write into a temporary folder then move it :
+        tmp = self._entry_path(key + '.tmp%i' % os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        mm = np.lib.format.open_memmap(os.path.join(tmp, 'data.npy'),
+                                       mode='w+', dtype=np.float32,
+                                       shape=tuple(data.shape))
+        for k in range(0, data.shape[1], chunk):
+            mm[:, k:k + chunk] = data[:, k:k + chunk]
+        mm.flush()
+        del mm
+        # Annotations are stored as (start, end, text) :
+        annot = np.c_[annotations_to_array(annot)].astype(str).tolist()
+        meta = {'file': file, 'sf': float(sf), 'dsf': int(dsf),
+                'downsample': None if downsample is None else float(
+                    downsample),
+                'channels': [str(k) for k in channels], 'n': int(n),
+                'start_time': [start_time.hour, start_time.minute,
+                               start_time.second, start_time.microsecond],
+                'annotations': annot}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        # Move the entry and update the index :
+        def add(index):
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            os.replace(tmp, self._entry_path(key))
+            index['entries'][key] = {'file': file, 'size': n_bytes,
+                                     'last_access': time.time()}
+        self._update_index(add)
+        logger.info("Data saved in the cache (%s)" % file)
+
+    # ----------- EVICTION -----------
+    def evict(self, max_size=None):
+        """Remove the least recently used entries.
+
+        Parameters
+        ----------
+        max_size : float | None
+            Size of the cache (in bytes) after eviction. If None, the
+            max_size attribute is used.
+        """
+        max_size = self.max_size if max_size is None else max_size
+
+        def remove(index):
+            entries = index['entries']
+            size = sum([k['size'] for k in entries.values()])
+            for key in sorted(entries,
+                              key=lambda k: entries[k]['last_access']):
+                if size <= max_size:
+                    break
+                size -= entries.pop(key)['size']
+                shutil.rmtree(self._entry_path(key), ignore_errors=True)
+                index['stats']['evictions'] += 1
+                logger.debug("Cache entry %s removed" % key)
+        self._update_index(remove)
+
+    def clear(self):
+        """Remove every entry of the cache."""
+        self.evict(0)
+
+    # ----------- PROPERTIES -----------
+    @property
+    def size(self):
+        """Get the size of the cache (in bytes)."""
+        entries = self._read_index()['entries']
+        return sum([k['size'] for k in entries.values()])
+
+    @property
+    def stats(self):
+        """Get the cache statistics.
+
+        Dictionary with the number of hits, misses, evictions, entries and
+        the size of the cache (in bytes).
+        """
+        index = self._read_index()
+        stats = index['stats'].copy()
+        stats['entries'] = len(index['entries'])
+        stats['size'] = sum([k['size'] for k in index['entries'].values()])
+        return stats
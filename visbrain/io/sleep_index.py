@@ -0,0 +1,225 @@
+"""Header-only probing and indexing of sleep files.
+
+This file contains :
+- read_sleep_header : read the metadata of a sleep file without loading data
+- SleepIndex : searchable index of the sleep files of a directory tree
+"""
+import os
+import json
+import logging
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+from .download import path_to_visbrain_data
+from .rw_utils import get_file_ext
+from .read_sleep import _edf_header, _trc_header, _eeg_header, _elan_header
+
+logger = logging.getLogger('visbrain')
+
+__all__ = ['read_sleep_header', 'SleepIndex']
+
+
+HEADER_READERS = {'.edf': _edf_header, '.bdf': _edf_header,
+                  '.rec': _edf_header,
+                  '.trc': _trc_header, '.vhdr': _eeg_header,
+                  '.eeg': _elan_header}
+
+
+def read_sleep_header(path):
+    """Read the metadata of a sleep file, without loading the data.
+
+    Only the header of the file is parsed. Supported files are .edf / .rec
+    (European Data Format), .bdf (BioSemi), .trc (Micromed), .vhdr
+    (BrainVision) and .eeg (ELAN).
+
+    Parameters
+    ----------
+    path : string
+        Path to the file.
+
+    Returns
+    -------
+    header : dict
+        Dictionary with the path, format, channels, sampling frequency (sf),
+        number of time points (n), duration (in seconds), start_time
+        ('hh:mm:ss'), size (in bytes) and modification time (mtime) of the
+        file.
+    """
+    file, ext = get_file_ext(path)
+    if ext not in HEADER_READERS:
+        raise ValueError("*" + ext + " files are currently not supported.")
+    hdr = HEADER_READERS[ext](path)
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'format': ext[1:],
+            'channels': [str(k) for k in hdr['channels']],
+            'sf': hdr['sf'], 'n': int(hdr['n']),
+            'duration': hdr['n'] / hdr['sf'],
+            'start_time': hdr['start_time'].strftime('%H:%M:%S'),
+            'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _is_sleep_file(path):
+    """Get if a file can be probed (ELAN files need their .ent header)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.eeg':
+        return os.path.isfile(path + '.ent')
+    return ext in HEADER_READERS
+
+
+class SleepIndex(object):
+    """Searchable index of the sleep files of a directory tree.
+
+    The index is a json file which contains the header of each file (see
+    read_sleep_header). Scanning a directory only parses the headers of
+    new or modified files (based on their size and modification time).
+
+    Parameters
+    ----------
+    index_file : string | None
+        Path to the json index file. If None, the index is stored in the
+        visbrain_data folder.
+    """
+
+    def __init__(self, index_file=None):
+        """Init."""
+        if index_file is None:
+            index_file = path_to_visbrain_data(file='sleep_index.json')
+        self.index_file = index_file
+        self.records = {}
+        if os.path.isfile(index_file):
+            with open(index_file, 'r') as f:
+                self.records = json.load(f)
+
+    def __len__(self):
+        """Return the number of indexed files."""
+        return len(self.records)
+
+    def __iter__(self):
+        """Iterate over the indexed headers."""
+        for k in sorted(self.records):
+            yield self.records[k]
+
+    def __getitem__(self, path):
+        """Get the header of an indexed file."""
+        return self.records[os.path.abspath(path)]
+
+    def save(self):
+        """Save the index (atomic)."""
+        folder = os.path.dirname(os.path.abspath(self.index_file))
+        os.makedirs(folder, exist_ok=True)
+        tmp = self.index_file + '.tmp%i' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(self.records, f)
+        os.replace(tmp, self.index_file)
+
+    def scan(self, folder, n_workers=8, recursive=True, save=True):
+        """Scan a directory and index its sleep files.
+
+        Parameters
+        ----------
+        folder : string
+            Path to the directory.
+        n_workers : int | 8
+            Number of threads used to read the headers.
+        recursive : bool | True
+            Scan sub-directories.
+        save : bool | True
+            Save the index once the directory is scanned.
+
+        Returns
+        -------
+        n_updated : int
+            Number of new or modified files.
+        """
+        folder = os.path.abspath(folder)
+        # List sleep files :
+        files = []
+        for root, dirs, names in os.walk(folder):
+            files += [os.path.join(root, k) for k in names]
+            if not recursive:
+                break
+        files = [k for k in files if _is_sleep_file(k)]
+        found = set(files)
+
+        # Remove files that do not exist anymore (only in the scanned
+        # directories) :
+        for path in list(self.records):
+            if recursive:
+                in_folder = os.path.commonpath([folder, path]) == folder
+            else:
+                in_folder = os.path.dirname(path) == folder
+            if in_folder and path not in found:
+                self.records.pop(path)
+
+        # Only read the headers of new / modified files :
+        def is_modified(path):
+            if path not in self.records:
+                return True
+            stat, rec = os.stat(path), self.records[path]
+            return (stat.st_size, stat.st_mtime) != (rec['size'],
+                                                     rec['mtime'])
+        to_read = [k for k in files if is_modified(k)]
+
+        def probe(path):
+            try:
+                return read_sleep_header(path)
+            except Exception as e:
+                logger.warning("Header of %s can not be read (%s)" % (path,
+                                                                      e))
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            headers = list(executor.map(probe, to_read))
+        for hdr in headers:
+            if hdr is not None:
+                self.records[hdr['path']] = hdr
+        logger.info("%i files indexed in %s (%i new or modified)" % (
+            len(files), folder, len(to_read)))
+        if save:
+            self.save()
+        return len(to_read)
+
+    def search(self, channels=None, min_duration=None, max_duration=None,
+               sf=None, pattern=None, fmt=None):
+        """Search files in the index.
+
+        Parameters
+        ----------
+        channels : list | None
+            List of channel names or glob patterns (case insensitive). Each
+            of them must match at least one channel of the file.
+        min_duration, max_duration : float | None
+            Minimum / maximum duration of the recording (in seconds).
+        sf : float | None
+            Sampling frequency.
+        pattern : string | None
+            Glob pattern that the path to the file must match.
+        fmt : string | None
+            File format (e.g. 'edf').
+
+        Returns
+        -------
+        headers : list
+            List of the headers of the matching files.
+        """
+        channels = [channels] if isinstance(channels, str) else channels
+        found = []
+        for hdr in self:
+            chans = [k.lower() for k in hdr['channels']]
+            if channels is not None and not all(
+                    [any([fnmatch(c, k.lower()) for c in chans])
+                     for k in channels]):
+                continue
+            if (min_duration is not None) and (hdr['duration'] <
+                                               min_duration):
+                continue
+            if (max_duration is not None) and (hdr['duration'] >
+                                               max_duration):
+                continue
+            if (sf is not None) and (hdr['sf'] != sf):
+                continue
+            if (pattern is not None) and not fnmatch(hdr['path'], pattern):
+                continue
+            if (fmt is not None) and (hdr['format'] != fmt.lower()):
+                continue
+            found.append(hdr)
+        return found
@@ -24,7 +24,7 @@ def write_fig_hyp(file, hypno, sf, tstartsec, grid=False, ascolor=False,
     ----------
     file : str
         Filename (with full path) to sleep dataset.
-    hypno : array_like
+    hypno : array_like | HypnoRuns
         Hypnogram vector
     sf : float
         The sampling frequency of displayed elements (could be the
@@ -46,7 +46,7 @@ def write_fig_hyp(file, hypno, sf, tstartsec, grid=False, ascolor=False,
 
     # Downsample to get one value per second
     sf = int(sf)
-    hypno = hypno[::sf]
+    hypno = np.array(hypno[::sf])
 
     # Put REM between Wake and N1 sleep
     hypno[hypno >= 1] += 1
@@ -4,9 +4,7 @@ from warnings import warn
 from PyQt5 import QtWidgets, QtCore
 import logging
 
-from ....utils import (remdetect, spindlesdetect, slowwavedetect, kcdetect,
-                       peakdetect, mtdetect)
-from ....utils.sleep.event import _events_to_index
+from ....utils import DetectionEngine, FeatureCache
 
 logger = logging.getLogger('visbrain')
 
@@ -30,6 +28,21 @@ class UiDetection(object):
         self._ToolRdAll.clicked.connect(self._fcn_applyMethod)
         self._ToolDetectProgress.hide()
         self._fcn_switchDetection()
+        # Detections run in background and results are displayed as soon as
+        # they are available. Feature traces are cached so that changing a
+        # threshold only runs the thresholding stage :
+        self._engine = DetectionEngine(self._sf, self._data, time=self._time,
+                                       cache=FeatureCache())
+        self._detectLast = (None, None)
+        self._detectTimer = QtCore.QTimer()
+        self._detectTimer.setInterval(50)
+        self._detectTimer.timeout.connect(self._fcn_detectionResults)
+        # Thresholds that are applied live, once the detection has been run :
+        for k in [self._ToolRemTh, self._ToolSpinTh, self._ToolSpinTmax,
+                  self._ToolWaveTh, self._ToolKCProbTh, self._ToolKCAmpTh,
+                  self._ToolKCMinDur, self._ToolKCMaxDur, self._ToolKCMinAmp,
+                  self._ToolKCMaxAmp, self._ToolMTTh]:
+            k.valueChanged.connect(self._fcn_liveDetection)
 
         # -------------------------------------------------
         # Location table :
@@ -91,98 +104,112 @@ class UiDetection(object):
         return idx
 
     # -------------- Run detection (only on selected channels) --------------
+    def _fcn_detectionSettings(self, method):
+        """Get the settings of a detection method from the GUI."""
+        # ====================== REM ======================
+        if method == 'REM':
+            return dict(threshold=self._ToolRemTh.value(),
+                        rem_only=self._ToolRemOnly.isChecked())
+
+        # ====================== SPINDLES ======================
+        elif method == 'Spindles':
+            return dict(threshold=self._ToolSpinTh.value(),
+                        fmin=self._ToolSpinFmin.value(),
+                        fmax=self._ToolSpinFmax.value(),
+                        tmin=self._ToolSpinTmin.value(),
+                        tmax=self._ToolSpinTmax.value(),
+                        nrem_only=self._ToolSpinRemOnly.isChecked())
+
+        # ====================== SLOW WAVES ======================
+        elif method == 'Slow waves':
+            return dict(threshold=self._ToolWaveTh.value())
+
+        # ====================== K-COMPLEXES ======================
+        elif method == 'K-complexes':
+            return dict(proba_thr=self._ToolKCProbTh.value(),
+                        amp_thr=self._ToolKCAmpTh.value(),
+                        tmin=self._ToolKCMinDur.value(),
+                        tmax=self._ToolKCMaxDur.value(),
+                        kc_min_amp=self._ToolKCMinAmp.value(),
+                        kc_max_amp=self._ToolKCMaxAmp.value(),
+                        nrem_only=self._ToolKCNremOnly.isChecked())
+
+        # ====================== PEAKS ======================
+        elif method == 'Peaks':
+            disp_types = ['max', 'min', 'minmax']
+            return dict(lookahead=int(self._ToolPeakLook.value() * self._sf),
+                        delta=1., threshold='auto',
+                        get=disp_types[self._ToolPeakMinMax.currentIndex()])
+
+        # ====================== MUSCLE TWITCHES ======================
+        elif method == 'Muscle twitches':
+            return dict(threshold=self._ToolMTTh.value(),
+                        rem_only=self._ToolMTOnly.isChecked())
+
     def _fcn_applyDetection(self):
-        """Apply detection (either REM/Spindles/Peaks/SlowWave/KC/MT)."""
+        """Apply detection (either REM/Spindles/Peaks/SlowWave/KC/MT).
+
+        The detection runs in background (see DetectionEngine) and results
+        are displayed channel by channel. Clicking again on the apply button
+        cancels a running detection.
+        """
+        # Cancel the running detection :
+        if self._engine.running:
+            self._engine.cancel()
+            self._fcn_detectionDone()
+            return
+        self._fcn_runDetection()
+
+    def _fcn_liveDetection(self):
+        """Run again the last detection when one of its thresholds changes.
+
+        Feature traces are cached by the engine, so only the thresholding
+        stage of the detection is run.
+        """
+        method = str(self._ToolDetectType.currentText())
+        if self._detectLast[0] == method:
+            self._fcn_runDetection()
+
+    def _fcn_runDetection(self):
+        """Start the detection (a running detection is canceled)."""
         # Get channels to apply detection and the detection method :
         idx = self._fcn_getChanDetection()
         method = str(self._ToolDetectType.currentText())
+        kwargs = self._fcn_detectionSettings(method)
 
         ############################################################
         # RUN DETECTION
         ############################################################
-        for i, k in enumerate(idx):
-            # Display progress bar (only if needed):
-            if len(idx) > 1:
-                self._ToolDetectProgress.show()
-
-            # Switch between detection types :
-            # ====================== REM ======================
-            if method == 'REM':
-                # Get variables :
-                thr = self._ToolRemTh.value()
-                rem_only = self._ToolRemOnly.isChecked()
-                # Get REM indices :
-                index, nb, dty, dur = remdetect(self._data[k, :], self._sf,
-                                                self._hypno, rem_only, thr)
-
-            # ====================== SPINDLES ======================
-            elif method == 'Spindles':
-                # Get variables :
-                thr = self._ToolSpinTh.value()
-                fMin = self._ToolSpinFmin.value()
-                fMax = self._ToolSpinFmax.value()
-                tMin = self._ToolSpinTmin.value()
-                tMax = self._ToolSpinTmax.value()
-                nrem_only = self._ToolSpinRemOnly.isChecked()
-                # Get Spindles indices :
-                index, nb, dty, dur = spindlesdetect(
-                    self._data[k, :], self._sf, thr, self._hypno, nrem_only,
-                    fMin, fMax, tMin, tMax)
-
-            # ====================== SLOW WAVES ======================
-            elif method == 'Slow waves':
-                # Get variables :
-                thr = self._ToolWaveTh.value()
-                # Get Slow Waves indices :
-                index, nb, dty, dur = slowwavedetect(self._data[k, :],
-                                                     self._sf, thr)
-
-            # ====================== K-COMPLEXES ======================
-            elif method == 'K-complexes':
-                # Get variables :
-                proba_thr = self._ToolKCProbTh.value()
-                amp_thr = self._ToolKCAmpTh.value()
-                tmin = self._ToolKCMinDur.value()
-                tmax = self._ToolKCMaxDur.value()
-                min_amp = self._ToolKCMinAmp.value()
-                max_amp = self._ToolKCMaxAmp.value()
-                nrem_only = self._ToolKCNremOnly.isChecked()
-                # Get Slow Waves indices :
-                index, nb, dty, dur = kcdetect(self._data[k, :], self._sf,
-                                               proba_thr, amp_thr, self._hypno,
-                                               nrem_only, tmin, tmax, min_amp,
-                                               max_amp)
-
-            # ====================== PEAKS ======================
-            elif method == 'Peaks':
-                # Get variables :
-                look = int(self._ToolPeakLook.value() * self._sf)
-                disp = self._ToolPeakMinMax.currentIndex()
-                disp_types = ['max', 'min', 'minmax']
-                index, nb, dty = peakdetect(self._sf, self._data[k, :],
-                                            self._time, lookahead=look,
-                                            delta=1., threshold='auto',
-                                            get=disp_types[disp])
-
-            # ====================== MUSCLE TWITCHES ======================
-            elif method == 'Muscle twitches':
-                # Get variables :
-                th = self._ToolMTTh.value()
-                rem_only = self._ToolMTOnly.isChecked()
-                index, nb, dty, dur = mtdetect(self._data[k, :], self._sf, th,
-                                               self._hypno, rem_only)
-
+        # The hypnogram is sent as a per-sample mask :
+        self._engine.set_data(self._data, self._hypno)
+        self._detectLast = (method, None)
+        self._engine.run(method, idx, **kwargs)
+        # Display progress bar (only if needed):
+        if len(idx) > 1:
+            self._ToolDetectProgress.setValue(0)
+            self._ToolDetectProgress.show()
+        self._ToolDetectApply.setText('Cancel')
+        self._detectTimer.start()
+
+    def _fcn_detectionResults(self):
+        """Display the detection results computed in background."""
+        method, _ = self._detectLast
+        for k, index, nb, dty in self._engine.poll():
+            if index is None:
+                continue
             logger.info(("Perform %s detection on channel %s. %i events "
                          "detected.") % (method, self._channels[k], nb))
+            self._detectLast = (method, (k, index, nb, dty))
+            # Events of a previous run are replaced :
+            key = (self._channels[k], method)
+            if not index.size and self._detect.dict[key]['index'].size:
+                self._detect.dict[key]['index'] = np.array([])
+                self._fcn_sliderMove()
 
             if index.size:
                 # Enable detection tab :
                 self._DetectionTab.setTabEnabled(1, True)
                 # Update index for this channel and detection :
-                if method == 'Peaks':
-                    index = np.c_[index, index]
-                else:
-                    index = _events_to_index(index)
                 self._detect.dict[(self._channels[k], method)]['index'] = index
                 # Be sure panel is displayed :
                 if not self.canvas_isVisible(k):
@@ -192,22 +219,31 @@ class UiDetection(object):
                 # Update plot :
                 self._fcn_sliderMove()
 
-            # Update progress bar :
-            self._ToolDetectProgress.setValue(100. * (i + 1) / len(self))
+        # Update progress bar :
+        n_done, n_todo = self._engine.progress
+        self._ToolDetectProgress.setValue(int(100. * n_done / max(n_todo, 1)))
+        if not self._engine.running:
+            self._fcn_detectionDone()
+
+    def _fcn_detectionDone(self):
+        """Report the results once the detection is over (or canceled)."""
+        self._detectTimer.stop()
+        self._ToolDetectApply.setText('Apply')
+        method, last = self._detectLast
 
         ############################################################
         # NUMBER // DENSITY
         ############################################################
-        if index.size:
+        if (last is not None) and last[1].size:
             # Report results on table :
             self._ToolDetectTable.setRowCount(1)
             self._ToolDetectTable.setItem(0, 0, QtWidgets.QTableWidgetItem(
-                str(nb)))
+                str(last[2])))
             self._ToolDetectTable.setItem(0, 1, QtWidgets.QTableWidgetItem(
-                str(round(dty, 2))))
-        else:
+                str(round(last[3], 2))))
+        elif last is not None:
             warn("\nNo " + method + " detected on channel " + self._channels[
-                 k] + ". Try to decrease the threshold")
+                 last[0]] + ". Try to decrease the threshold")
 
         ############################################################
         # LINE REPORT :
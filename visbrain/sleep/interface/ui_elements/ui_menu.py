@@ -5,10 +5,10 @@ import numpy as np
 import os
 from PyQt5 import QtWidgets
 
-from ....utils import HelpMenu
+from ....utils import HelpMenu, HypnoRuns
 from ....io import (dialogSave, dialogLoad, write_fig_hyp, write_csv,
                     write_txt, write_hypno_txt, write_hypno_hyp, read_hypno,
-                    annotations_to_array, oversample_hypno)
+                    annotations_to_array)
 
 
 class UiMenu(HelpMenu):
@@ -291,8 +291,8 @@ class UiMenu(HelpMenu):
                                   "All files (*.*)")
         if filename:
             # Load the hypnogram :
-            self._hypno, _ = read_hypno(filename)
-            self._hypno = oversample_hypno(self._hypno, self._N)[::self._dsf]
+            hypno, _ = read_hypno(filename)
+            self._hypno = HypnoRuns.from_epochs(hypno, self._N, self._dsf)
             self._hyp.set_data(self._sf, self._hypno, self._time)
             # Update info table :
             self._fcn_infoUpdate()
@@ -551,7 +551,7 @@ class UiMenu(HelpMenu):
     ###########################################################################
     def settCleanHyp(self):
         """Clean the hypnogram."""
-        self._hypno = np.zeros((len(self._hyp),), dtype=np.float32)
+        self._hypno = HypnoRuns.zeros(len(self._hyp))
         self._hyp.clean(self._sf, self._time)
         # Update info table :
         self._fcn_infoUpdate()
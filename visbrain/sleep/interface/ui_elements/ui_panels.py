@@ -432,10 +432,10 @@ class UiPanels(object):
             cmap += '_r'
         self._specLabel.setText(self._addspace + self._channels[chan])
         # Set data :
-        self._spec.set_data(self._sf, self._data[chan, ...], self._time,
+        self._spec.set_data(self._sf, self._data, self._time,
                             nfft=nfft, overlap=over, fstart=fstart, fend=fend,
                             cmap=cmap, contrast=contrast, interp=interp,
-                            norm=norm)
+                            norm=norm, chan=chan, background=True)
         # Set apply button disable :
         self._PanSpecApply.setEnabled(False)
 
@@ -2,7 +2,7 @@
 import numpy as np
 from PyQt5 import QtWidgets
 
-from ....utils import transient
+from ....utils import transient, HypnoRuns
 
 
 class UiScoring(object):
@@ -51,20 +51,21 @@ class UiScoring(object):
         """Update hypno data from hypno score."""
         if self._scoreSet:
             # Reset hypnogram :
-            self._hypno = np.zeros((len(self._time)), dtype=np.float32)
+            self._hypno = HypnoRuns.zeros(len(self._time))
             # Loop over table row :
             for k in range(self._scoreTable.rowCount()):
                 # Get tstart / tend / stage :
                 tstart, tend, stage = self._get_scoreMarker(k)
                 # Update pos if not None :
                 if tstart is not None:
-                    self._hypno[tstart:tend] = stage
+                    self._hypno.set_stage(tstart, tend, stage)
                     self._hyp.set_stage(tstart, tend, stage)
             if self._enabhypedit:
                 # Reset markers points position and color :
                 self._hypedit.pos = np.array([])
                 # Update hypnogram :
-                self._hypedit._transient(-self._hypno, self._time)
+                self._hypedit._transient(-self._hypno.to_array(),
+                                         self._time)
                 self._hypedit.color = np.tile(self._hypedit.color_static,
                                               (self._hypedit.pos.shape[0], 1))
                 self._hyp.edit.set_data(pos=self._hypedit.pos,
@@ -5,6 +5,8 @@ from PyQt5.QtCore import QObjectCleanupHandler
 
 import vispy.visuals.transforms as vist
 
+from ....utils import time_to_index
+
 
 class UiSettings(object):
     """Main class for settings managment."""
@@ -17,6 +19,7 @@ class UiSettings(object):
         self._slFrame.setMaximumHeight(100)
         # Function applied when the slider move :
         self._slOnStart = False
+        self._slLastVal = 0
         self._fcn_sliderSettings()
         self._SlVal.valueChanged.connect(self._fcn_sliderMove)
         # Function applied when slider's settings changed :
@@ -55,9 +58,8 @@ class UiSettings(object):
         iszoom = self.menuDispZoom.isChecked()
         unit = str(self._slRules.currentText())
         # Find closest time index :
-        t = [0, 0]
-        t[0] = int(round(np.abs(self._time - xlim[0]).argmin()))
-        t[1] = int(round(np.abs(self._time - xlim[1]).argmin()))
+        t = [time_to_index(xlim[0], self._time),
+             time_to_index(xlim[1], self._time)]
         # Hypnogram info :
         hypref = int(self._hypno[t[0]])
         hypconv = self._hconv[hypref]
@@ -87,8 +89,8 @@ class UiSettings(object):
         # Update topoplot if visible :
         if self._topoW.isVisible():
             # Prepare data before plotting :
-            data = self._topo._prepare_data(self._sf, self._data[:, sl],
-                                            self._time[sl]).mean(1)
+            data = self._topo.get_window(self._sf, self._data, self._time,
+                                         t[0], t[1])
             # Set preprocessed sleep data :
             self._topo.set_sleep_topo(data)
             # Update title :
@@ -105,6 +107,20 @@ class UiSettings(object):
             self._TimeAxis.set_data(xlim[0], win, self._time, unit=unit,
                                     markers=self._annot_mark)
 
+        # ---------------------------------------
+        # Prefetch the next and previous windows (in the scroll direction) :
+        direction = -1 if val < self._slLastVal else 1
+        self._slLastVal = val
+        windows = []
+        for k in [direction, -direction]:
+            sta = time_to_index((val + k) * step, self._time)
+            end = time_to_index((val + k) * step + win, self._time)
+            if end > sta:
+                windows.append((sta, end))
+        self._chan.prefetch(self._sf, self._data, self._time, windows)
+        if self._topoW.isVisible():
+            self._topo.prefetch(self._sf, self._data, self._time, windows)
+
         # ================= GUI =================
         # Update Go to :
         self._SlGoto.setValue(val * step)
@@ -240,11 +256,10 @@ class UiSettings(object):
         step = self._SigSlStep.value()
         xlim = (val * step, val * step + win)
         # Find closest time index :
-        t = [0, 0]
-        t[0] = int(round(np.abs(self._time - xlim[0]).argmin()))
-        t[1] = int(round(np.abs(self._time - xlim[1]).argmin()))
+        t = [time_to_index(xlim[0], self._time),
+             time_to_index(xlim[1], self._time)]
         # Set the stage :
-        self._hypno[t[0]:t[1]] = stage
+        self._hypno.set_stage(t[0], t[1], stage)
         self._hyp.set_stage(t[0], t[1], stage)
         # # Update info table :
         self._fcn_infoUpdate()
@@ -4,6 +4,7 @@ import numpy as np
 from PyQt5 import QtWidgets
 from ....utils import (rereferencing, bipolarization, find_non_eeg,
                        commonaverage)
+from ....io import LazySleepData
 
 
 class UiTools(object):
@@ -71,6 +72,10 @@ class UiTools(object):
 
     def _fcn_refApply(self):
         """Apply re-referencing."""
+        # Channels of a running detection would not be valid anymore :
+        if self._engine.running:
+            self._engine.cancel()
+            self._fcn_detectionDone()
         # By default, ingore non-eeg channel :
         to_ignore = self._noneeg
         if self._ToolsRefIgn.isChecked():
@@ -80,6 +85,14 @@ class UiTools(object):
                 # Set to ignore :
                 to_ignore[idinlst] = k.isChecked()
 
+        # For lazy data, the re-referencing is applied to an identity matrix
+        # in order to get the montage to use on reading :
+        is_lazy = isinstance(self._data, LazySleepData)
+        if is_lazy:
+            data = np.eye(len(self._channels), dtype=np.float32)
+        else:
+            data = self._data
+
         # Get the current selected method :
         idx = int(self._ToolsRefMeth.currentIndex())
         # Single channel :
@@ -87,22 +100,34 @@ class UiTools(object):
             # Get selected channel :
             idchan = idx = self._ToolsRefLst.currentIndex()
             # Re-referencing :
-            self._data, self._channels, consider = rereferencing(
-                self._data, self._channels, idchan,
+            data, self._channels, consider = rereferencing(
+                data, self._channels, idchan,
                 to_ignore)
             self._chanChecks[idx].setChecked(False)
         elif idx == 1:  # Common average
-            self._data, self._channels, consider = commonaverage(
-                self._data, self._channels, to_ignore)
+            data, self._channels, consider = commonaverage(
+                data, self._channels, to_ignore)
         elif idx == 2:  # Bipolarization
-            self._data, self._channels, consider = bipolarization(
-                self._data, self._channels,
+            data, self._channels, consider = bipolarization(
+                data, self._channels,
                 to_ignore)
 
+        if is_lazy:
+            montage = self._data.montage
+            self._data.montage = data if montage is None else data.dot(
+                montage)
+        else:
+            self._data = data
+
         # ____________________ Update ____________________
         aM = np.argmax(consider)
         # Update data info :
         self._get_data_info()
+        self._chan.set_pyramid(self._data, background=True)
+        if self._prepared is not None:
+            self._prepared.set_data(self._data)
+        self._topo.windows.clear()
+        self._spec.powers.clear()
 
         # Update and clear detections :
         self._DetectLocations.setRowCount(0)
@@ -8,7 +8,7 @@ from .visuals import Visuals
 from .tools import Tools
 from ..pyqt_module import PyQtModule
 from ..utils import (FixedCam, color2vb, MouseEventControl)
-from ..io import ReadSleepData
+from ..io import ReadSleepData, LazySleepData
 from ..config import profiler
 
 
@@ -45,7 +45,8 @@ class Sleep(PyQtModule, ReadSleepData, UiInit, Visuals, UiElements, Tools,
     sf : float | None
         The sampling frequency of raw data.
     downsample : float | 100.
-        The downsampling frequency for the data and hypnogram raw data.
+        The downsampling frequency for the data and hypnogram raw data. Data
+        are low-pass filtered (anti-aliasing) before being down-sampled.
     axis : bool | False
         Specify if each axis have to contains its own axis. Be carefull
         with this option, the rendering can be much slower.
@@ -64,19 +65,36 @@ class Sleep(PyQtModule, ReadSleepData, UiInit, Visuals, UiElements, Tools,
     ..versionadded:: 0.3.4
     preload : bool | True
         Preload data into memory. For large datasets, turn this parameter to
-        True.
+        False : natively supported files are then memory-mapped and only the
+        displayed / analyzed portions of data are decoded on demand.
     use_mne : bool | False
         Force to load the file using mne.io functions.
     kwargs_mne : dict | {}
         Dictionary to pass to the mne.io loading function.
+    use_cache : bool | False
+        Keep the decoded and down-sampled data in an on-disk cache (in the
+        visbrain_data/cache folder). Opening the same file again with the
+        same parameters is then much faster. Files loaded with
+        preload=False are not cached. See visbrain.io.SleepCache.
+    picks : string, list | None
+        Channels to load from the file. Only these channels are read and
+        decoded. Use None to load all channels, 'eeg' to exclude non-EEG
+        channels or a list of channel names, glob patterns (e.g. ['C*',
+        'EOG*']) and / or channel indices.
+    whole_prep : bool | False
+        Apply the de-meaning, de-trending and filtering once over the whole
+        recording (in a background thread) instead of on each displayed
+        window. Scrolling then only slices the prepared data, and the
+        filtered signal has no transient at the window borders.
 
     Notes
     -----
     .. note::
         * Supported polysomnographic files : by default, Sleep support .vhdr
-          (BrainVision), .eeg (Elan), .trc (Micromed) and .edf (European Data
-          Format). If mne-python is installed, this default list of supported
-          files is extended to .cnt, .egi, .mff, .edf, .bdf, .gdf, .set, .vhdr.
+          (BrainVision), .eeg (Elan), .trc (Micromed), .edf (European Data
+          Format) and .bdf (BioSemi). If mne-python is installed, this
+          default list of supported files is extended to .cnt, .egi, .mff,
+          .edf, .bdf, .gdf, .set, .vhdr.
         * Supproted hypnogram files : by default, Sleep support .txt, .csv and
           .hyp hypnogram files.
 
@@ -89,7 +107,8 @@ class Sleep(PyQtModule, ReadSleepData, UiInit, Visuals, UiElements, Tools,
                  annotations=None, channels=None, sf=None, downsample=100.,
                  axis=False, line='gl', hedit=False, use_tf=False,
                  href=['art', 'wake', 'rem', 'n1', 'n2', 'n3'],
-                 preload=True, use_mne=False, kwargs_mne={}, verbose=None):
+                 preload=True, use_mne=False, kwargs_mne={}, use_cache=False,
+                 picks=None, whole_prep=False, verbose=None):
         """Init."""
         PyQtModule.__init__(self, verbose=verbose, icon='sleep_icon.svg')
         # ====================== APP CREATION ======================
@@ -105,7 +124,7 @@ class Sleep(PyQtModule, ReadSleepData, UiInit, Visuals, UiElements, Tools,
         profiler("Import file", as_type='title')
         ReadSleepData.__init__(self, data, channels, sf, hypno, href, preload,
                                use_mne, downsample, kwargs_mne,
-                               annotations)
+                               annotations, use_cache, picks)
 
         # ====================== VARIABLES ======================
         # Check all data :
@@ -115,6 +134,8 @@ class Sleep(PyQtModule, ReadSleepData, UiInit, Visuals, UiElements, Tools,
         self._ax = axis
         self._enabhypedit = hedit
         self._use_tf = use_tf
+        self._whole_prep = whole_prep
+        self._prepared = None
         # ---------- Default line width ----------
         self._linemeth = line
         self._lw = 1.
@@ -186,9 +207,14 @@ class Sleep(PyQtModule, ReadSleepData, UiInit, Visuals, UiElements, Tools,
     ###########################################################################
     def _get_data_info(self):
         """Get some info about data (min, max, std, mean, dist)."""
-        self._datainfo = {'min': self._data.min(1), 'max': self._data.max(1),
-                          'std': self._data.std(1), 'mean': self._data.mean(1),
-                          'dist': self._data.max(1) - self._data.min(1)}
+        if isinstance(self._data, LazySleepData):
+            # Single pass over the recording :
+            dmin, dmax, mean, std = self._data.stats(1)
+        else:
+            dmin, dmax = self._data.min(1), self._data.max(1)
+            mean, std = self._data.mean(1), self._data.std(1)
+        self._datainfo = {'min': dmin, 'max': dmax, 'std': std, 'mean': mean,
+                          'dist': dmax - dmin}
 
     def _set_default_state(self):
         """Set the default window state."""
@@ -15,7 +15,8 @@ class Tools(object):
         # =========== HYPNOGRAM EDITION ===========
         yaxis = (self._hypcam.rect.bottom, self._hypcam.rect.top)
         if self._enabhypedit:
-            self._hypedit = HypnoEdition(self._sf, self._hyp, -self._hypno,
+            self._hypedit = HypnoEdition(self._sf, self._hyp,
+                                         -self._hypno.to_array(),
                                          self._time, self._hypCanvas.canvas,
                                          yaxis, enable=True,
                                          fcn=[self._fcn_infoUpdate,
@@ -99,7 +100,7 @@ class HypnoEdition(object):
                 - Set data to marker object.
             """
             # Get latest data version :
-            data = -hypno_obj.gui_to_hyp()
+            data = -hypno_obj.gui_to_hyp().to_array()
             # Get cursor position :
             cpos = _get_cursor(event.pos, not self.keep)
             # Get closest marker :
@@ -195,7 +196,7 @@ class HypnoEdition(object):
             # Get y position :
             if force:
                 # Force cursor to be on the hypnogram :
-                val = -hypno_obj.gui_to_hyp()[np.abs(time - cursor).argmin()]
+                val = -hypno_obj.runs[np.abs(time - cursor).argmin()]
             else:
                 # Return converted y axis :
                 val = (yaxis[0] - yaxis[1]) * pos[1] / canvas.size[
@@ -249,12 +250,6 @@ class HypnoEdition(object):
         self._call = on_mouse_move
 
         # =================== UTILS FUNCTIONS ===================
-        def data_update(hypno_obj):
-            """Get latest data version."""
-            data = -hypno_obj.gui_to_hyp()
-            time = hypno_obj.mesh.pos[hypno_obj.sl, 0]
-            return data, time
-
         def time_update():
             """Get time extreme."""
             t_min = hypno_obj._camera.rect.left
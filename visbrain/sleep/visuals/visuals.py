@@ -12,7 +12,8 @@ from vispy import scene
 import vispy.visuals.transforms as vist
 
 from .marker import Markers
-from ...utils import (array2colormap, color2vb, PrepareData)
+from ...utils import (array2colormap, color2vb, PrepareData, MinMaxPyramid,
+                      WindowCache, PreparedRecording, HypnoRuns)
 from ...utils.sleep.event import _index_to_events
 from ...visuals import TopoMesh, TFmapsMesh
 from ...config import profiler
@@ -215,7 +216,21 @@ class Detection(object):
 
 
 class ChannelPlot(PrepareData):
-    """Plot each channel."""
+    """Plot each channel.
+
+    When a MinMaxPyramid of the data is set (pyramid attribute), long time
+    windows are displayed using their min / max envelope, with at most
+    ~2 points per screen pixel.
+
+    Prepared windows are kept in a LRU cache (windows attribute), keyed by
+    the time window, the visible channels and the preprocessing settings.
+    Neighbouring windows can be prepared in advance with the prefetch
+    method.
+
+    When a PreparedRecording is set (prepared attribute), the data are
+    prepared once over the whole recording (in a background thread) and
+    windows are sliced from it.
+    """
 
     def __init__(self, channels, time, color=(.2, .2, .2), width=1.5,
                  color_detection='red', method='gl', camera=None,
@@ -225,6 +240,10 @@ class ChannelPlot(PrepareData):
 
         # Variables :
         self._camera = camera
+        self._canvas = parent
+        self.pyramid = None
+        self.prepared = None
+        self.windows = WindowCache(self._get_window, max_size=16)
         self._preproc_channel = -1
         self.rect = []
         self.width = width
@@ -308,24 +327,14 @@ class ChannelPlot(PrepareData):
 
         # Manage slice :
         sl = slice(0, data.shape[1]) if sl is None else sl
+        start, stop, _ = sl.indices(data.shape[1])
+        self.x = (time[start], time[max(stop - 1, start)])
 
-        # Slice selection (of time and data) :
-        time_sl = time[sl]
-        self.x = (time_sl.min(), time_sl.max())
-        data_sl = data[self.visible, sl]
+        # Get the (prepared) window from the cache :
+        key, args = self._window_args(sf, data, time, start, stop)
+        time_sl, data_sl = self.windows.get(key, *args)
         z = np.full_like(time_sl, .5, dtype=np.float32)
 
-        # Prepare the data (only if needed) :
-        if self:
-            if self._preproc_channel == -1:  # prepare all channels
-                data_sl = self._prepare_data(sf, data_sl.copy(), time_sl)
-            else:  # filt only one channel
-                # Get on which visible channel to apply preprocessing :
-                chan_lst_viz = list(np.arange(len(self))[self.visible])
-                to_chan = chan_lst_viz.index(self._preproc_channel)
-                data_sl[[to_chan], :] = self._prepare_data(sf, data_sl[
-                    [to_chan], :].copy(), time_sl)
-
         # Set data to each plot :
         for l, (i, k) in enumerate(self):
             # ________ MAIN DATA ________
@@ -349,6 +358,99 @@ class ChannelPlot(PrepareData):
             k.update()
             self.rect.append(rect)
 
+    def _window_args(self, sf, data, time, start, stop):
+        """Get the cache key and the arguments of _get_window.
+
+        The visible channels and the preprocessing settings are copied so
+        that the window can be safely prepared in another thread.
+        """
+        chan = np.flatnonzero(self.visible)
+        n_pix = 2 * self._n_pixels() if self.pyramid is not None else None
+        ready = (self.pyramid is not None) and self.pyramid.ready
+        settings = self.settings
+        # Ask for the whole-recording prepared channels :
+        prepared = None
+        if self and (self.prepared is not None):
+            p_chan = chan if self._preproc_channel == -1 else [
+                self._preproc_channel]
+            if self.prepared.request(self, p_chan):
+                prepared = self.prepared
+        key = (id(data), start, stop, tuple(chan), self._preproc_channel,
+               tuple(sorted(settings.items())), n_pix, ready,
+               prepared is not None)
+        args = (sf, data, time, start, stop, chan, self._preproc_channel,
+                PrepareData(**settings), n_pix, prepared)
+        return key, args
+
+    def _get_window(self, sf, data, time, start, stop, chan, preproc_channel,
+                    prep, n_pix, prepared=None):
+        """Get the time vector and the (prepared) data of a time window."""
+        # Use the min / max envelope for long windows (only if the data
+        # don't need to be prepared) :
+        index = None
+        if (self.pyramid is not None) and not prep:
+            index, data_sl = self.pyramid.envelope(chan, start, stop, n_pix)
+        if index is None:
+            time_sl = time[start:stop]
+            data_sl = np.asarray(data[chan, start:stop], dtype=np.float32)
+        else:
+            time_sl = time[index]
+
+        # Prepare the data (only if needed) :
+        if prep:
+            if preproc_channel == -1:  # prepare all channels
+                to_chan, p_chan = slice(None), chan
+            else:  # filt only one channel
+                # Get on which visible channel to apply preprocessing :
+                to_chan = [list(chan).index(preproc_channel)]
+                p_chan = [preproc_channel]
+            # Slice the whole-recording prepared data (if available) :
+            data_prep = None
+            if prepared is not None:
+                data_prep = prepared.get(prep, p_chan, start, stop)
+            if data_prep is None:
+                data_prep = prep._prepare_data(
+                    sf, data_sl[to_chan, :].copy(), time_sl)
+            data_sl[to_chan, :] = data_prep
+        return time_sl, data_sl
+
+    def prefetch(self, sf, data, time, windows):
+        """Prepare time windows in a background thread.
+
+        Parameters
+        ----------
+        sf : float
+            The sampling frequency.
+        data: array_like
+            Array of data of shape (n_channels, n_points)
+        time: array_like
+            The time vector.
+        windows : list
+            List of (start, stop) time indices of the windows to prepare, by
+            order of priority.
+        """
+        items = [self._window_args(sf, data, time, *k) for k in windows]
+        self.windows.prefetch(items)
+
+    def set_pyramid(self, data, background=True):
+        """Build the min / max pyramid of the data.
+
+        Parameters
+        ----------
+        data: array_like
+            Array of data of shape (n_channels, n_points)
+        background : bool | True
+            Build the pyramid in a background thread.
+        """
+        if self.pyramid is not None:
+            self.pyramid.cancel()
+        self.pyramid = MinMaxPyramid(data, background=background)
+        self.windows.clear()
+
+    def _n_pixels(self):
+        """Get the width (in pixels) of the channel canvas."""
+        return max([int(k.canvas.size[0]) for k in self._canvas] + [1])
+
     def set_location(self, sf, data, channel, start, end, factor=100.):
         """Set vertical lines for detections."""
         # Get data limits :
@@ -413,6 +515,12 @@ class Spectrogram(PrepareData):
 
     After object creation, use the set_data() method to pass new data, new
     color, new frequency / time range, new settings...
+
+    When the channel is given to set_data, the spectral estimate (power in
+    dB or time-frequency map) is kept in a LRU cache (powers attribute),
+    keyed by the channel, the spectral settings and the preprocessing
+    settings. Changing only the display settings (cmap, contrast, fstart,
+    fend, interp) then only redo the color-mapping.
     """
 
     def __init__(self, camera, parent=None, fcn=None, use_tf=False):
@@ -425,6 +533,11 @@ class Spectrogram(PrepareData):
         self._fcn = fcn
         self._use_tf = use_tf
 
+        # Cache of spectral estimates and background computation :
+        self.powers = WindowCache(self._compute_power, max_size=8)
+        self._pending = None
+        self._timer = None
+
         # Time-frequency map
         self.tf = TFmapsMesh(parent=parent)
         # Spectrogram
@@ -433,7 +546,8 @@ class Spectrogram(PrepareData):
         self.mesh.transform = vist.STTransform()
 
     def set_data(self, sf, data, time, cmap='rainbow', nfft=30., overlap=0.,
-                 fstart=.5, fend=20., contrast=.5, interp='nearest', norm=0):
+                 fstart=.5, fend=20., contrast=.5, interp='nearest', norm=0,
+                 chan=None, background=False):
         """Set data to the spectrogram.
 
         Use this method to change data, colormap, spectrogram settings, the
@@ -444,7 +558,8 @@ class Spectrogram(PrepareData):
         sf: float
             The sampling frequency.
         data: array_like
-            The data to use for the spectrogram. Must be a row vector.
+            The data to use for the spectrogram. Must be a row vector or an
+            array of shape (n_channels, n_points) if chan is not None.
         time: array_like
             The time vector.
         cmap : string | 'viridis'
@@ -463,33 +578,98 @@ class Spectrogram(PrepareData):
             Interpolation method.
         norm : int | 0
             Normalization method for TF.
+        chan : int | None
+            Index of the channel to use. The spectral estimate is cached only
+            if the channel is given.
+        background : bool | False
+            Compute the spectral estimate in a background thread (only if
+            chan is not None). A blank image is displayed until it's ready.
         """
+        nperseg = int(round(nfft * sf))
+        use_tf = bool(self._use_tf)
+        settings = self.settings
+        # The TF depends on the frequency range and on the normalization :
+        tf_key = (fstart, fend, norm) if use_tf else ()
+        key = (id(data), chan, tuple(sorted(settings.items())), use_tf,
+               nperseg, overlap) + tf_key
+        args = (sf, data, chan, PrepareData(**settings), use_tf, nperseg,
+                overlap, fstart, fend, norm)
+        display = dict(sf=sf, time=time, cmap=cmap, fstart=fstart, fend=fend,
+                       contrast=contrast, interp=interp, use_tf=use_tf)
+
+        self._pending = None
+        if chan is None:  # no cache
+            self._set_power(*self._compute_power(*args), **display)
+        elif (key in self.powers) or not background:
+            self._set_power(*self.powers.get(key, *args), **display)
+        else:
+            self._pending = (key, args, display)
+            self._set_placeholder(time, fstart, fend)
+            self.powers.prefetch([(key, args)])
+            if self._timer is None:
+                from PyQt5 import QtCore
+                self._timer = QtCore.QTimer()
+                self._timer.setInterval(50)
+                self._timer.timeout.connect(self._check_power)
+            self._timer.start()
+
+    def _compute_power(self, sf, data, chan, prep, use_tf, nperseg, overlap,
+                       fstart, fend, norm):
+        """Compute the spectral estimate (without any display)."""
+        data = np.asarray(data if chan is None else data[chan, :])
+
         # =================== PREPARE DATA ===================
         # Prepare data (only if needed)
-        if self:
-            data = self._prepare_data(sf, data.copy(), time)
-
-        nperseg = int(round(nfft * sf))
+        if prep:
+            data = prep._prepare_data(sf, data.copy(), None)
 
         # =================== TF // SPECTRO ===================
-        if self._use_tf:
-            self.tf.set_data(data, sf, f_min=fstart, f_max=fend, cmap=cmap,
-                             contrast=contrast, n_window=nperseg,
-                             overlap=overlap, window='hamming', norm=norm)
+        if use_tf:
+            freq, power = self.tf.compute_tf(data, sf, f_min=fstart,
+                                             f_max=fend, norm=norm,
+                                             n_window=nperseg,
+                                             overlap=overlap,
+                                             window='hamming')
+        else:
+            overlap = int(round(overlap * nperseg))
+            freq, _, power = scpsig.spectrogram(data, fs=sf, nperseg=nperseg,
+                                                noverlap=overlap,
+                                                window='hamming')
+            power = 20 * np.log10(power)
+        return freq, power.astype(np.float32)
+
+    def _check_power(self):
+        """Display the spectral estimate computed in background (if ready)."""
+        if (self._pending is None) or (self.mesh is None):
+            self._timer.stop()
+            return
+        key, args, display = self._pending
+        if (key in self.powers) or not self.powers.busy:
+            self._pending = None
+            self._timer.stop()
+            self._set_power(*self.powers.get(key, *args), **display)
+
+    def _set_placeholder(self, time, fstart, fend):
+        """Display a blank image while the spectral estimate is computed."""
+        tm, tM = time.min(), time.max()
+        self.mesh.set_data(np.full((1, 1, 4), .9, dtype=np.float32))
+        self.mesh.transform.translate = [0., fstart, 0.]
+        self.mesh.transform.scale = (tM, fend - fstart, 1)
+        self.mesh.update()
+        self.rect = (tm, fstart, tM - tm, fend - fstart)
+        self.freq = np.array([fstart, fend])
+        self.mesh.visible, self.tf.visible = True, False
+
+    def _set_power(self, freq, mesh, sf, time, cmap, fstart, fend, contrast,
+                   interp, use_tf):
+        """Color-map and display a spectral estimate."""
+        if use_tf:
+            self.tf.set_tf(mesh, freq, sf, len(time), cmap=cmap,
+                           contrast=contrast)
             self.tf._image.interpolation = interp
             self.rect = self.tf.rect
             self.freq = self.tf.freqs
         else:
-            # =================== CONVERSION ===================
-            overlap = int(round(overlap * nperseg))
-
-            # =================== COMPUTE ===================
-            # Compute the spectrogram :
-            freq, _, mesh = scpsig.spectrogram(data, fs=sf, nperseg=nperseg,
-                                               noverlap=overlap,
-                                               window='hamming')
-            mesh = 20 * np.log10(mesh)
-
             # =================== FREQUENCY SELECTION ===================
             # Find where freq is [fstart, fend] :
             f = [0., 0.]
@@ -522,8 +702,8 @@ class Spectrogram(PrepareData):
             self.rect = (tm, freq.min(), tM - tm, freq.max() - freq.min())
             self.freq = freq
         # Visibility :
-        self.mesh.visible = not self._use_tf
-        self.tf.visible = self._use_tf
+        self.mesh.visible = not use_tf
+        self.tf.visible = use_tf
 
     def clean(self):
         """Clean indicators."""
@@ -561,7 +741,11 @@ class Spectrogram(PrepareData):
 
 
 class Hypnogram(object):
-    """Create a hypnogram object."""
+    """Create a hypnogram object.
+
+    The hypnogram is kept as a HypnoRuns (runs attribute) and only the stage
+    transitions are drawn.
+    """
 
     def __init__(self, time, camera, color='darkblue', width=2., parent=None,
                  hconv=None):
@@ -571,15 +755,17 @@ class Hypnogram(object):
         self.rect = (time.min(), -5., time.max() - time.min(), 7.)
         self.width = width
         self.n = len(time)
+        self._time = time
         self._hconv = hconv
         self._hconvinv = {v: k for k, v in self._hconv.items()}
+        self.runs = HypnoRuns.zeros(self.n)
         # Get color :
         self.color = {k: color2vb(color=i) for k, i in zip(color.keys(),
                                                            color.values())}
         # Create a default line :
         pos = np.array([[0, 0], [0, 100]])
         self.mesh = scene.visuals.Line(pos, name='hypnogram', method='gl',
-                                       parent=parent)
+                                       connect='segments', parent=parent)
         self.mesh.set_gl_state('translucent')
         # Create a default marker (for edition):
         self.edit = Markers(parent=parent)
@@ -606,33 +792,50 @@ class Hypnogram(object):
         ----------
         sf: float
             The sampling frequency.
-        data: array_like
-            The data to send. Must be a row vector.
+        data: array_like | HypnoRuns
+            The data to send. Must be a row vector or a HypnoRuns.
         time: array_like
             The time vector
         convert : bool | True
-            Specify if hypnogram data have to be converted.
+            Specify if hypnogram data have to be converted. If False, data
+            are considered as already converted for the GUI.
         """
+        self._time = time
+        runs = HypnoRuns.from_array(data)
         # Hypno conversion :
-        if (self._hconv != self._hconvinv) and convert:
-            data = self.hyp_to_gui(data)
-        # Build color array :
-        color = np.zeros((len(data), 4), dtype=np.float32)
+        if (self._hconv != self._hconvinv) and not convert:
+            runs = runs.map(self._hconvinv)
+        self.runs = runs
+        self._draw()
+
+    def _draw(self):
+        """Draw the stage transitions of the hypnogram."""
+        runs = self.runs.map(self._hconv) if (
+            self._hconv != self._hconvinv) else self.runs
+        time, n_runs = self._time, len(runs.onset)
+        # Run boundaries (in time) :
+        t_sta = time[runs.onset]
+        t_end = time[np.minimum(runs.stop, len(time) - 1)]
+        y = -runs.stage.astype(np.float32)
+        # Each run is drawn with an horizontal segment followed by a vertical
+        # one (up to the next stage), both with the color of the run :
+        pos = np.zeros((n_runs, 4, 2), dtype=np.float32)
+        pos[:, 0, 0], pos[:, 1:, 0] = t_sta, t_end[:, np.newaxis]
+        pos[:, 0:3, 1] = y[:, np.newaxis]
+        pos[:, 3, 1] = np.r_[y[1:], y[-1:]]
+        color = np.zeros((n_runs, 4, 4), dtype=np.float32)
         for k, v in zip(self.color.keys(), self.color.values()):
             # Set the stage color :
-            color[data == k, :] = v
-        # Avoid gradient color :
-        color[1::, :] = color[0:-1, :]
+            color[runs.stage == k, ...] = v
         # Set data to the mesh :
-        self.mesh.set_data(pos=np.vstack((time, -data)).T, width=self.width,
-                           color=color)
+        self.mesh.set_data(pos=pos.reshape(-1, 2), width=self.width,
+                           color=color.reshape(-1, 4))
         self.mesh.update()
 
     def set_stage(self, stfrom, stend, stage):
         """Add a stage in a specific interval.
 
-        This method only set the stage without updating the entire
-        hypnogram.
+        Only the stage transitions are redrawn.
 
         Parameters
         ----------
@@ -643,13 +846,8 @@ class Hypnogram(object):
         stage : int
             Stage value.
         """
-        # Convert the stage :
-        stagec = self._hconv[stage]
-        # Update color :
-        self.mesh.color[stfrom + 1:stend + 1, :] = self.color[stagec]
-        # Only update the needed part :
-        self.mesh.pos[stfrom:stend, 1] = -float(stagec)
-        self.mesh.update()
+        self.runs.set_stage(stfrom, stend, stage)
+        self._draw()
 
     def set_grid(self, time, length=30., y=1.):
         """Set grid lentgh."""
@@ -667,14 +865,16 @@ class Hypnogram(object):
 
         Parameters
         ----------
-        data : array_like
-            The data to send. Must be a row vector.
+        data : array_like | HypnoRuns
+            The data to send. Must be a row vector or a HypnoRuns.
 
         Returns
         -------
-        datac : array_like
+        datac : array_like | HypnoRuns
             Converted data
         """
+        if isinstance(data, HypnoRuns):
+            return data.map(self._hconv)
         # Backup copy :
         datac = data.copy()
         data = np.zeros_like(datac)
@@ -688,16 +888,10 @@ class Hypnogram(object):
 
         Returns
         -------
-        data : array_like
-            The converted data.
+        data : HypnoRuns
+            A copy of the hypnogram.
         """
-        # Get latest data version :
-        datac = -self.mesh.pos[:, 1]
-        data = np.zeros_like(datac)
-        # Fill new data :
-        for k in self._hconvinv.keys():
-            data[datac == k] = self._hconvinv[k]
-        return data
+        return self.runs.copy()
 
     def pos_to_gui(self, pos):
         """Convert a position array.
@@ -750,8 +944,7 @@ class Hypnogram(object):
     def clean(self, sf, time):
         """Clean indicators."""
         # Mesh :
-        posmesh = np.zeros((len(self),), dtype=np.float32)
-        self.set_data(sf, posmesh, time)
+        self.set_data(sf, HypnoRuns.zeros(len(self)), time)
         # Edit :
         posedit = np.full((1, 3), -10., dtype=np.float32)
         self.edit.set_data(pos=posedit, face_color='gray')
@@ -779,12 +972,18 @@ filetring, de-meaning...
 
 
 class TopoSleep(TopoMesh, PrepareData):
-    """Topoplot for sleep data."""
+    """Topoplot for sleep data.
+
+    The mean of the prepared data over time windows is kept in a LRU cache
+    (windows attribute). See ChannelPlot for the prepared attribute.
+    """
 
     def __init__(self, **kwargs):
         # Initialize TopoMesh and PrepareData :
         TopoMesh.__init__(self, **kwargs)
         PrepareData.__init__(self, axis=1)
+        self.prepared = None
+        self.windows = WindowCache(self._get_window, max_size=16)
         # Initialize data, clim, cmap and cblabel :
         self._data = None
         self._clim = None
@@ -813,6 +1012,55 @@ class TopoSleep(TopoMesh, PrepareData):
         if data is not None:
             self.set_data(data, cmap=cmap, cblabel=cblabel, clim=clim)
 
+    def _window_args(self, sf, data, time, start, stop):
+        """Get the cache key and the arguments of _get_window."""
+        settings = self.settings
+        # Ask for the whole-recording prepared channels :
+        prepared = None
+        if self and (self.prepared is not None):
+            if self.prepared.request(self, np.arange(data.shape[0])):
+                prepared = self.prepared
+        key = (id(data), start, stop, tuple(sorted(settings.items())),
+               prepared is not None)
+        return key, (sf, data, time, start, stop, PrepareData(**settings),
+                     prepared)
+
+    @staticmethod
+    def _get_window(sf, data, time, start, stop, prep, prepared=None):
+        """Get the mean of the prepared data over a time window."""
+        if prepared is not None:
+            data_sl = prepared.get(prep, np.arange(data.shape[0]), start,
+                                   stop)
+            if data_sl is not None:
+                return data_sl.mean(1)
+        data_sl = np.array(data[:, start:stop], dtype=np.float32)
+        return prep._prepare_data(sf, data_sl, time[start:stop]).mean(1)
+
+    def get_window(self, sf, data, time, start, stop):
+        """Get the mean of the prepared data over a time window (cached).
+
+        Parameters
+        ----------
+        sf : float
+            The sampling frequency.
+        data: array_like
+            Array of data of shape (n_channels, n_points)
+        time: array_like
+            The time vector.
+        start, stop : int
+            First and last (excluded) time indices of the window.
+        """
+        key, args = self._window_args(sf, data, time, start, stop)
+        return self.windows.get(key, *args)
+
+    def prefetch(self, sf, data, time, windows):
+        """Prepare time windows in a background thread.
+
+        See ChannelPlot.prefetch.
+        """
+        items = [self._window_args(sf, data, time, *k) for k in windows]
+        self.windows.prefetch(items)
+
 
 """
 ###############################################################################
@@ -1093,6 +1341,12 @@ class Visuals(CanvasShortcuts):
                                  width=self._lw, color_detection=self._indicol,
                                  parent=self._chanCanvas,
                                  fcn=self._fcn_sliderMove)
+        # Min / max pyramid for the display of long windows :
+        self._chan.set_pyramid(data, background=True)
+        # Whole-recording preparation :
+        if self._whole_prep:
+            self._prepared = PreparedRecording(sf, data)
+            self._chan.prepared = self._prepared
         profiler('Channels', level=1)
 
         # =================== SPECTROGRAM ===================
@@ -1100,7 +1354,7 @@ class Visuals(CanvasShortcuts):
         self._spec = Spectrogram(camera=cameras[1], fcn=self._fcn_specSetData,
                                  parent=self._specCanvas.wc.scene,
                                  use_tf=self._use_tf)
-        self._spec.set_data(sf, data[0, ...], time, cmap=self._defcmap)
+        self._spec.set_data(sf, data, time, cmap=self._defcmap, chan=0)
         profiler('Spectrogram', level=1)
         # Create a visual indicator for spectrogram :
         self._specInd = Indicator(name='spectro_indic', visible=True, alpha=.3,
@@ -1133,6 +1387,7 @@ class Visuals(CanvasShortcuts):
         # =================== TOPOPLOT ===================
         self._topo = TopoSleep(channels=self._channels, margin=.2,
                                parent=self._topoCanvas.wc.scene)
+        self._topo.prepared = self._prepared
         # Set camera properties :
         cameras[3].rect = self._topo.rect
         cameras[3].aspect = 1.
@@ -1,16 +1,35 @@
 """Set of tools to filter data."""
 
 import numpy as np
+from scipy.fftpack import next_fast_len
 from scipy.signal import butter, filtfilt, lfilter, bessel, welch, detrend
 
-__all__ = ('filt', 'morlet', 'ndmorlet', 'morlet_power', 'welch_power',
-           'PrepareData')
+__all__ = ('filt', 'morlet', 'ndmorlet', 'morlet_bank', 'morlet_power',
+           'welch_power', 'PrepareData')
 
 #############################################################################
 # FILTERING
 #############################################################################
 
 
+def _filt_coefs(sf, f, btype='bandpass', order=3, method='butterworth'):
+    """Get the coefficients (b, a) of the filter used by filt."""
+    # Normalize frequency vector according to btype :
+    if btype in ['bandpass', 'bandstop']:
+        fnorm = np.divide(f, .5 * sf)
+    elif btype == 'lowpass':
+        fnorm = np.array(f[-1] / (.5 * sf))
+    elif btype == 'highpass':
+        fnorm = np.array(f[0] / (.5 * sf))
+
+    # Get filter coefficients :
+    if method == 'butterworth':
+        b, a = butter(order, fnorm, btype=btype)
+    elif method == 'bessel':
+        b, a = bessel(order, fnorm, btype=btype)
+    return b, a
+
+
 def filt(sf, f, x, btype='bandpass', order=3, method='butterworth',
          way='filtfilt', axis=0):
     """Filt data.
@@ -41,19 +60,8 @@ def filt(sf, f, x, btype='bandpass', order=3, method='butterworth',
     xfilt : array_like
         Filtered data.
     """
-    # Normalize frequency vector according to btype :
-    if btype in ['bandpass', 'bandstop']:
-        fnorm = np.divide(f, .5 * sf)
-    elif btype == 'lowpass':
-        fnorm = np.array(f[-1] / (.5 * sf))
-    elif btype == 'highpass':
-        fnorm = np.array(f[0] / (.5 * sf))
-
     # Get filter coefficients :
-    if method == 'butterworth':
-        b, a = butter(order, fnorm, btype=btype)
-    elif method == 'bessel':
-        b, a = bessel(order, fnorm, btype=btype)
+    b, a = _filt_coefs(sf, f, btype, order, method)
 
     # Apply filter :
     if way == 'filtfilt':
@@ -94,6 +102,76 @@ def _morlet_wlt(sf, f, width=7.0):
     return wlt
 
 
+def morlet_bank(x, sf, freqs, width=7.0, get=None, axis=-1, chunk=2 ** 16):
+    """Complex decomposition of a signal using a bank of Morlet's wavelets.
+
+    The decomposition is computed in the frequency domain : each chunk of
+    the signal is transformed once and multiplied by the precomputed spectra
+    of every wavelet (overlap-save). This gives the same result as
+    convolving the signal with each wavelet (see morlet), with a memory
+    usage bounded by the chunk size.
+
+    Parameters
+    ----------
+    x : array_like
+        The signal to decompose (e.g. of shape (n_channels, n_points)).
+    sf : float
+        Sampling frequency.
+    freqs : array_like
+        Central frequencies of the wavelets.
+    width : float | 7.0
+        Width of the wavelets.
+    get : {None, 'amplitude', 'phase', 'power'}
+        Specify if the amplitude, phase or power of the filtered signal have to
+        be returned or only the filtered signal.
+    axis : int | -1
+        Specify the axis where is located the time dimension.
+    chunk : int | 2 ** 16
+        Number of time points decomposed at once.
+
+    Returns
+    -------
+    xout: array_like
+        Decomposition of x of shape (len(freqs),) + x.shape.
+    """
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    shape, n_pts = x.shape, x.shape[-1]
+    x = x.reshape(-1, n_pts)
+    freqs = np.atleast_1d(freqs)
+    # Wavelets and index of the first sample of each convolution to keep :
+    wlts = [_morlet_wlt(sf, f, width) for f in freqs]
+    starts = [int(np.ceil(len(m) / 2)) - 1 for m in wlts]
+    n_wlt = max([len(m) for m in wlts])
+    # Samples needed before / after each chunk :
+    before = max([len(m) - 1 - s for m, s in zip(wlts, starts)])
+    after = max(starts)
+    chunk = max(min(int(chunk), n_pts), 1)
+    nfft = next_fast_len(before + chunk + after + n_wlt - 1)
+    spectra = np.array([np.fft.fft(m, nfft) for m in wlts])
+
+    dtype = complex if get is None else float
+    xout = np.empty((len(freqs), x.shape[0], n_pts), dtype=dtype)
+    for k in range(0, n_pts, chunk):
+        end = min(chunk, n_pts - k)
+        # Zero-padded segment of the signal around the chunk :
+        seg = np.zeros((x.shape[0], before + end + after))
+        sta, sto = max(k - before, 0), min(k + end + after, n_pts)
+        seg[:, sta - k + before:sto - k + before] = x[:, sta:sto]
+        xfft = np.fft.fft(seg, nfft, axis=-1)
+        for i, (spec, s) in enumerate(zip(spectra, starts)):
+            stop = s + before + end
+            y = np.fft.ifft(xfft * spec, axis=-1)[:, s + before:stop]
+            if get == 'amplitude':
+                y = np.abs(y)
+            elif get == 'power':
+                y = np.square(np.abs(y))
+            elif get == 'phase':
+                y = np.angle(y)
+            xout[i, :, k:k + end] = y
+    xout = xout.reshape((len(freqs),) + shape)
+    return np.moveaxis(xout, -1, axis if axis < 0 else axis + 1)
+
+
 def morlet(x, sf, f, width=7.0):
     """Complex decomposition of a signal x using the morlet wavelet.
 
@@ -114,14 +192,7 @@ def morlet(x, sf, f, width=7.0):
     xout: array_like
         The complex decomposition of the signal x.
     """
-    # Get the wavelet :
-    m = _morlet_wlt(sf, f, width)
-
-    # Compute morlet :
-    y = np.convolve(x, m)
-    xout = y[int(np.ceil(len(m) / 2)) - 1:int(len(y) - np.floor(len(m) / 2))]
-
-    return xout
+    return morlet_bank(x, sf, [f], width)[0]
 
 
 def ndmorlet(x, sf, f, axis=0, get=None, width=7.0):
@@ -148,24 +219,7 @@ def ndmorlet(x, sf, f, axis=0, get=None, width=7.0):
         xout: array, same shape as x
             Complex decomposition of x.
     """
-    # Get the wavelet :
-    m = _morlet_wlt(sf, f, width)
-
-    # Define a morlet function :
-    def morlet_fcn(xt):
-        # Compute morlet :
-        y = np.convolve(xt, m)
-        return y[int(np.ceil(len(m) / 2)) - 1:int(len(y) - np.floor(
-            len(m) / 2))]
-
-    xf = np.apply_along_axis(morlet_fcn, axis, x)
-    # Get amplitude / power / phase :
-    if get == 'amplitude':
-        return np.abs(xf)
-    elif get == 'power':
-        return np.square(np.abs(xf))
-    elif get == 'phase':
-        return np.angle(xf)
+    return morlet_bank(x, sf, [f], width, get=get, axis=axis)[0]
 
 
 def morlet_power(x, freqs, sf, norm=True):
@@ -193,11 +247,7 @@ def morlet_power(x, freqs, sf, norm=True):
     # Build frequency vector :
     f = np.c_[freqs[0:-1], freqs[1::]].mean(1)
     # Get wavelet transform :
-    xpow = np.zeros((len(f), len(x)), dtype=np.float)
-    for num, k in enumerate(f):
-        xpow[num, :] = np.abs(morlet(x, sf, k))
-    # Compute inplace power :
-    np.power(xpow, 2, out=xpow)
+    xpow = morlet_bank(x, sf, f, get='power')
     # Normalize by the band sum :
     if norm:
         sum_pow = xpow.sum(0).reshape(1, -1)
@@ -205,13 +255,17 @@ def morlet_power(x, freqs, sf, norm=True):
     return xpow
 
 
-def welch_power(x, freqs, sf, window_s=10, norm=True):
+def welch_power(x, freqs, sf, window_s=10, norm=True, oversample=True):
     """Compute bandwise-normalized power of data using welch power.
 
+    The signal is split into epochs of window_s seconds and the power of
+    all the epochs (and of all the signals) is computed at once.
+
     Parameters
     ----------
     x : array_like
-        Row vector signal.
+        Signal of shape (..., npts) (e.g. a row vector or an array of shape
+        (n_channels, npts)).
     freqs : array_like
         Frequency bands for power computation. The power will be computed
         using successive frequency band (e.g freqs=(1., 2, .3)).
@@ -222,37 +276,50 @@ def welch_power(x, freqs, sf, window_s=10, norm=True):
     norm : bool | True
         If True, return bandwise normalized band power
         (For each time point, the sum of power in the 4 band equals 1)
+    oversample : bool | True
+        If True, the power of each epoch is repeated for each of its time
+        points (the last epoch is extended up to npts). Otherwise, the power
+        of each epoch is returned.
 
     Returns
     -------
     xpow : array_like
         The power in the specified frequency bands of shape
-        (len(freqs)-1, npts).
+        (..., len(freqs)-1, npts) or (..., len(freqs)-1, n_epochs) if
+        oversample is False.
     """
     sf = int(sf)
     freq_spacing = .1
-    n_epoch = max(1, int(len(x) / (window_s * sf)))
-
-    xpow = np.zeros((len(freqs) - 1, n_epoch), dtype=np.float)
-
-    for i in np.arange(0, len(x), window_s * sf):
-        f, Pxx_spec = welch(x[int(i):int(i + window_s * sf)], sf,
-                            nperseg=sf * (1 / freq_spacing),
-                            scaling='spectrum')
-        epoch = int(i / (window_s * sf))
-
-        for num, k in enumerate(freqs[:-1]):
-            fmin = np.abs(f - k).argmin()
-            fmax = np.abs(f - freqs[num + 1]).argmin()
-            xpow[num, epoch] = np.mean(Pxx_spec[fmin:fmax])
+    x = np.asarray(x)
+    npts = x.shape[-1]
+    n_win = int(window_s * sf)
+    n_epoch = max(1, npts // n_win)
+    n_win = min(n_win, npts)
+
+    # Epochs of shape (..., n_epoch, n_win) (incomplete epoch dropped) :
+    epochs = x[..., :n_epoch * n_win].reshape(x.shape[:-1] + (n_epoch, n_win))
+    nperseg = min(int(sf * (1 / freq_spacing)), n_win)
+    f, pxx_spec = welch(epochs, sf, nperseg=nperseg, scaling='spectrum',
+                        axis=-1)
+
+    # Mean power inside each band. Bands start / end at the closest
+    # frequency bins :
+    bounds = np.abs(f.reshape(-1, 1) - np.asarray(freqs).reshape(1, -1))
+    bounds = bounds.argmin(0)
+    bins = np.arange(len(f)).reshape(-1, 1)
+    in_band = ((bins >= bounds[:-1]) & (bins < bounds[1:])).astype(float)
+    xpow = np.swapaxes(np.dot(pxx_spec, in_band) / in_band.sum(0), -1, -2)
 
     # Normalize by the band sum :
     if norm:
-        sum_pow = xpow.sum(0).reshape(1, -1)
+        sum_pow = xpow.sum(-2, keepdims=True)
         np.divide(xpow, sum_pow, out=xpow)
 
     # Oversample
-    xpow = np.repeat(xpow, int(window_s * sf), axis=1)
+    if oversample:
+        repeats = np.full((n_epoch,), n_win)
+        repeats[-1] += npts - n_epoch * n_win
+        xpow = np.repeat(xpow, repeats, axis=-1)
     return xpow
 
 
@@ -286,6 +353,21 @@ class PrepareData(object):
         """Return if data have to be prepared."""
         return any([self.demean, self.detrend, self.filt])
 
+    @property
+    def settings(self):
+        """Get the preparation settings.
+
+        Dictionary of the input parameters, which can be used to create an
+        independent copy (PrepareData(**settings)) or as a cache key
+        (sorted(settings.items())).
+        """
+        return {'axis': self.axis, 'demean': self.demean,
+                'detrend': self.detrend, 'filt': self.filt,
+                'fstart': self.fstart, 'fend': self.fend,
+                'forder': self.forder, 'way': self.way,
+                'filt_meth': self.filt_meth, 'btype': self.btype,
+                'dispas': self.dispas}
+
     def _prepare_data(self, sf, data, time):
         """Prepare data before plotting."""
         # ============= DEMEAN =============
@@ -1,5 +1,6 @@
 """Group of functions for physiological processing."""
 from re import findall
+from fnmatch import fnmatch
 
 import numpy as np
 from itertools import product
@@ -8,8 +9,9 @@ from scipy.stats import zscore
 from .sigproc import smoothing
 from .others import get_data_path
 
-__all__ = ('find_non_eeg', 'rereferencing', 'bipolarization', 'commonaverage',
-           'tal2mni', 'mni2tal', 'load_predefined_roi', 'generate_eeg')
+__all__ = ('find_non_eeg', 'pick_channels', 'rereferencing', 'bipolarization',
+           'commonaverage', 'tal2mni', 'mni2tal', 'load_predefined_roi',
+           'generate_eeg')
 
 
 def find_non_eeg(channels, pattern=['eog', 'emg', 'ecg', 'abd']):
@@ -37,6 +39,47 @@ def find_non_eeg(channels, pattern=['eog', 'emg', 'ecg', 'abd']):
     return iseeg
 
 
+def pick_channels(channels, picks=None):
+    """Get the indices of a selection of channels.
+
+    Parameters
+    ----------
+    channels : list
+        List of channel names.
+    picks : string, list | None
+        Channels to select. Use None to select all channels, 'eeg' to select
+        EEG channels only (see find_non_eeg) or a list of channel names,
+        glob patterns (e.g. 'C*', case insensitive) and / or channel
+        indices.
+
+    Returns
+    -------
+    idx : array_like
+        Sorted indices of the selected channels.
+    """
+    n_chan = len(channels)
+    if picks is None:
+        return np.arange(n_chan)
+    if isinstance(picks, str) and (picks.lower() == 'eeg'):
+        idx = np.flatnonzero(~find_non_eeg(channels))
+    else:
+        picks = [picks] if np.ndim(picks) == 0 else picks
+        lower = [str(k).lower() for k in channels]
+        is_picked = np.zeros((n_chan,), dtype=bool)
+        for k in picks:
+            if isinstance(k, str):
+                found = [fnmatch(c, k.lower()) for c in lower]
+                if not any(found):
+                    raise ValueError("No channel found for %s" % k)
+                is_picked += np.array(found, dtype=bool)
+            else:
+                is_picked[int(k)] = True
+        idx = np.flatnonzero(is_picked)
+    if not len(idx):
+        raise ValueError("No channel selected.")
+    return idx
+
+
 ###############################################################################
 ###############################################################################
 #                               RE-REFERENCING
@@ -1,8 +1,9 @@
 """This script contains some usefull signal processing functions."""
 import logging
+from functools import lru_cache
 
 import numpy as np
-from scipy.signal import fftconvolve
+from scipy.signal import fftconvolve, oaconvolve
 
 
 __all__ = ('normalize', 'derivative', 'tkeo', 'zerocrossing', 'power_of_ten',
@@ -287,7 +288,19 @@ def normalization(data, axis=-1, norm=None, baseline=None):
             data /= d_std
 
 
-def smoothing(x, n_window=10, window='hanning'):
+@lru_cache(maxsize=32)
+def _smoothing_window(n_window, window):
+    """Get the normalized coefficients of a smoothing window (read-only)."""
+    if window == 'flat':  # Moving average
+        w = np.ones((n_window,))
+    else:
+        w = getattr(np, window)(n_window)
+    w = w / w.sum()
+    w.flags.writeable = False
+    return w
+
+
+def smoothing(x, n_window=10, window='hanning', axis=-1):
     """Smooth the data using a window with requested size.
 
     This method is based on the convolution of a scaled window with the signal.
@@ -295,23 +308,29 @@ def smoothing(x, n_window=10, window='hanning'):
     (with the window size) in both ends so that transient parts are minimized
     in the begining and end part of the output signal.
 
+    Flat windows are computed with a running sum and long windows with an
+    overlap-add (FFT) convolution, so that the cost barely depends on the
+    window length.
+
     Parameters
     ----------
     x : array_like
-        1-D array to smooth.
+        Array to smooth (e.g. of shape (n_channels, n_pts)).
     n_window : int | 10
         Window length.
     window : string, array_like | 'hanning'
         Use either 'flat', 'hanning', 'hamming', 'bartlett', 'blackman' or pass
         a numpy array of length n_window.
+    axis : int | -1
+        Axis along which to smooth.
 
     Returns
     -------
         The smoothed signal
     """
     n_window = int(n_window)
-    assert isinstance(x, np.ndarray) and x.ndim == 1
-    assert len(x) > n_window
+    assert isinstance(x, np.ndarray) and x.ndim >= 1
+    assert x.shape[axis] > n_window
     assert isinstance(window, (str, np.ndarray))
     if isinstance(window, str):
         assert window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']
@@ -321,14 +340,31 @@ def smoothing(x, n_window=10, window='hanning'):
     if n_window < 3:
         return x
 
-    s = np.r_[2 * x[0] - x[n_window:1:-1], x, 2 * x[-1] - x[-1:-n_window:-1]]
-    if window == 'flat':  # Moving average
-        w = np.ones((n_window,))
+    x = np.moveaxis(x, axis, -1)
+    s = np.concatenate((2 * x[..., 0:1] - x[..., n_window:1:-1], x,
+                        2 * x[..., -1:] - x[..., -1:-n_window:-1]), axis=-1)
+    s = s.astype(np.result_type(s.dtype, np.float64), copy=False)
+    # Output sample i is computed from s[i + start:i + start + n_window] :
+    start, n_pts = (n_window - 1) // 2, x.shape[-1]
+    if isinstance(window, str) and window == 'flat':
+        # Running mean (of the values minus the first one, to limit the
+        # rounding errors of the cumulative sum) :
+        cum = np.cumsum(s - s[..., 0:1], axis=-1)
+        cum = np.concatenate((np.zeros(cum.shape[:-1] + (1,)), cum), axis=-1)
+        y = cum[..., start + n_window:start + n_window + n_pts]
+        y = (y - cum[..., start:start + n_pts]) / n_window + s[..., 0:1]
     else:
-        w = eval('np.' + window + '(n_window)')
-
-    y = np.convolve(w / w.sum(), s, mode='same')
-    return y[n_window - 1:-n_window + 1]
+        if isinstance(window, str):
+            w = _smoothing_window(n_window, window)
+        else:
+            w = window / window.sum()
+        if n_window <= 256 and s.ndim == 1:
+            y = np.convolve(w, s, mode='valid')
+        else:
+            w = w.reshape((1,) * (s.ndim - 1) + (-1,))
+            y = oaconvolve(s, w, mode='valid', axes=-1)
+        y = y[..., start:start + n_pts]
+    return np.moveaxis(y, -1, axis)
 
 
 def smooth_3d(vol, smooth_factor=3):
@@ -1,2 +1,6 @@
 from .detection import *
+from .engine import *
 from .hypnoprocessing import *
+from .navigation import *
+from .preparation import *
+from .pyramid import *
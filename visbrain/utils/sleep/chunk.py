@@ -0,0 +1,289 @@
+"""Tools for the chunked (bounded-memory) detections.
+
+Long recordings are processed chunk by chunk. Each chunk is extended on
+both sides by an overlap that covers the support of the local operations
+(wavelets, smoothing, filters) so that the values inside the chunk are the
+same as the ones computed on the whole recording. Global statistics are
+computed in a first streaming pass and events are stitched at the borders
+of the chunks.
+"""
+import numpy as np
+
+from ..filtering import _morlet_wlt
+from .preparation import _filtfilt_overlap
+
+__all__ = ('_iter_chunks', '_chunked_map', '_wavelets_length',
+           '_filtfilt_length', '_hypno_stages', '_RunningStats',
+           '_streaming_kth', '_stitch_intervals', '_chunked_extrema')
+
+
+def _iter_chunks(n, chunk, overlap=0):
+    """Iterate over chunks of a recording.
+
+    Parameters
+    ----------
+    n : int
+        Number of time points.
+    chunk : int
+        Number of time points per chunk.
+    overlap : int | 0
+        Number of time points added on both sides of each chunk.
+
+    Returns
+    -------
+    chunks : generator
+        Generator of (start, stop, ext_start, ext_stop) where (start, stop)
+        are the bounds of the chunk and (ext_start, ext_stop) the bounds of
+        the extended chunk.
+    """
+    chunk = max(int(chunk), 1)
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        yield start, stop, max(start - overlap, 0), min(stop + overlap, n)
+
+
+def _chunked_map(fcn, n, chunk, overlap):
+    """Apply a local function to each extended chunk.
+
+    Parameters
+    ----------
+    fcn : function
+        Function fcn(ext_start, ext_stop) returning a tuple of arrays of
+        length ext_stop - ext_start.
+    n : int
+        Number of time points.
+    chunk : int
+        Number of time points per chunk.
+    overlap : int
+        Number of time points added on both sides of each chunk.
+
+    Returns
+    -------
+    chunks : generator
+        Generator of (start, stop, outputs) where outputs is the tuple
+        returned by fcn, cropped to (start, stop).
+    """
+    for start, stop, ext_start, ext_stop in _iter_chunks(n, chunk, overlap):
+        sl = slice(start - ext_start, stop - ext_start)
+        yield start, stop, tuple(k[sl] for k in fcn(ext_start, ext_stop))
+
+
+def _wavelets_length(sf, freqs):
+    """Get the length of the longest Morlet's wavelet."""
+    return max([len(_morlet_wlt(sf, f)) for f in np.atleast_1d(freqs)])
+
+
+def _filtfilt_length(b, a):
+    """Get the number of samples affected by the borders with filtfilt."""
+    return _filtfilt_overlap(b, a) + 3 * max(len(a), len(b))
+
+
+def _hypno_stages(hypno, chunk):
+    """Get the stages of a hypnogram, chunk by chunk.
+
+    Parameters
+    ----------
+    hypno : array_like | HypnoRuns
+        The hypnogram (one value per time point).
+    chunk : int
+        Number of time points read at once.
+
+    Returns
+    -------
+    stages : array_like
+        The sorted unique stages.
+    """
+    if hasattr(hypno, 'stage'):
+        return np.unique(hypno.stage)
+    stages = [np.unique(hypno[start:stop]) for start, stop, _, _ in
+              _iter_chunks(len(hypno), chunk)]
+    return np.unique(np.concatenate(stages + [np.array([])]))
+
+
+class _RunningStats(object):
+    """Streaming mean and standard deviation.
+
+    Statistics of each chunk are merged using the parallel algorithm of
+    Chan et al., which is numerically stable.
+    """
+
+    def __init__(self):
+        """Init."""
+        self.n, self.mean, self._m2 = 0, 0., 0.
+
+    def update(self, x):
+        """Add values."""
+        x = np.asarray(x, dtype=np.float64).ravel()
+        if not x.size:
+            return
+        n, mean = x.size, x.mean()
+        m2 = np.square(x - mean).sum()
+        delta, n_tot = mean - self.mean, self.n + n
+        self.mean += delta * n / n_tot
+        self._m2 += m2 + delta ** 2 * self.n * n / n_tot
+        self.n = n_tot
+
+    @property
+    def std(self):
+        """Get the standard deviation (ddof=0)."""
+        return np.sqrt(self._m2 / self.n) if self.n else np.nan
+
+
+def _float_keys(x):
+    """Map floats to unsigned integers that have the same ordering."""
+    bits = np.asarray(x, dtype=np.float64).ravel().view(np.uint64)
+    negative = (bits >> np.uint64(63)).astype(bool)
+    return np.where(negative, ~bits, bits | np.uint64(1 << 63))
+
+
+def _keys_to_float(keys):
+    """Inverse of _float_keys."""
+    keys = np.asarray(keys, dtype=np.uint64)
+    positive = (keys >> np.uint64(63)).astype(bool)
+    bits = np.where(positive, keys & ~np.uint64(1 << 63), ~keys)
+    return bits.view(np.float64)
+
+
+def _streaming_kth(values, ks, max_candidates=2 ** 20):
+    """Get the exact k-th smallest values of a stream of arrays.
+
+    The values are selected 16 bits at a time (radix selection) : each pass
+    over the stream narrows down the candidates until they fit in memory.
+
+    Parameters
+    ----------
+    values : function
+        Function returning an iterator over the arrays of the stream. It is
+        called once per pass.
+    ks : list
+        Ranks (starting from 0) of the values to get.
+    max_candidates : int | 2 ** 20
+        Maximum number of candidates to keep in memory.
+
+    Returns
+    -------
+    kth : array_like
+        The k-th smallest values.
+    """
+    state = [dict(k=int(k), prefix=np.uint64(0), shift=64, count=None,
+                  value=None) for k in ks]
+    while True:
+        todo = [s for s in state if s['value'] is None]
+        if not todo:
+            break
+        # Either histogram the next 16 bits or collect the candidates :
+        collect = [s['count'] is not None and s['count'] <= max_candidates
+                   for s in todo]
+        counts = [np.zeros((2 ** 16,), dtype=np.int64) for _ in todo]
+        candidates = [[] for _ in todo]
+        for x in values():
+            keys = _float_keys(x)
+            for i, s in enumerate(todo):
+                if s['shift'] < 64:
+                    shifted = keys >> np.uint64(s['shift'])
+                    k_in = keys[shifted == s['prefix']]
+                else:
+                    k_in = keys
+                if collect[i]:
+                    candidates[i].append(k_in)
+                else:
+                    digits = (k_in >> np.uint64(s['shift'] - 16)) & \
+                        np.uint64(0xFFFF)
+                    counts[i] += np.bincount(digits.astype(np.int64),
+                                             minlength=2 ** 16)
+        for i, s in enumerate(todo):
+            if collect[i]:
+                keys = np.sort(np.concatenate(candidates[i]))
+                s['value'] = _keys_to_float(keys[s['k']:s['k'] + 1])[0]
+                continue
+            cum = np.cumsum(counts[i])
+            digit = int(np.searchsorted(cum, s['k'], side='right'))
+            s['k'] -= int(cum[digit - 1]) if digit else 0
+            s['prefix'] = (s['prefix'] << np.uint64(16)) | np.uint64(digit)
+            s['shift'] -= 16
+            s['count'] = int(counts[i][digit])
+            if s['shift'] == 0:
+                # All the candidates are equal :
+                s['value'] = _keys_to_float([s['prefix']])[0]
+    return np.array([s['value'] for s in state])
+
+
+def _stitch_intervals(intervals):
+    """Concatenate the intervals of chunks and stitch them at the borders.
+
+    Parameters
+    ----------
+    intervals : list
+        List of arrays of shape (n_events, 2) of sorted (start, stop)
+        intervals, one per chunk, in global indices.
+
+    Returns
+    -------
+    intervals : array_like
+        Array of shape (n_events, 2). Events that touch the border of two
+        chunks are merged.
+    """
+    intervals = [np.asarray(k, dtype=int).reshape(-1, 2) for k in intervals]
+    intervals = np.concatenate(intervals + [np.zeros((0, 2), dtype=int)])
+    if len(intervals) < 2:
+        return intervals
+    keep = intervals[1:, 0] != intervals[:-1, 1]
+    return np.c_[intervals[np.r_[True, keep], 0],
+                 intervals[np.r_[keep, True], 1]]
+
+
+def _chunked_extrema(read, n, intervals, chunk):
+    """Find the maximum and the minimum of the data inside each event.
+
+    Parameters
+    ----------
+    read : function
+        Function read(start, stop) returning the data between two time
+        indices.
+    n : int
+        Number of time points.
+    intervals : array_like
+        Array of shape (n_events, 2) with the sorted (start, stop) indices of
+        each (non-empty) event.
+    chunk : int
+        Number of time points read at once.
+
+    Returns
+    -------
+    x_max, i_max, x_min, i_min : array_like
+        Maximum / minimum of each event and their first location (relative
+        to the start of the event). See _intervals_extrema.
+    """
+    from .event import _intervals_extrema
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    if not len(intervals):
+        return (np.array([]),) * 4
+    ev, pieces = [], []
+    for start, stop, _, _ in _iter_chunks(n, chunk):
+        # Events (or pieces of events) inside the chunk :
+        first = np.searchsorted(intervals[:, 1], start, side='right')
+        last = np.searchsorted(intervals[:, 0], stop, side='left')
+        if last <= first:
+            continue
+        piece = np.clip(intervals[first:last], start, stop)
+        x_max, i_max, x_min, i_min = _intervals_extrema(read(start, stop),
+                                                        piece - start)
+        # Locations relative to the start of the event :
+        shift = piece[:, 0] - intervals[first:last, 0]
+        ev.append(np.arange(first, last))
+        pieces.append(np.c_[x_max, i_max + shift, x_min, i_min + shift])
+    ev, pieces = np.concatenate(ev), np.concatenate(pieces)
+    # Sort pieces by event (chunks are already sorted) :
+    order = np.argsort(ev, kind='mergesort')
+    ev, pieces = ev[order], pieces[order]
+    group = np.flatnonzero(np.r_[True, ev[1:] != ev[:-1]])
+    length = np.diff(np.r_[group, len(ev)])
+
+    def _first(values, locations, ufunc):
+        extremum = ufunc.reduceat(values, group)
+        is_ext = np.flatnonzero(values == np.repeat(extremum, length))
+        return extremum, locations[is_ext[np.searchsorted(is_ext, group)]]
+
+    x_max, i_max = _first(pieces[:, 0], pieces[:, 1], np.maximum)
+    x_min, i_min = _first(pieces[:, 2], pieces[:, 3], np.minimum)
+    return x_max, i_max.astype(int), x_min, i_min.astype(int)
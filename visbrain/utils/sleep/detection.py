@@ -11,16 +11,59 @@ Perform:
 - Peak detection
 """
 import numpy as np
-from scipy.signal import hilbert, detrend
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from scipy.signal import hilbert
 
-from ..filtering import filt, morlet, morlet_power
+from ..filtering import filt, morlet, morlet_power, _filt_coefs
 from ..sigproc import derivative, tkeo, smoothing
-from .event import (_events_duration, _events_removal, _events_distance_fill,
-                    _events_amplitude)
+from .event import (_events_proximity, _intervals_to_events,
+                    _mask_to_intervals, _intervals_to_mask, _intervals_merge,
+                    _intervals_duration, _intervals_amplitude)
+from .chunk import (_chunked_map, _wavelets_length, _filtfilt_length,
+                    _hypno_stages, _RunningStats, _streaming_kth,
+                    _stitch_intervals, _chunked_extrema)
 
 __all__ = ('kcdetect', 'spindlesdetect', 'remdetect', 'slowwavedetect',
            'mtdetect', 'peakdetect')
 
+
+def _detection_output(intervals, sf, length):
+    """Get the outputs of a detection from the intervals of events.
+
+    Parameters
+    ----------
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        detected event (stop excluded).
+    sf : float
+        The sampling frequency.
+    length : int
+        Number of time points used for the density.
+
+    Returns
+    -------
+    idx_sup_thr : array_like
+        Array of supra-threshold indices
+    number : int
+        Number of detected events
+    density : float
+        Number of events per minutes of data
+    duration_ms : array_like
+        Duration (ms) of each detected event
+    """
+    if not len(intervals):
+        return np.array([], dtype=int), 0., 0., np.array([], dtype=int)
+    number = len(intervals)
+    density = number / (length / sf / 60.)
+    return (_intervals_to_events(intervals), number, density,
+            _intervals_duration(intervals, sf))
+
+
+def _band_centers(freqs):
+    """Get the center frequencies of successive frequency bands."""
+    freqs = np.asarray(freqs, dtype=float)
+    return np.c_[freqs[0:-1], freqs[1::]].mean(1)
+
 ###########################################################################
 # K-COMPLEX DETECTION
 ###########################################################################
@@ -29,7 +72,7 @@ __all__ = ('kcdetect', 'spindlesdetect', 'remdetect', 'slowwavedetect',
 def kcdetect(elec, sf, proba_thr, amp_thr, hypno, nrem_only, tmin, tmax,
              kc_min_amp, kc_max_amp, fmin=.5, fmax=4., delta_thr=.8,
              smoothing_s=30, spindles_thresh=2., range_spin_sec=20,
-             kc_peak_min_distance=100., min_distance_ms=500.):
+             kc_peak_min_distance=100., min_distance_ms=500., chunk=None):
     """Perform a K-complex detection.
 
     Parameters
@@ -74,6 +117,10 @@ def kcdetect(elec, sf, proba_thr, amp_thr, hypno, nrem_only, tmin, tmax,
         Minimum distance (ms) between the minimum and maxima of a KC
     min_distance_ms : float | 500.
         Minimum distance (ms) between two KCs to be considered unique.
+    chunk : int | None
+        Number of time points processed at once. If None, the whole
+        recording is processed in memory. Because of the bandpass filter,
+        the chunked detection matches the in-memory one up to a tolerance.
 
     Returns
     -------
@@ -86,101 +133,209 @@ def kcdetect(elec, sf, proba_thr, amp_thr, hypno, nrem_only, tmin, tmax,
     duration_ms : float
         Duration (ms) of each K-complex detected
     """
+    if chunk is not None:
+        return _kc_chunked(elec, sf, proba_thr, amp_thr, hypno, nrem_only,
+                           tmin, tmax, kc_min_amp, kc_max_amp, fmin, fmax,
+                           delta_thr, smoothing_s, spindles_thresh,
+                           range_spin_sec, kc_peak_min_distance,
+                           min_distance_ms, chunk)
+    traces = _kc_traces(elec, sf, hypno, nrem_only, fmin, fmax, smoothing_s)
+    return _kc_threshold(traces, sf, proba_thr, amp_thr, tmin, tmax,
+                         kc_min_amp, kc_max_amp, delta_thr, spindles_thresh,
+                         range_spin_sec, kc_peak_min_distance,
+                         min_distance_ms)
+
+
+def _kc_traces(elec, sf, hypno, nrem_only, fmin, fmax, smoothing_s):
+    """Feature stage of the K-complex detection (see kcdetect)."""
     # Find if hypnogram is loaded :
     hyploaded = True if np.unique(hypno).size > 1 and nrem_only else False
-
-    data = elec
-    length = max(data.shape)
+    length = max(elec.shape)
 
     # PRE DETECTION
     # Compute delta band power
-    # Morlet's wavelet
-    freqs = np.array([0.1, 4., 8., 12., 16., 30.])
-    delta_npow = morlet_power(data, freqs, sf, norm=True)[0]
-    delta_nfpow = smoothing(delta_npow, smoothing_s * sf)
-    idx_no_delta = np.where(delta_nfpow < delta_thr)[0]
-    idx_loc_delta = np.where(delta_npow > np.mean(delta_npow))[0]
+    delta_npow, delta_nfpow, sig_transformed = _kc_features(
+        elec, sf, fmin, fmax, smoothing_s)
+    sig_transformed = sig_transformed[:length - 2]
+    # Spindles (with the default parameters of spindlesdetect) :
+    spindles = _spindles_traces(elec, sf, hypno, False, 12., 14., 500,
+                                'wavelet')
+    return dict(elec=elec, hypno=hypno, hyploaded=hyploaded, length=length,
+                delta_nfpow=delta_nfpow,
+                is_loc_delta=delta_npow > np.mean(delta_npow),
+                tkeo=sig_transformed, tkeo_mean=np.mean(sig_transformed),
+                tkeo_std=np.std(sig_transformed), spindles=spindles)
+
+
+def _kc_threshold(traces, sf, proba_thr, amp_thr, tmin, tmax, kc_min_amp,
+                  kc_max_amp, delta_thr, spindles_thresh, range_spin_sec,
+                  kc_peak_min_distance, min_distance_ms):
+    """Thresholding stage of the K-complex detection (see kcdetect)."""
+    data, length = traces['elec'], traces['length']
+    is_no_delta = traces['delta_nfpow'] < delta_thr
 
     # MAIN DETECTION
-    # Bandpass filtering
-    sig_filt = filt(sf, np.array([fmin, fmax]), data)
-    # Taiger-Keaser energy operator
-    sig_transformed = tkeo(sig_filt)
     # Initial thresholding of the TKEO's amplitude
-    thresh = np.mean(sig_transformed) + amp_thr * np.std(sig_transformed)
-    idx_sup_thr = np.where(sig_transformed >= thresh)[0]
+    sig_transformed = traces['tkeo']
+    thresh = traces['tkeo_mean'] + amp_thr * traces['tkeo_std']
+    is_sup_thr = np.zeros((length,), dtype=bool)
+    is_sup_thr[:len(sig_transformed)] = sig_transformed >= thresh
 
-    if idx_sup_thr.size > 0:
+    if is_sup_thr.any():
         # Check if spindles are present in range_spin_sec
-        idx_spin, _, _, _ = spindlesdetect(data, sf, spindles_thresh, hypno,
-                                           nrem_only=False)
-
-        number, _, idx_start, idx_stop = _events_duration(idx_sup_thr, sf)
-
-        spin_bool = np.array([], dtype=np.bool)
-        for i, j in enumerate(idx_start):
-            step = 0.5 * range_spin_sec * sf
-            st_spin = idx_sup_thr[j]
-            is_spin = np.in1d(np.arange(st_spin - step, st_spin + step, 1),
-                              idx_spin, assume_unique=True)
-            spin_bool = np.append(spin_bool, any(is_spin))
-        kc_spin = np.where(spin_bool)[0]
-        idx_kc_spin = idx_sup_thr[_events_removal(idx_start, idx_stop,
-                                                  kc_spin)]
-
-        # Compute probability
-        proba = np.zeros(shape=data.shape)
-        proba[idx_sup_thr] += 0.1
-        proba[idx_no_delta] += 0.1
-        proba[idx_loc_delta] += 0.1
-        proba[idx_kc_spin] += 0.1
-
-        if hyploaded:
-            proba[hypno == -1] += -0.1
-            proba[hypno == 0] += -0.2
-            proba[hypno == 1] += 0
-            proba[hypno == 2] += 0.1
-            proba[hypno == 3] += -0.1
-            proba[hypno == 4] += -0.2
+        idx_spin = _spindles_threshold(traces['spindles'], sf,
+                                       spindles_thresh, 500, 2000, 500,
+                                       .25)[0]
 
-        # Smooth and normalize probability vector
-        proba = proba / 0.5 if hyploaded else proba / 0.4
-        proba = smoothing(proba, sf)
+        kc = _mask_to_intervals(is_sup_thr)
+        spin_bool = _events_proximity(idx_spin, kc[:, 0],
+                                      0.5 * range_spin_sec * sf)
+        is_kc_spin = _intervals_to_mask(kc[spin_bool], len(is_sup_thr))
 
         # Keep only proba >= proba_thr (user defined threshold)
-        idx_sup_thr = np.intersect1d(idx_sup_thr, np.where(
-            proba >= proba_thr)[0], True)
+        is_sup_thr &= _kc_proba(sf, is_sup_thr, is_no_delta,
+                                traces['is_loc_delta'], is_kc_spin,
+                                traces['hypno'],
+                                traces['hyploaded']) >= proba_thr
 
-    if idx_sup_thr.size > 0:
+    kc = _mask_to_intervals(is_sup_thr)
+    if len(kc):
         # K-COMPLEX MORPHOLOGY
-        idx_sup_thr = _events_distance_fill(idx_sup_thr, min_distance_ms, sf)
-        _, duration_ms, idx_start, idx_stop = _events_duration(idx_sup_thr, sf)
+        kc = _intervals_merge(kc, min_distance_ms, sf)
+        kc_amp, distance_ms = _intervals_amplitude(data, kc, sf)
+        kc = _kc_morphology(kc, sf, kc_amp, distance_ms, tmin, tmax,
+                            kc_min_amp, kc_max_amp, kc_peak_min_distance,
+                            min_distance_ms)
 
-        kc_amp, distance_ms = _events_amplitude(data, idx_sup_thr,
-                                                idx_start, idx_stop, sf)
-        good_dur = np.where(np.logical_and(duration_ms > tmin,
-                                           duration_ms < tmax))[0]
+    # Export info
+    return _detection_output(kc, sf, length)
 
-        good_amp = np.where(np.logical_and(kc_amp > kc_min_amp,
-                                           kc_amp < kc_max_amp))[0]
-        good_dist = np.where(distance_ms > kc_peak_min_distance)[0]
 
-        good_event = np.intersect1d(good_amp, good_dur, True)
-        good_event = np.intersect1d(good_event, good_dist, True)
-        good_idx = _events_removal(idx_start, idx_stop, good_event)
+def _kc_features(data, sf, fmin, fmax, smoothing_s):
+    """Get the delta power and the TKEO used by the K-complex detection.
 
-        idx_sup_thr = idx_sup_thr[good_idx]
-        idx_sup_thr = _events_distance_fill(idx_sup_thr, min_distance_ms, sf)
+    The TKEO is padded with zeros to the length of the data.
+    """
+    # Morlet's wavelet
+    freqs = np.array([0.1, 4., 8., 12., 16., 30.])
+    delta_npow = morlet_power(data, freqs, sf, norm=True)[0]
+    delta_nfpow = smoothing(delta_npow, smoothing_s * sf)
+    # Bandpass filtering
+    sig_filt = filt(sf, np.array([fmin, fmax]), data)
+    # Taiger-Keaser energy operator
+    sig_transformed = np.zeros((len(data),))
+    sig_transformed[:len(data) - 2] = tkeo(sig_filt)
+    return delta_npow, delta_nfpow, sig_transformed
 
-        # Export info
-        number, duration_ms, idx_start, idx_stop = _events_duration(
-            idx_sup_thr, sf)
 
-        density = number / (length / sf / 60.)
-        return idx_sup_thr, number, density, duration_ms
+def _kc_proba(sf, is_sup_thr, is_no_delta, is_loc_delta, is_kc_spin, hypno,
+              hyploaded):
+    """Get the smoothed probability of K-complexes."""
+    # Compute probability
+    proba = np.zeros(shape=is_sup_thr.shape)
+    proba[is_sup_thr] += 0.1
+    proba[is_no_delta] += 0.1
+    proba[is_loc_delta] += 0.1
+    proba[is_kc_spin] += 0.1
 
-    else:
-        return np.array([], dtype=int), 0., 0., np.array([], dtype=int)
+    if hyploaded:
+        proba[hypno == -1] += -0.1
+        proba[hypno == 0] += -0.2
+        proba[hypno == 1] += 0
+        proba[hypno == 2] += 0.1
+        proba[hypno == 3] += -0.1
+        proba[hypno == 4] += -0.2
+
+    # Smooth and normalize probability vector
+    proba = proba / 0.5 if hyploaded else proba / 0.4
+    return smoothing(proba, sf)
+
+
+def _kc_morphology(kc, sf, kc_amp, distance_ms, tmin, tmax, kc_min_amp,
+                   kc_max_amp, kc_peak_min_distance, min_distance_ms):
+    """Keep the K-complexes with a valid duration, amplitude and shape."""
+    duration_ms = _intervals_duration(kc, sf)
+    good_dur = np.logical_and(duration_ms > tmin, duration_ms < tmax)
+    good_amp = np.logical_and(kc_amp > kc_min_amp, kc_amp < kc_max_amp)
+    good_dist = distance_ms > kc_peak_min_distance
+    good_event = good_dur & good_amp & good_dist
+
+    return _intervals_merge(kc[good_event], min_distance_ms, sf)
+
+
+def _kc_chunked(elec, sf, proba_thr, amp_thr, hypno, nrem_only, tmin, tmax,
+                kc_min_amp, kc_max_amp, fmin, fmax, delta_thr, smoothing_s,
+                spindles_thresh, range_spin_sec, kc_peak_min_distance,
+                min_distance_ms, chunk):
+    """Chunked K-complex detection (see kcdetect)."""
+    length = len(elec)
+    hyploaded = nrem_only and _hypno_stages(hypno, chunk).size > 1
+    b, a = _filt_coefs(sf, np.array([fmin, fmax]))
+    freqs = _band_centers([0.1, 4., 8., 12., 16., 30.])
+    overlap = max(_wavelets_length(sf, freqs) + int(smoothing_s * sf),
+                  _filtfilt_length(b, a) + 2)
+
+    def _features(start, stop):
+        data = np.asarray(elec[start:stop])
+        feat = _kc_features(data, sf, fmin, fmax, smoothing_s)
+        # The last two values of the TKEO are not defined :
+        is_tkeo = np.arange(start, stop) < length - 2
+        return feat + (is_tkeo,)
+
+    # First pass : mean of the delta power and statistics of the TKEO
+    delta_stats, tkeo_stats = _RunningStats(), _RunningStats()
+    for _, _, (delta_npow, _, sig_transformed, is_tkeo) in _chunked_map(
+            _features, length, chunk, overlap):
+        delta_stats.update(delta_npow)
+        tkeo_stats.update(sig_transformed[is_tkeo])
+    thresh = tkeo_stats.mean + amp_thr * tkeo_stats.std
+
+    # Second pass : supra-threshold TKEO
+    kc = _stitch_intervals([_mask_to_intervals(
+        (sig_transformed >= thresh) & is_tkeo) + start for start, _, (
+        _, _, sig_transformed, is_tkeo) in _chunked_map(
+        _features, length, chunk, overlap)])
+
+    if len(kc):
+        # Check if spindles are present in range_spin_sec
+        idx_spin, _, _, _ = spindlesdetect(elec, sf, spindles_thresh, hypno,
+                                           nrem_only=False, chunk=chunk)
+        spin_bool = _events_proximity(idx_spin, kc[:, 0],
+                                      0.5 * range_spin_sec * sf)
+        kc_spin = kc[spin_bool]
+
+        # Third pass : probability, which is smoothed over one second
+        def _proba(start, stop):
+            delta_npow, delta_nfpow, sig_transformed, is_tkeo = _features(
+                start, stop)
+            is_sup_thr = (sig_transformed >= thresh) & is_tkeo
+            first = np.searchsorted(kc_spin[:, 1], start, side='right')
+            last = np.searchsorted(kc_spin[:, 0], stop, side='left')
+            spin = np.clip(kc_spin[first:last], start, stop) - start
+            is_kc_spin = _intervals_to_mask(spin, stop - start)
+            hyp = np.asarray(hypno[start:stop]) if hyploaded else None
+            proba = _kc_proba(sf, is_sup_thr, delta_nfpow < delta_thr,
+                              delta_npow > delta_stats.mean, is_kc_spin, hyp,
+                              hyploaded)
+            return (is_sup_thr & (proba >= proba_thr),)
+
+        kc = _stitch_intervals([_mask_to_intervals(is_kc) + start for start,
+                                _, (is_kc,) in _chunked_map(
+            _proba, length, chunk, overlap + int(sf) + 1)])
+
+    if len(kc):
+        # K-COMPLEX MORPHOLOGY
+        kc = _intervals_merge(kc, min_distance_ms, sf)
+        x_max, i_max, x_min, i_min = _chunked_extrema(
+            lambda start, stop: np.asarray(elec[start:stop]), length, kc,
+            chunk)
+        kc = _kc_morphology(kc, sf, x_max - x_min,
+                            np.abs(i_max - i_min) / sf * 1000., tmin, tmax,
+                            kc_min_amp, kc_max_amp, kc_peak_min_distance,
+                            min_distance_ms)
+
+    # Export info
+    return _detection_output(kc, sf, length)
 
 
 ###########################################################################
@@ -189,7 +344,7 @@ def kcdetect(elec, sf, proba_thr, amp_thr, hypno, nrem_only, tmin, tmax,
 
 def spindlesdetect(elec, sf, threshold, hypno, nrem_only, fmin=12., fmax=14.,
                    tmin=500, tmax=2000, method='wavelet', min_distance_ms=500,
-                   sigma_thr=0.25):
+                   sigma_thr=0.25, chunk=None):
     """Perform a sleep spindles detection.
 
     Parameters
@@ -218,6 +373,10 @@ def spindlesdetect(elec, sf, threshold, hypno, nrem_only, fmin=12., fmax=14.,
         two distinct spindles
     sigma_thr : float | 0.25
         Sigma band-wise normalized power threshold (between 0 and 1)
+    chunk : int | None
+        Number of time points processed at once. If None, the whole
+        recording is processed in memory. Only the 'wavelet' method can be
+        used with chunks.
 
     Returns
     -------
@@ -231,6 +390,18 @@ def spindlesdetect(elec, sf, threshold, hypno, nrem_only, fmin=12., fmax=14.,
         Duration (ms) of each spindles detected
 
     """
+    if chunk is not None:
+        return _spindles_chunked(elec, sf, threshold, hypno, nrem_only, fmin,
+                                 fmax, tmin, tmax, method, min_distance_ms,
+                                 sigma_thr, chunk)
+    traces = _spindles_traces(elec, sf, hypno, nrem_only, fmin, fmax, tmin,
+                              method)
+    return _spindles_threshold(traces, sf, threshold, tmin, tmax,
+                               min_distance_ms, sigma_thr)
+
+
+def _spindles_traces(elec, sf, hypno, nrem_only, fmin, fmax, tmin, method):
+    """Feature stage of the spindles detection (see spindlesdetect)."""
     # Find if hypnogram is loaded :
     hyploaded = True if np.unique(hypno).size > 1 and nrem_only else False
 
@@ -243,12 +414,38 @@ def spindlesdetect(elec, sf, threshold, hypno, nrem_only, fmin=12., fmax=14.,
         data = elec
         length = max(data.shape)
 
+    amplitude, sigma_nfpow = _spindles_features(data, sf, fmin, fmax, tmin,
+                                                method)
+
+    if hyploaded:
+        amplitude[idx_zero] = np.nan
+
+    return dict(amplitude=amplitude, sigma_nfpow=sigma_nfpow, length=length,
+                mean=np.nanmean(amplitude), std=np.nanstd(amplitude))
+
+
+def _spindles_threshold(traces, sf, threshold, tmin, tmax, min_distance_ms,
+                        sigma_thr):
+    """Thresholding stage of the spindles detection (see spindlesdetect)."""
+    # Define threshold
+    thresh = traces['mean'] + threshold * traces['std']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        is_sup_thr = np.logical_and(traces['amplitude'] > thresh,
+                                    traces['sigma_nfpow'] > sigma_thr)
+
+    spin = _mask_to_intervals(is_sup_thr)
+    return _spindles_output(spin, sf, traces['length'], tmin, tmax,
+                            min_distance_ms)
+
+
+def _spindles_features(data, sf, fmin, fmax, tmin, method='wavelet'):
+    """Get the amplitude and the smoothed sigma power of the spindles."""
     # Pre-detection
     # Compute relative sigma power
     freqs = np.array([0.5, 4., 8., fmin, fmax])
     sigma_npow = morlet_power(data, freqs, sf, norm=True)[-1]
     sigma_nfpow = smoothing(sigma_npow, sf * (tmin / 1000))
-    idx_sigma = np.where(sigma_nfpow > sigma_thr)[0]
 
     # Get complex decomposition of filtered data :
     if method == 'hilbert':
@@ -264,41 +461,56 @@ def spindlesdetect(elec, sf, threshold, hypno, nrem_only, fmin=12., fmax=14.,
     elif method == 'wavelet':
         analytic = morlet(data, sf, np.mean([fmin, fmax]))
 
-    amplitude = np.abs(analytic)
+    return np.abs(analytic), sigma_nfpow
 
-    if hyploaded:
-        amplitude[idx_zero] = np.nan
-
-    # Define threshold
-    thresh = np.nanmean(amplitude) + threshold * np.nanstd(amplitude)
-
-    with np.errstate(divide='ignore', invalid='ignore'):
-        idx_sup_thr = np.where(amplitude > thresh)[0]
 
-    if idx_sup_thr.size > 0:
+def _spindles_output(spin, sf, length, tmin, tmax, min_distance_ms):
+    """Merge the spindles and keep the ones with a valid duration."""
+    spin = _intervals_merge(spin, min_distance_ms, sf)
 
-        idx_sup_thr = np.intersect1d(idx_sup_thr, idx_sigma, True)
-        idx_sup_thr = _events_distance_fill(idx_sup_thr, min_distance_ms, sf)
+    # Get where min_dur < spindles duration < max_dur :
+    duration_ms = _intervals_duration(spin, sf)
+    good_dur = np.logical_and(duration_ms > tmin, duration_ms < tmax)
 
-        # Get where spindles start / end and duration :
-        _, duration_ms, idx_start, idx_stop = _events_duration(idx_sup_thr,
-                                                               sf)
+    return _detection_output(spin[good_dur], sf, length)
 
-        # Get where min_dur < spindles duration < max_dur :
-        good_dur = np.where(np.logical_and(duration_ms > tmin,
-                                           duration_ms < tmax))[0]
 
-        good_idx = _events_removal(idx_start, idx_stop, good_dur)
+def _spindles_chunked(elec, sf, threshold, hypno, nrem_only, fmin, fmax,
+                      tmin, tmax, method, min_distance_ms, sigma_thr, chunk):
+    """Chunked spindles detection (see spindlesdetect)."""
+    if method != 'wavelet':
+        raise ValueError("Only the 'wavelet' method can be used for the "
+                         "chunked spindles detection.")
+    n = len(elec)
+    hyploaded = nrem_only and _hypno_stages(hypno, chunk).size > 1
+    freqs = _band_centers([0.5, 4., 8., fmin, fmax])
+    overlap = _wavelets_length(sf, freqs) + int(sf * (tmin / 1000))
 
-        idx_sup_thr = idx_sup_thr[good_idx]
-
-        number, duration_ms, _, _ = _events_duration(idx_sup_thr, sf)
-        density = number / (length / sf / 60.)
-
-        return idx_sup_thr, number, density, duration_ms
-
-    else:
-        return np.array([], dtype=int), 0., 0., np.array([], dtype=int)
+    def _features(start, stop):
+        data = np.asarray(elec[start:stop])
+        if hyploaded:
+            hyp = np.asarray(hypno[start:stop])
+            data = data.copy()
+            data[np.logical_or(hyp < 1, hyp == 4)] = 0.
+        amplitude, sigma_nfpow = _spindles_features(data, sf, fmin, fmax,
+                                                    tmin)
+        is_th = data != 0 if hyploaded else np.ones((len(data),), bool)
+        return amplitude, sigma_nfpow, is_th
+
+    # First pass : statistics of the amplitude
+    stats = _RunningStats()
+    for _, _, (amplitude, _, is_th) in _chunked_map(_features, n, chunk,
+                                                    overlap):
+        stats.update(amplitude[is_th])
+    thresh = stats.mean + threshold * stats.std
+
+    # Second pass : supra-threshold values
+    spin = _stitch_intervals([_mask_to_intervals(
+        (amplitude > thresh) & (sigma_nfpow > sigma_thr) & is_th) + start
+        for start, _, (amplitude, sigma_nfpow, is_th) in _chunked_map(
+            _features, n, chunk, overlap)])
+    return _spindles_output(spin, sf, stats.n if hyploaded else n, tmin,
+                            tmax, min_distance_ms)
 
 
 ###########################################################################
@@ -308,7 +520,7 @@ def spindlesdetect(elec, sf, threshold, hypno, nrem_only, fmin=12., fmax=14.,
 
 def remdetect(elec, sf, hypno, rem_only, threshold, tmin=200, tmax=1500,
               min_distance_ms=200, smoothing_ms=200, deriv_ms=30,
-              amplitude_art=400):
+              amplitude_art=400, chunk=None):
     """Perform a rapid eye movement (REM) detection.
 
     Function to perform a semi-automatic detection of rapid eye movements
@@ -341,6 +553,9 @@ def remdetect(elec, sf, hypno, rem_only, threshold, tmin=200, tmax=1500,
         Time (ms) window of derivative computation
     amplitude_art : int | 400
         Remove extreme values from the signal
+    chunk : int | None
+        Number of time points processed at once. If None, the whole
+        recording is processed in memory.
 
     Returns
     -------
@@ -353,50 +568,100 @@ def remdetect(elec, sf, hypno, rem_only, threshold, tmin=200, tmax=1500,
     duration_ms: float
         Duration (ms) of each REM detected
     """
+    if chunk is not None:
+        return _rem_chunked(elec, sf, hypno, rem_only, threshold, tmin, tmax,
+                            min_distance_ms, smoothing_ms, deriv_ms,
+                            amplitude_art, chunk)
+    traces = _rem_traces(elec, sf, hypno, rem_only, smoothing_ms, deriv_ms)
+    return _rem_threshold(traces, sf, threshold, tmin, tmax, min_distance_ms,
+                          amplitude_art)
+
+
+def _rem_traces(elec, sf, hypno, rem_only, smoothing_ms, deriv_ms):
+    """Feature stage of the REM detection (see remdetect)."""
     if rem_only and 4 in hypno:
-        elec[(np.where(hypno < 4))] = 0
+        elec = elec.copy()
+        elec[hypno < 4] = 0
         length = np.count_nonzero(elec)
-        idx_zero = np.where(elec == 0)
+        is_th = elec != 0
     else:
         length = max(elec.shape)
+        is_th = np.ones(elec.shape, dtype=bool)
+
+    sm_sig, deriv = _rem_features(elec, sf, smoothing_ms, deriv_ms)
+    return dict(sm_sig=sm_sig, deriv=deriv, is_th=is_th, length=length)
+
+
+def _rem_threshold(traces, sf, threshold, tmin, tmax, min_distance_ms,
+                   amplitude_art):
+    """Thresholding stage of the REM detection (see remdetect)."""
+    deriv = traces['deriv']
+    # Remove extreme values
+    is_th = traces['is_th'] & (np.abs(traces['sm_sig']) <= amplitude_art)
+    # Find supra-threshold values
+    thresh = np.mean(deriv[is_th]) + threshold * np.std(deriv[is_th])
+    rem = _mask_to_intervals(deriv > thresh)
+    return _rem_output(rem, sf, traces['length'], tmin, tmax,
+                       min_distance_ms)
 
+
+def _rem_features(elec, sf, smoothing_ms, deriv_ms):
+    """Get the smoothed signal and its smoothed derivative."""
     # Smooth signal
     sm_sig = smoothing(elec, sf * (smoothing_ms / 1000))
     # Compute first derivative
     deriv = derivative(sm_sig, deriv_ms, sf)
     # Smooth derivative
     deriv = smoothing(deriv, sf * (smoothing_ms / 1000))
-    # Define threshold
-    if rem_only and 4 in hypno:
-        id_th = np.setdiff1d(np.arange(elec.size), idx_zero)
-    else:
-        id_th = np.arange(elec.size)
-    # Remove extreme values
-    id_th = np.setdiff1d(id_th, np.where(np.abs(sm_sig) > amplitude_art)[0])
-    # Find supra-threshold values
-    thresh = np.mean(deriv[id_th]) + threshold * np.std(deriv[id_th])
-    idx_sup_thr = np.where(deriv > thresh)[0]
-
-    if idx_sup_thr.size:
-
-        # Find REMs separated by less than min_distance_ms
-        idx_sup_thr = _events_distance_fill(idx_sup_thr, min_distance_ms, sf)
-
-        _, duration_ms, idx_start, idx_stop = _events_duration(idx_sup_thr, sf)
-
-        # Get where min_dur < REM duration < tmax
-        good_dur = np.where(np.logical_and(duration_ms > tmin,
-                                           duration_ms < tmax))[0]
-        good_idx = _events_removal(idx_start, idx_stop, good_dur)
-        idx_sup_thr = idx_sup_thr[good_idx]
-
-        number, duration_ms, _, _ = _events_duration(idx_sup_thr, sf)
-        density = number / (length / sf / 60.)
-
-        return idx_sup_thr, number, density, duration_ms
-
-    else:
-        return np.array([], dtype=int), 0., 0., np.array([], dtype=int)
+    return sm_sig, deriv
+
+
+def _rem_output(rem, sf, length, tmin, tmax, min_distance_ms):
+    """Merge the REMs and keep the ones with a valid duration."""
+    # Find REMs separated by less than min_distance_ms
+    rem = _intervals_merge(rem, min_distance_ms, sf)
+
+    # Get where min_dur < REM duration < tmax
+    duration_ms = _intervals_duration(rem, sf)
+    good_dur = np.logical_and(duration_ms > tmin, duration_ms < tmax)
+
+    return _detection_output(rem[good_dur], sf, length)
+
+
+def _rem_chunked(elec, sf, hypno, rem_only, threshold, tmin, tmax,
+                 min_distance_ms, smoothing_ms, deriv_ms, amplitude_art,
+                 chunk):
+    """Chunked REM detection (see remdetect)."""
+    n = len(elec)
+    is_rem = rem_only and 4 in _hypno_stages(hypno, chunk)
+    overlap = 2 * int(sf * (smoothing_ms / 1000)) + int(
+        deriv_ms / (1000 / sf)) + 2
+
+    def _features(start, stop):
+        data = np.asarray(elec[start:stop])
+        if is_rem:
+            data = data.copy()
+            data[np.asarray(hypno[start:stop]) < 4] = 0
+        sm_sig, deriv = _rem_features(data, sf, smoothing_ms, deriv_ms)
+        is_th = np.abs(sm_sig) <= amplitude_art
+        if is_rem:
+            is_th &= data != 0
+        return deriv, is_th, data != 0
+
+    # First pass : statistics of the derivative
+    stats, length = _RunningStats(), 0
+    for _, _, (deriv, is_th, is_nz) in _chunked_map(_features, n, chunk,
+                                                    overlap):
+        stats.update(deriv[is_th])
+        length += np.count_nonzero(is_nz)
+    thresh = stats.mean + threshold * stats.std
+
+    # Second pass : supra-threshold values
+    rem = _stitch_intervals([_mask_to_intervals(deriv > thresh) + start
+                             for start, _, (deriv, _, _) in _chunked_map(
+                                 _features, n, chunk, overlap)])
+    return _rem_output(rem, sf, length if is_rem else n, tmin, tmax,
+                       min_distance_ms)
 
 
 ###########################################################################
@@ -405,7 +670,8 @@ def remdetect(elec, sf, hypno, rem_only, threshold, tmin=200, tmax=1500,
 
 
 def slowwavedetect(elec, sf, threshold, min_amp=70., max_amp=400., fmin=.1,
-                   fmax=4., smoothing_s=30, min_duration_ms=500.):
+                   fmax=4., smoothing_s=30, min_duration_ms=500.,
+                   chunk=None):
     """Perform a Slow Wave detection.
 
     Parameters
@@ -430,6 +696,9 @@ def slowwavedetect(elec, sf, threshold, min_amp=70., max_amp=400., fmin=.1,
         Smoothing window in seconds
     min_duration_ms : float | 500.
         Minimum duration (ms) of slow waves
+    chunk : int | None
+        Number of time points processed at once. If None, the whole
+        recording is processed in memory.
 
     Returns
     -------
@@ -440,38 +709,57 @@ def slowwavedetect(elec, sf, threshold, min_amp=70., max_amp=400., fmin=.1,
     duration_ms : float
         Duration (ms) of each slow wave period detected
     """
+    if chunk is None:
+        traces = _sw_traces(elec, sf, fmin, fmax, smoothing_s)
+        return _sw_threshold(traces, sf, threshold, min_amp, max_amp,
+                             min_duration_ms)
     length = max(elec.shape)
+    freqs = [fmin, fmax, 8, 12, 16, 30]
+    overlap = _wavelets_length(sf, _band_centers(freqs)) + int(
+        smoothing_s * sf)
 
-    delta_nfpow = morlet_power(elec, [fmin, fmax, 8, 12, 16, 30], sf,
-                               norm=True)[0, :]
-
-    delta_nfpow = smoothing(delta_nfpow, smoothing_s * sf)
+    def _features(start, stop):
+        delta_nfpow = morlet_power(np.asarray(elec[start:stop]), freqs, sf,
+                                   norm=True)[0, :]
+        return (smoothing(delta_nfpow, smoothing_s * sf),)
 
     # Normalized power criteria
-    idx_sup_thr = np.where(delta_nfpow > threshold)[0]
-
-    if idx_sup_thr.size:
+    sw = _stitch_intervals([_mask_to_intervals(
+        delta_nfpow > threshold) + start for start, _, (
+        delta_nfpow,) in _chunked_map(_features, length, chunk, overlap)])
+    x_max, _, x_min, _ = _chunked_extrema(
+        lambda start, stop: np.asarray(elec[start:stop]), length, sw, chunk)
+    return _sw_output(sw, x_max - x_min, sf, length, min_amp, max_amp,
+                      min_duration_ms)
+
+
+def _sw_traces(elec, sf, fmin, fmax, smoothing_s):
+    """Feature stage of the slow wave detection (see slowwavedetect)."""
+    freqs = [fmin, fmax, 8, 12, 16, 30]
+    delta_nfpow = morlet_power(elec, freqs, sf, norm=True)[0, :]
+    delta_nfpow = smoothing(delta_nfpow, smoothing_s * sf)
+    return dict(elec=elec, delta_nfpow=delta_nfpow, length=max(elec.shape))
 
-        _, duration_ms, idx_start, idx_stop = _events_duration(idx_sup_thr, sf)
 
-        sw_amp, _ = _events_amplitude(elec, idx_sup_thr, idx_start,
-                                      idx_stop, sf)
+def _sw_threshold(traces, sf, threshold, min_amp, max_amp, min_duration_ms):
+    """Thresholding stage of the slow wave detection (see slowwavedetect)."""
+    # Normalized power criteria
+    sw = _mask_to_intervals(traces['delta_nfpow'] > threshold)
+    sw_amp, _ = _intervals_amplitude(traces['elec'], sw, sf,
+                                     get_distance=False)
+    return _sw_output(sw, sw_amp, sf, traces['length'], min_amp, max_amp,
+                      min_duration_ms)
 
-        good_amp = np.where(np.logical_and(sw_amp > min_amp,
-                                           sw_amp < max_amp))[0]
 
-        good_dur = np.where(duration_ms > min_duration_ms)[0]
-        good_event = np.intersect1d(good_amp, good_dur, True)
-        good_idx = _events_removal(idx_start, idx_stop, good_event)
-        idx_sup_thr = idx_sup_thr[good_idx]
+def _sw_output(sw, sw_amp, sf, length, min_amp, max_amp, min_duration_ms):
+    """Keep the slow waves with a valid amplitude and duration."""
+    duration_ms = _intervals_duration(sw, sf)
 
-        # Export info
-        number, duration_ms, _, _ = _events_duration(idx_sup_thr, sf)
-        density = number / (length / sf / 60.)
-        return idx_sup_thr, number, density, duration_ms
+    good_amp = np.logical_and(sw_amp > min_amp, sw_amp < max_amp)
+    good_dur = duration_ms > min_duration_ms
 
-    else:
-        return np.array([], dtype=int), 0., 0., np.array([], dtype=int)
+    # Export info
+    return _detection_output(sw[good_amp & good_dur], sf, length)
 
 
 ###########################################################################
@@ -481,7 +769,7 @@ def slowwavedetect(elec, sf, threshold, min_amp=70., max_amp=400., fmin=.1,
 
 def mtdetect(elec, sf, threshold, hypno, rem_only, fmin=0., fmax=50.,
              tmin=800, tmax=2500, min_distance_ms=1000, min_amp=10,
-             max_amp=400):
+             max_amp=400, chunk=None):
     """Perform a detection of muscle twicthes (MT).
 
     Sampling frequency must be at least 1000 Hz.
@@ -514,6 +802,9 @@ def mtdetect(elec, sf, threshold, hypno, rem_only, fmin=0., fmax=50.,
     max_amp : int | 400
         Maximum amplitude of Muscle Twitches. Above this threshold,
         detected events are probably artefacts.
+    chunk : int | None
+        Number of time points processed at once. If None, the whole
+        recording is processed in memory.
 
     Returns
     -------
@@ -526,68 +817,363 @@ def mtdetect(elec, sf, threshold, hypno, rem_only, fmin=0., fmax=50.,
     duration_ms : float
         Duration (ms) of each MT detected
     """
+    if chunk is not None:
+        return _mt_chunked(elec, sf, threshold, hypno, rem_only, fmin, fmax,
+                           tmin, tmax, min_distance_ms, min_amp, max_amp,
+                           chunk)
+    traces = _mt_traces(elec, sf, hypno, rem_only, fmin, fmax, tmin)
+    return _mt_threshold(traces, sf, threshold, tmin, tmax, min_distance_ms,
+                         min_amp, max_amp)
+
+
+def _mt_traces(elec, sf, hypno, rem_only, fmin, fmax, tmin):
+    """Feature stage of the muscle twitches detection (see mtdetect)."""
     if rem_only and 4 in hypno:
-        elec[(np.where(hypno < 4))] = 0
+        elec = elec.copy()
+        elec[hypno < 4] = 0
         length = np.count_nonzero(elec)
-        idx_zero = np.where(elec == 0)
     else:
         length = max(elec.shape)
 
-    # Morlet's envelope
-    analytic = morlet(elec, sf, np.mean([fmin, fmax]))
-    amplitude = np.abs(analytic)
-    amplitude = smoothing(amplitude, sf * (tmin / 1000))
+    amplitude = _mt_features(elec, sf, fmin, fmax, tmin)
 
     # Define threshold
     if rem_only and 4 in hypno:
-        id_th = np.setdiff1d(np.arange(elec.size), idx_zero)
+        is_th = elec != 0
     else:
         # Remove period with too much delta power (N2 - N3)
-        delta_nfpow = morlet_power(elec, [0.5, 4], sf, norm=False)
-        id_th = np.setdiff1d(np.arange(elec.size), np.where(
-            delta_nfpow > np.median(delta_nfpow))[0])
+        delta_nfpow = morlet_power(elec, [0.5, 4], sf, norm=False)[0, :]
+        is_th = delta_nfpow <= np.median(delta_nfpow)
 
     # Remove extreme values
-    id_th = np.setdiff1d(id_th, np.where(abs(elec) > 400)[0])
+    is_th &= abs(elec) <= 400
+    return dict(elec=elec, amplitude=amplitude, length=length,
+                mean=np.mean(amplitude[is_th]), std=np.std(amplitude[is_th]))
 
+
+def _mt_threshold(traces, sf, threshold, tmin, tmax, min_distance_ms,
+                  min_amp, max_amp):
+    """Thresholding stage of the muscle twitches detection (see mtdetect)."""
     # Find supra-threshold values
-    thresh = np.mean(amplitude[id_th]) + threshold * np.std(amplitude[id_th])
-    idx_sup_thr = np.where(amplitude > thresh)[0]
+    thresh = traces['mean'] + threshold * traces['std']
+    mt = _mask_to_intervals(traces['amplitude'] > thresh)
 
-    if idx_sup_thr.size:
+    # Find MTs separated by less than min_distance_ms
+    mt = _intervals_merge(mt, min_distance_ms, sf)
 
-        # Find MTs separated by less than min_distance_ms
-        idx_sup_thr = _events_distance_fill(idx_sup_thr, min_distance_ms, sf)
+    # Amplitude criteria
+    mt_amp, _ = _intervals_amplitude(traces['elec'], mt, sf,
+                                     get_distance=False)
+    return _mt_output(mt, mt_amp, sf, traces['length'], tmin, tmax, min_amp,
+                      max_amp)
 
-        _, _, idx_start, idx_stop = _events_duration(idx_sup_thr, sf)
 
-        # Amplitude criteria
-        mt_amp, _ = _events_amplitude(elec, idx_sup_thr, idx_start, idx_stop,
-                                      sf)
-        good_amp = np.where(np.logical_and(mt_amp > min_amp,
-                                           mt_amp < max_amp))[0]
-        good_idx = _events_removal(idx_start, idx_stop, good_amp)
+def _mt_features(elec, sf, fmin, fmax, tmin):
+    """Get the smoothed Morlet's envelope of the signal."""
+    # Morlet's envelope
+    analytic = morlet(elec, sf, np.mean([fmin, fmax]))
+    amplitude = np.abs(analytic)
+    return smoothing(amplitude, sf * (tmin / 1000))
+
+
+def _mt_output(mt, mt_amp, sf, length, tmin, tmax, min_amp, max_amp):
+    """Keep the MTs with a valid amplitude and duration."""
+    good_amp = np.logical_and(mt_amp > min_amp, mt_amp < max_amp)
+
+    # Duration criteria
+    duration_ms = _intervals_duration(mt, sf)
+    good_dur = np.logical_and(duration_ms > tmin, duration_ms < tmax)
+
+    # Keep only good events
+    return _detection_output(mt[good_amp & good_dur], sf, length)
+
+
+def _mt_chunked(elec, sf, threshold, hypno, rem_only, fmin, fmax, tmin, tmax,
+                min_distance_ms, min_amp, max_amp, chunk):
+    """Chunked detection of muscle twitches (see mtdetect)."""
+    n = len(elec)
+    is_rem = rem_only and 4 in _hypno_stages(hypno, chunk)
+    overlap = max(_wavelets_length(sf, [np.mean([fmin, fmax])]) + int(
+        sf * (tmin / 1000)), _wavelets_length(sf, _band_centers([0.5, 4])))
+
+    def _read(start, stop):
+        data = np.asarray(elec[start:stop])
+        if is_rem:
+            data = data.copy()
+            data[np.asarray(hypno[start:stop]) < 4] = 0
+        return data
+
+    def _delta(start, stop):
+        return morlet_power(_read(start, stop), [0.5, 4], sf,
+                            norm=False)[0:1, :]
+
+    # Median of the delta power (N2 - N3), found in a few streaming passes
+    if not is_rem:
+        ks = [(n - 1) // 2, n // 2]
+        median = _streaming_kth(lambda: (k[0] for _, _, k in _chunked_map(
+            _delta, n, chunk, overlap)), ks).mean()
+
+    def _features(start, stop):
+        data = _read(start, stop)
+        if is_rem:
+            is_th = data != 0
+        else:
+            is_th = morlet_power(data, [0.5, 4], sf,
+                                 norm=False)[0, :] <= median
+        # Remove extreme values
+        is_th &= abs(data) <= 400
+        return _mt_features(data, sf, fmin, fmax, tmin), is_th, data != 0
+
+    # First pass : statistics of the envelope
+    stats, length = _RunningStats(), 0
+    for _, _, (amplitude, is_th, is_nz) in _chunked_map(_features, n, chunk,
+                                                        overlap):
+        stats.update(amplitude[is_th])
+        length += np.count_nonzero(is_nz)
+    thresh = stats.mean + threshold * stats.std
+
+    # Second pass : supra-threshold values
+    mt = _stitch_intervals([_mask_to_intervals(amplitude > thresh) + start
+                            for start, _, (amplitude, _, _) in _chunked_map(
+                                _features, n, chunk, overlap)])
+
+    # Find MTs separated by less than min_distance_ms
+    mt = _intervals_merge(mt, min_distance_ms, sf)
+
+    # Amplitude criteria
+    x_max, _, x_min, _ = _chunked_extrema(_read, n, mt, chunk)
+    return _mt_output(mt, x_max - x_min, sf, length if is_rem else n, tmin,
+                      tmax, min_amp, max_amp)
 
-        # Duration criteria
-        _, duration_ms, idx_start, idx_stop = _events_duration(idx_sup_thr, sf)
-        good_dur = np.where(np.logical_and(duration_ms > tmin,
-                                           duration_ms < tmax))[0]
-        good_idx = _events_removal(idx_start, idx_stop, good_dur)
 
-        # Keep only good events
-        idx_sup_thr = idx_sup_thr[good_idx]
-        number, duration_ms, _, _ = _events_duration(idx_sup_thr, sf)
-        density = number / (length / sf / 60.)
+###########################################################################
+# PEAKS DETECTION
+###########################################################################
 
-        return idx_sup_thr, number, density, duration_ms
 
-    else:
-        return np.array([], dtype=int), 0., 0., np.array([], dtype=int)
+def _peaks_scan(y, y_next, delta, start, mx, w=64):
+    """Find the next maximum detected by peakdetect with a linear scan.
 
+    Parameters
+    ----------
+    y : array_like
+        Values of shape (n,).
+    y_next : array_like
+        Maximum of the 'lookahead' values starting at each value.
+    delta : float
+        Minimum difference between a peak and the following values.
+    start : int
+        Index where the scan starts.
+    mx : float
+        Running maximum of the values before start.
+    w : int | 64
+        Number of values of the first scanned window. The next windows are
+        twice longer.
 
-###########################################################################
-# PEAKS DETECTION
-###########################################################################
+    Returns
+    -------
+    k : int
+        Index of the maximum (n if there is none).
+    mx : float
+        Running maximum at the end of y if there is no maximum.
+    """
+    n = len(y)
+    while start < n:
+        sl = slice(start, start + w)
+        run_max = np.maximum(np.maximum.accumulate(y[sl]), mx)
+        is_peak = (y[sl] < run_max - delta) & (y_next[sl] < run_max)
+        k = is_peak.argmax()
+        if is_peak[k]:
+            return start + int(k), mx
+        mx, start, w = run_max[-1], start + w, 2 * w
+    return n, mx
+
+
+def _detrend(x):
+    """Remove the least-squares line (and the mean) of a signal.
+
+    This is equivalent to scipy.signal.detrend(x) followed by a demean, but
+    the line is computed in closed form (one pass over the data instead of a
+    least-squares solver).
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 2:
+        return np.zeros_like(x)
+    t = np.arange(n, dtype=float)
+    s_x, s_tx, t_mean = x.sum(), np.dot(t, x), (n - 1) / 2.
+    slope = (s_tx - t_mean * s_x) / (n * (n ** 2 - 1) / 12.)
+    t *= -slope
+    t += x
+    t -= s_x / n - slope * t_mean
+    return t
+
+
+def _peaks_lockstep(y, y_max, y_min, delta, mx, mn):
+    """Run the peakdetect state machine on several lanes at once.
+
+    Parameters
+    ----------
+    y : array_like
+        Array of shape (n_steps, n_lanes) with the values of each lane (NaN
+        values are ignored).
+    y_max, y_min : array_like
+        Maximum and minimum of the 'lookahead' values starting at each value.
+    delta : float
+        Minimum difference between a peak and the following values.
+    mx, mn : array_like
+        Running maximum and minimum of each lane before the first step. They
+        are updated inplace.
+
+    Returns
+    -------
+    is_max, is_min : array_like
+        Boolean arrays of shape (n_steps, n_lanes) where the maxima and the
+        minima are found.
+    """
+    is_max, is_min = np.zeros(y.shape, bool), np.zeros(y.shape, bool)
+    for t, v in enumerate(y):
+        np.fmax(mx, v, out=mx)
+        np.fmin(mn, v, out=mn)
+        # Look for max :
+        found = is_max[t]
+        np.less(v, mx - delta, out=found)
+        found &= (mx != np.inf) & (y_max[t] < mx)
+        np.copyto(mx, np.inf, where=found)
+        np.copyto(mn, np.inf, where=found)
+        # Look for min :
+        found = is_min[t]
+        np.greater(v, mn + delta, out=found)
+        found &= (mn != -np.inf) & (y_min[t] > mn) & ~is_max[t]
+        np.copyto(mn, -np.inf, where=found)
+        np.copyto(mx, -np.inf, where=found)
+    return is_max, is_min
+
+
+def _peaks_lane(y, y_max, y_min, delta, mx, mn, is_max, is_min):
+    """Run the peakdetect state machine on one lane.
+
+    The search stops as soon as it finds one of the peaks in is_max / is_min
+    because the next peaks do not depend on the starting state anymore.
+
+    Parameters
+    ----------
+    y, y_max, y_min, delta : array_like, array_like, array_like, float
+        See _peaks_lockstep (for one lane, without NaN values).
+    mx, mn : float
+        Running maximum and minimum before the lane.
+    is_max, is_min : array_like
+        Peaks of the lane found with another starting state.
+
+    Returns
+    -------
+    is_max, is_min : array_like
+        Peaks of the lane.
+    mx, mn : float | None
+        Running maximum and minimum at the end of the lane (None if the
+        search has found one of the peaks in is_max / is_min).
+    """
+    n = len(y)
+    new_max, new_min = np.zeros((n,), bool), np.zeros((n,), bool)
+    start = 0
+    while True:
+        # Maxima are searched before minima :
+        k_max = k_min = n
+        if mx != np.inf:
+            k_max, mx = _peaks_scan(y, y_max, delta, start, mx)
+        if mn != -np.inf:
+            k_min, mn = _peaks_scan(-y, -y_min, delta, start, -mn)
+            mn = -mn
+        if min(k_max, k_min) >= n:
+            return new_max, new_min, mx, mn
+        if k_max <= k_min:
+            k, new, old, mx, mn = k_max, new_max, is_max, np.inf, np.inf
+        else:
+            k, new, old, mx, mn = k_min, new_min, is_min, -np.inf, -np.inf
+        new[k], start = True, k + 1
+        if old[k]:
+            new_max[start:], new_min[start:] = is_max[start:], is_min[start:]
+            return new_max, new_min, None, None
+
+
+def _peaks_search(index, y_axis, lookahead, delta, n_steps=256):
+    """Run the peakdetect search of alternating maxima and minima.
+
+    The candidates are split into lanes that are searched at once. Each lane
+    starts with the final state of the previous lane found by a first pass.
+    The lanes with a wrong starting state are then searched again.
+
+    Parameters
+    ----------
+    index : array_like
+        Indices of the candidate values.
+    y_axis : array_like
+        The data.
+    lookahead : int
+        Distance to look ahead from a peak candidate.
+    delta : float
+        Minimum difference between a peak and the following points.
+    n_steps : int | 256
+        Minimum number of candidates per lane.
+
+    Returns
+    -------
+    max_peaks, min_peaks : list
+        Indices of the maxima and of the minima.
+    dump : list
+        For each peak (in order), True if it is a maximum.
+    """
+    n, length = len(index), len(y_axis)
+    if not n:
+        return [], [], []
+    dtype = y_axis.dtype if y_axis.dtype.kind == 'f' else float
+    # Maximum / minimum of the 'lookahead' points starting at each index :
+    org = (lookahead - 1) // 2
+    y_max = maximum_filter1d(y_axis[::-1], lookahead, mode='nearest',
+                             origin=org)[::-1]
+    y_min = minimum_filter1d(y_axis[::-1], lookahead, mode='nearest',
+                             origin=org)[::-1]
+    # Split the candidates into lanes :
+    n_lanes = min(max(n // n_steps, 1), 4096)
+    n_steps = -(-n // n_lanes)
+    pad = np.full((n_lanes * n_steps - n,), np.nan, dtype=dtype)
+
+    def _lanes(x):
+        x = np.r_[x[index].astype(dtype, copy=False), pad]
+        return np.ascontiguousarray(x.reshape(n_lanes, n_steps).T)
+    y, y_next_max, y_next_min = _lanes(y_axis), _lanes(y_max), _lanes(y_min)
+    # First pass to estimate the state at the end of each lane :
+    mx = np.full((n_lanes,), -np.inf, dtype=dtype)
+    mn = np.full((n_lanes,), np.inf, dtype=dtype)
+    _peaks_lockstep(y, y_next_max, y_next_min, delta, mx, mn)
+    mx = np.r_[-np.inf, mx[:-1]].astype(dtype)
+    mn = np.r_[np.inf, mn[:-1]].astype(dtype)
+    first = (mx.tolist(), mn.tolist())
+    is_max, is_min = _peaks_lockstep(y, y_next_max, y_next_min, delta, mx,
+                                     mn)
+    # Search again the lanes that started with a wrong state :
+    mx, mn = mx.tolist(), mn.tolist()
+    for s in range(1, n_lanes):
+        if (first[0][s] == mx[s - 1]) and (first[1][s] == mn[s - 1]):
+            continue
+        sl = slice(0, min(n_steps, n - s * n_steps))
+        new_max, new_min, s_mx, s_mn = _peaks_lane(
+            y[sl, s], y_next_max[sl, s], y_next_min[sl, s], delta,
+            mx[s - 1], mn[s - 1], is_max[sl, s], is_min[sl, s])
+        is_max[sl, s], is_min[sl, s] = new_max, new_min
+        if s_mx is not None:
+            mx[s], mn[s] = float(s_mx), float(s_mn)
+    # Peaks in order :
+    p_max = np.flatnonzero(is_max.T.ravel())
+    p_min = np.flatnonzero(is_min.T.ravel())
+    peaks = np.r_[p_max, p_min]
+    order = np.argsort(peaks, kind='mergesort')
+    peaks, dump = index[peaks[order]], (order < len(p_max))
+    # End is within lookahead no more peaks can be found :
+    end = np.flatnonzero(peaks + lookahead >= length)
+    if len(end):
+        peaks, dump = peaks[:end[0] + 1], dump[:end[0] + 1]
+    return peaks[dump].tolist(), peaks[~dump].tolist(), dump.tolist()
 
 
 def peakdetect(sf, y_axis, x_axis=None, lookahead=200, delta=1., get='max',
@@ -644,14 +1230,12 @@ def peakdetect(sf, y_axis, x_axis=None, lookahead=200, delta=1., get='max',
         Density of peaks.
     """
     # ============== CHECK DATA ==============
-    if x_axis is None:
-        x_axis = range(len(y_axis))
     # Check length :
-    if len(y_axis) != len(x_axis):
+    if (x_axis is not None) and (len(y_axis) != len(x_axis)):
         raise ValueError("Input vectors y_axis and x_axis must have same "
                          "length")
     # Needs to be a numpy array
-    y_axis, x_axis = np.asarray(y_axis), np.asarray(x_axis)
+    y_axis = np.asarray(y_axis)
 
     # store data length for later use
     length = len(y_axis)
@@ -667,64 +1251,21 @@ def peakdetect(sf, y_axis, x_axis=None, lookahead=200, delta=1., get='max',
         raise ValueError("The get parameter must either be 'min', 'max' or"
                          " 'minmax'")
 
-    # ============== PRE-ALLOCATION ==============
-    max_peaks, min_peaks = [], []
-    dump = []   # Used to pop the first hit which almost always is false
-
-    # maxima and minima candidates are temporarily stored in
-    # mx and mn respectively
-    mn, mx = np.Inf, -np.Inf
-
     # ============== THRESHOLD ==============
     if threshold is not None:
-        if threshold is 'auto':
+        if isinstance(threshold, str) and threshold == 'auto':
             threshold = np.std(y_axis)
         # Detrend / demean y-axis :
-        y_axisp = detrend(y_axis)
-        y_axisp -= y_axisp.mean()
+        y_axisp = _detrend(y_axis)
         # Find values above threshold :
-        above = np.abs(y_axisp) >= threshold
-        zp = zip(np.arange(length)[above], x_axis[above], y_axis[above])
+        index = np.flatnonzero(np.abs(y_axisp) >= threshold)
     else:
-        zp = zip(np.arange(length)[:-lookahead], x_axis[:-lookahead],
-                 y_axis[:-lookahead])
+        index = np.arange(max(length - lookahead, 0))
 
     # ============== FIND MIN / MAX PEAKS ==============
     # Only detect peak if there is 'lookahead' amount of points after it
-    for index, x, y in zp:
-        if y > mx:
-            mx = y
-        if y < mn:
-            mn = y
-
-        # ==== Look for max ====
-        if y < mx - delta and mx != np.Inf:
-            # Maxima peak candidate found
-            # look ahead in signal to ensure that this is a peak and not jitter
-            if y_axis[index:index + lookahead].max() < mx:
-                max_peaks.append(index)
-                dump.append(True)
-                # set algorithm to only find minima now
-                mx = np.Inf
-                mn = np.Inf
-                if index + lookahead >= length:
-                    # end is within lookahead no more peaks can be found
-                    break
-                continue
-
-        # ==== Look for max ====
-        if y > mn + delta and mn != -np.Inf:
-            # Minima peak candidate found
-            # look ahead in signal to ensure that this is a peak and not jitter
-            if y_axis[index:index + lookahead].min() > mn:
-                min_peaks.append(index)
-                dump.append(False)
-                # set algorithm to only find maxima now
-                mn = -np.Inf
-                mx = -np.Inf
-                if index + lookahead >= length:
-                    # end is within lookahead no more peaks can be found
-                    break
+    max_peaks, min_peaks, dump = _peaks_search(index, y_axis, lookahead,
+                                               delta)
 
     if min_peaks and max_peaks:
         # ============== CLEAN ==============
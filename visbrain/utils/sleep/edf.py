@@ -1,4 +1,4 @@
-"""Module reads and writes header and data for EDF data.
+"""Module reads and writes header and data for EDF and BDF data.
 
 Poor man's version of
 https://github.com/breuderink/eegtools/blob/master/eegtools/io/edfplus.py
@@ -7,13 +7,15 @@ Values are slightly different from those computed by FieldTrip, however they
 are identical to those computed by Biosig and EDFBrowser. The difference is due
 to the calibration.
 
+BDF files (BioSemi) share the EDF header but store 24-bit samples.
 """
 from logging import getLogger
 
 from datetime import datetime
-from math import floor
+from math import ceil
 from re import findall
-from numpy import empty, asarray, fromstring, iinfo
+from numpy import (empty, asarray, iinfo, memmap, multiply, int8, int32,
+                   uint8)
 
 
 lg = getLogger(__name__)
@@ -23,6 +25,31 @@ DIGITAL_MAX = edf_iinfo.max
 DIGITAL_MIN = -1 * edf_iinfo.max  # so that digital 0 = physical 0
 
 
+def _bdf_to_int32(raw):
+    """Convert 24-bit little-endian samples into int32.
+
+    The most significant (signed) byte is cast to int32 then the two other
+    bytes are shifted in, in place.
+
+    Parameters
+    ----------
+    raw : array_like
+        Array of bytes (uint8) of shape (..., 3 * n_samples).
+
+    Returns
+    -------
+    numpy.ndarray
+        The int32 samples of shape (..., n_samples).
+    """
+    raw = raw.reshape(raw.shape[:-1] + (raw.shape[-1] // 3, 3))
+    dat = raw[..., 2].view(int8).astype(int32)
+    dat <<= 8
+    dat |= raw[..., 1]
+    dat <<= 8
+    dat |= raw[..., 0]
+    return dat
+
+
 def _assert_all_the_same(items):
     """Check that all the items in a list are the same."""
     assert all(items[0] == x for x in items)
@@ -31,10 +58,12 @@ def _assert_all_the_same(items):
 class Edf:
     """Provide class EDF, which can be used to read the header and the data.
 
+    Both EDF (16-bit) and BDF (24-bit, BioSemi) files are supported.
+
     Parameters
     ----------
     edffile : str
-        Full path for the EDF file
+        Full path for the EDF or BDF file
 
     Attributes
     ----------
@@ -58,7 +87,10 @@ class Edf:
 
             hdr = {}
             assert f.tell() == 0
-            assert f.read(8) == b'0       '
+            version = f.read(8)
+            assert version in [b'0       ', b'\xffBIOSEMI']
+            # number of bytes per sample (24-bit for BDF files)
+            hdr['n_bytes'] = 3 if version == b'\xffBIOSEMI' else 2
 
             # recording info
             hdr['subject_id'] = f.read(80).decode('utf-8').strip()
@@ -136,11 +168,35 @@ class Edf:
 
         return subj_id, start_time, s_freq, chan_name, n_samples, self.hdr
 
+    def _chan_index(self, chan):
+        """Convert channel names and/or indices into an array of indices."""
+        labels = self.hdr['label']
+        idx = [labels.index(k) if isinstance(k, str) else int(k)
+               for k in chan]
+        return asarray(idx, dtype=int)
+
+    def _memmap_records(self):
+        """Memory-map the data section as a (n_records, n_rec_samples) array.
+
+        Each row contains one data record, i.e. the samples of every channel
+        stored one after the other. For BDF files, each row contains the
+        3 * n_rec_samples bytes of the record.
+        """
+        n_rec_samples = sum(self.hdr['n_samples_per_record'])
+        if self.hdr['n_bytes'] == 3:
+            return memmap(self.filename, dtype=uint8, mode='r',
+                          offset=self.hdr['header_n_bytes'],
+                          shape=(self.hdr['n_records'], 3 * n_rec_samples))
+        return memmap(self.filename, dtype='<i2', mode='r',
+                      offset=self.hdr['header_n_bytes'],
+                      shape=(self.hdr['n_records'], n_rec_samples))
+
     def _read_dat(self, i_chan, begsam, endsam):
         """Read raw data from a single EDF channel.
 
-        Reads only one channel at the time. Very initial implementation, very
-        simple and probably not very fast
+        The data section is memory-mapped and the samples of the channel are
+        returned as a strided view over the data records, without any copy.
+        For BDF files, the 24-bit samples are unpacked into int32.
 
         Parameters
         ----------
@@ -154,59 +210,44 @@ class Edf:
         Returns
         -------
         numpy.ndarray
-            A vector with the data as written on file, in 16-bit precision
+            A (n_records, n_samples_per_record) view with the data as written
+            on file, in 16-bit precision (int32 for BDF files), covering the
+            records between begsam and endsam.
+        int
+            Index of begsam inside the first returned record.
         """
         assert begsam < endsam
 
-        begsam = float(begsam)
-        endsam = float(endsam)
-
         n_sam_rec = self.hdr['n_samples_per_record']
+        n_sam = n_sam_rec[i_chan]
 
-        begrec = int(floor(begsam / n_sam_rec[i_chan]))
-        begsam_rec = int(begsam % n_sam_rec[i_chan])
+        begrec = begsam // n_sam
+        endrec = int(ceil(endsam / n_sam))
 
-        endrec = int(floor(endsam / n_sam_rec[i_chan]))
-        endsam_rec = int(endsam % n_sam_rec[i_chan])
-
-        dat = empty(shape=(int(endsam) - int(begsam)), dtype='int16')
-        i_dat = 0
-
-        with open(self.filename, 'rb') as f:
-            for rec in range(begrec, endrec + 1):
-                if rec == begrec:
-                    begpos_rec = begsam_rec
-                else:
-                    begpos_rec = 0
+        # Position of the first sample of the channel inside a record :
+        begpos = sum(n_sam_rec[:i_chan])
 
-                if rec == endrec:
-                    endpos_rec = endsam_rec
-                else:
-                    endpos_rec = n_sam_rec[i_chan]
+        records = self._memmap_records()
+        if self.hdr['n_bytes'] == 3:
+            dat = _bdf_to_int32(records[begrec:endrec,
+                                        3 * begpos:3 * (begpos + n_sam)])
+        else:
+            dat = records[begrec:endrec, begpos:begpos + n_sam]
 
-                begpos = begpos_rec + sum(n_sam_rec) * rec + sum(
-                    n_sam_rec[:i_chan])
-                endpos = endpos_rec + sum(n_sam_rec) * rec + sum(
-                    n_sam_rec[:i_chan])
-
-                f.seek(begpos * 2 + self.hdr['header_n_bytes'])
-                samples = f.read(2 * (endpos - begpos))
-
-                i_dat_end = i_dat + endpos - begpos
-                dat[i_dat:i_dat_end] = fromstring(samples, dtype='<i2')
-                i_dat = i_dat_end
-
-        return dat
+        return dat, int(begsam - begrec * n_sam)
 
     def return_dat(self, chan, begsam, endsam):
-        """Read data from an EDF file.
+        """Read data from an EDF or BDF file.
 
-        Reads channel by channel, and adjusts the values by calibration.
+        The data section is memory-mapped once and every channel is decoded
+        record-wise in a vectorized way, then adjusted by calibration in
+        float32.
 
         Parameters
         ----------
-        chan : list of str
-            index (indices) of the channels to read
+        chan : list of str or int
+            names or index (indices) of the channels to read. All channels
+            must share the same sampling frequency.
         begsam : int
             index of the first sample
         endsam : int
@@ -218,24 +259,37 @@ class Edf:
             A 2d matrix, where the first dimension is the channels and the
             second dimension are the samples.
         """
+        i_chan = self._chan_index(chan)
         hdr = self.hdr
-        dig_min = hdr['digital_min']
-        phys_min = hdr['physical_min']
-        phys_range = hdr['physical_max'] - hdr['physical_min']
-        dig_range = hdr['digital_max'] - hdr['digital_min']
+        n_sam = asarray(hdr['n_samples_per_record'])[i_chan]
+        if any(n_sam != n_sam[0]):
+            raise ValueError("Channels read together must share the same "
+                             "sampling frequency.")
+        n_sam = int(n_sam[0])
+
+        dig_min = hdr['digital_min'][i_chan]
+        phys_min = hdr['physical_min'][i_chan]
+        phys_range = hdr['physical_max'][i_chan] - phys_min
+        dig_range = hdr['digital_max'][i_chan] - dig_min
 
         # assert all(phys_range > 0)
         # assert all(dig_range > 0)
 
-        gain = phys_range / dig_range
+        gain = (phys_range / dig_range).astype('float32')
+        offset = (phys_min - dig_min * phys_range / dig_range).astype(
+            'float32')
+
+        n_rec = int(ceil(endsam / n_sam)) - begsam // n_sam
+        dat = empty(shape=(len(i_chan), n_rec, n_sam), dtype='float32')
 
-        dat = empty(shape=(len(chan), endsam - begsam), dtype='float64')
+        for i, c in enumerate(i_chan):
+            raw, first = self._read_dat(c, begsam, endsam)
+            multiply(raw, gain[i], out=dat[i, ...])
+            dat[i, ...] += offset[i]
 
-        for i, i_chan in enumerate(chan):
-            d = self._read_dat(i, begsam, endsam).astype('float64')
-            dat[i, :] = (d - dig_min[i]) * gain[i] + phys_min[i]
+        dat = dat.reshape(len(i_chan), n_rec * n_sam)
 
-        return dat
+        return dat[:, first:first + endsam - begsam]
 
     def return_markers(self):
         """Return markers."""
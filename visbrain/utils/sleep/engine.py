@@ -0,0 +1,444 @@
+"""Multi-channel detection engine.
+
+This file contains :
+- detect_channel : run one of the sleep detections on a single channel.
+- FeatureCache : cache of the feature traces of the detections, so that
+  changing a threshold only runs the (fast) thresholding stage.
+- DetectionEngine : run a detection over many channels in a pool of threads
+  or processes, with cancellation and streaming of the per-channel results.
+"""
+import hashlib
+import inspect
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from queue import Queue, Empty
+
+import numpy as np
+
+from .detection import (remdetect, spindlesdetect, slowwavedetect, kcdetect,
+                        peakdetect, mtdetect, _rem_traces, _rem_threshold,
+                        _spindles_traces, _spindles_threshold, _sw_traces,
+                        _sw_threshold, _kc_traces, _kc_threshold, _mt_traces,
+                        _mt_threshold)
+from .event import _events_to_index
+
+logger = logging.getLogger('visbrain')
+
+__all__ = ('detect_channel', 'FeatureCache', 'DetectionEngine')
+
+# Detection functions, and if they need the hypnogram :
+_DETECTIONS = {'REM': (remdetect, True),
+               'Spindles': (spindlesdetect, True),
+               'Slow waves': (slowwavedetect, False),
+               'K-complexes': (kcdetect, True),
+               'Muscle twitches': (mtdetect, True),
+               'Peaks': (peakdetect, False)}
+
+# Feature and thresholding stages of the detections. The feature stage
+# only depends on the data, the hypnogram and on its own parameters :
+_STAGES = {'REM': (_rem_traces, _rem_threshold),
+           'Spindles': (_spindles_traces, _spindles_threshold),
+           'Slow waves': (_sw_traces, _sw_threshold),
+           'K-complexes': (_kc_traces, _kc_threshold),
+           'Muscle twitches': (_mt_traces, _mt_threshold)}
+
+
+def _digest(x):
+    """Get a digest of the content of an array."""
+    x = np.ascontiguousarray(x)
+    h = hashlib.sha1(str((x.dtype, x.shape)).encode())
+    h.update(x.view(np.uint8))
+    return h.hexdigest()
+
+
+def _stage_kwargs(fcn, params):
+    """Select the parameters of a stage of a detection."""
+    return {k: params[k] for k in inspect.signature(fcn).parameters
+            if k in params}
+
+
+class FeatureCache(object):
+    """Cache of the feature traces of the detections.
+
+    Feature traces (e.g. the wavelet amplitude of the spindles detection)
+    are stored by (detection, feature parameters, digest of the data and of
+    the hypnogram). The least recently used traces are dropped first.
+
+    Parameters
+    ----------
+    max_bytes : int | 2 ** 28
+        Maximum size (in bytes) of the cached traces.
+    """
+
+    def __init__(self, max_bytes=2 ** 28):
+        """Init."""
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Get the number of cached traces."""
+        return len(self._items)
+
+    def __contains__(self, key):
+        """Get if traces are cached."""
+        return key in self._items
+
+    @property
+    def nbytes(self):
+        """Get the size (in bytes) of the cached traces."""
+        with self._lock:
+            return sum(k[1] for k in self._items.values())
+
+    @staticmethod
+    def _nbytes(traces):
+        """Get the size of the arrays of (nested) traces."""
+        return sum(FeatureCache._nbytes(k) if isinstance(k, dict) else
+                   getattr(k, 'nbytes', 0) for k in traces.values())
+
+    def get(self, key, fcn):
+        """Get cached traces, or compute and cache them.
+
+        Parameters
+        ----------
+        key : tuple
+            Key of the traces.
+        fcn : function
+            Function without arguments that computes the traces.
+
+        Returns
+        -------
+        traces : dict
+            The feature traces.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key][0]
+        traces = fcn()
+        with self._lock:
+            self._items[key] = (traces, self._nbytes(traces))
+            self._items.move_to_end(key)
+            total = sum(k[1] for k in self._items.values())
+            while (total > self.max_bytes) and (len(self._items) > 1):
+                total -= self._items.popitem(last=False)[1][1]
+        return traces
+
+    def clear(self):
+        """Drop all the cached traces."""
+        with self._lock:
+            self._items.clear()
+
+
+def detect_channel(method, x, sf, hypno=None, time=None, cache=None,
+                   **kwargs):
+    """Run a detection on a single channel.
+
+    Parameters
+    ----------
+    method : {'REM', 'Spindles', 'Slow waves', 'K-complexes', 'Peaks',
+              'Muscle twitches'}
+        The detection method.
+    x : array_like
+        Data of the channel of shape (n_points,).
+    sf : float
+        The sampling frequency.
+    hypno : array_like | None
+        Per-sample hypnogram of shape (n_points,). Required by the REM,
+        spindles, K-complexes and muscle twitches detections.
+    time : array_like | None
+        The time vector (only used by the peak detection).
+    cache : FeatureCache | None
+        Cache of the feature traces. If the traces of this channel were
+        already computed with the same feature parameters, only the
+        thresholding stage of the detection is run. Not used by the peak
+        detection and by the chunked detections.
+    kwargs : dict | {}
+        Additional arguments sent to the detection function (e.g.
+        threshold=2. for the spindles detection).
+
+    Returns
+    -------
+    index : array_like
+        Array of shape (n_events, 2) with the (start, end) indices of each
+        event. For peaks, start and end are the index of the peak.
+    number : int
+        Number of detected events.
+    density : float
+        Density of detected events.
+    """
+    if method not in _DETECTIONS:
+        raise ValueError("Unknown detection %s. Use %s" % (
+            method, ', '.join(_DETECTIONS.keys())))
+    fcn, use_hypno = _DETECTIONS[method]
+    x = np.asarray(x)
+    if method == 'Peaks':
+        index, number, density = fcn(sf, x, time, **kwargs)
+        index = np.asarray(index, dtype=int)
+        return np.c_[index, index], number, density
+    if use_hypno:
+        if hypno is None:
+            raise ValueError("The %s detection needs the hypnogram." % method)
+        kwargs['hypno'] = hypno
+    if (cache is not None) and (method in _STAGES) and (
+            kwargs.get('chunk') is None):
+        index, number, density, _ = _detect_staged(method, x, sf, cache,
+                                                   **kwargs)
+    else:
+        index, number, density, _ = fcn(x, sf, **kwargs)
+    if np.size(index):
+        index = _events_to_index(index)
+    else:
+        index = np.zeros((0, 2), dtype=int)
+    return index, number, density
+
+
+def _detect_staged(method, x, sf, cache, **kwargs):
+    """Run a detection with cached feature traces (see detect_channel)."""
+    fcn = _DETECTIONS[method][0]
+    fcn_traces, fcn_threshold = _STAGES[method]
+    # Parameters of the detection, including the default ones :
+    params = inspect.signature(fcn).bind(x, sf, **kwargs)
+    params.apply_defaults()
+    params = params.arguments
+    # Traces depend on the data, the hypnogram and on the feature parameters
+    # (except the data and the hypnogram, they are hashable) :
+    feat = _stage_kwargs(fcn_traces, params)
+    key = tuple(sorted((k, v) for k, v in feat.items() if k not in (
+        'elec', 'hypno')))
+    key = (method, _digest(x)) + key
+    if 'hypno' in feat:
+        key += (_digest(feat['hypno']),)
+    traces = cache.get(key, lambda: fcn_traces(**feat))
+    return fcn_threshold(traces, **_stage_kwargs(fcn_threshold, params))
+
+
+def _detect_task(generation, chan, method, x, sf, hypno, time, cache,
+                 kwargs):
+    """Detection of a single channel, run in the pool."""
+    return generation, chan, detect_channel(method, x, sf, hypno, time,
+                                            cache, **kwargs)
+
+
+class DetectionEngine(object):
+    """Run a sleep detection over many channels in parallel.
+
+    Channels are read in a dispatching thread and sent to a pool of threads
+    or processes. Per-channel results are streamed as soon as they are
+    available (see the poll and results methods), so that they can be
+    consumed without waiting for the whole detection.
+
+    Parameters
+    ----------
+    sf : float
+        The sampling frequency.
+    data : array_like
+        Array-like of shape (n_channels, n_points). Can be a LazySleepData.
+    hypno : array_like | HypnoRuns | None
+        The hypnogram (one value per time point).
+    time : array_like | None
+        The time vector (only used by the peak detection).
+    n_jobs : int | None
+        Number of workers. By default, the number of processors.
+    backend : {'thread', 'process'}
+        Use a pool of threads or of processes.
+    cache : FeatureCache | None
+        Cache of the feature traces, so that running again a detection with
+        other thresholds is fast. Only used with the 'thread' backend.
+    """
+
+    def __init__(self, sf, data, hypno=None, time=None, n_jobs=None,
+                 backend='thread', cache=None):
+        """Init."""
+        if backend not in ('thread', 'process'):
+            raise ValueError("backend must either be 'thread' or 'process'")
+        self._sf = sf
+        self._time = time
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.cache = cache
+        self._results = Queue()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._done.set()
+        self._generation = 0
+        self._n_todo, self._n_done = 0, 0
+        self._thread = None
+        self.set_data(data, hypno)
+
+    def set_data(self, data, hypno=None):
+        """Set the data and the hypnogram.
+
+        Parameters
+        ----------
+        data : array_like
+            Array-like of shape (n_channels, n_points).
+        hypno : array_like | HypnoRuns | None
+            The hypnogram (one value per time point).
+        """
+        self.cancel()
+        self._data = data
+        if (hypno is not None) and hasattr(hypno, 'to_array'):
+            hypno = hypno.to_array()
+        self._hypno = hypno
+
+    @property
+    def running(self):
+        """Get if a detection is running."""
+        return not self._done.is_set()
+
+    @property
+    def progress(self):
+        """Get the (number of processed channels, number of channels)."""
+        return self._n_done, self._n_todo
+
+    def run(self, method, chans, **kwargs):
+        """Start a detection. A detection already running is canceled.
+
+        Parameters
+        ----------
+        method : string
+            The detection method (see detect_channel).
+        chans : array_like
+            Indices of the channels.
+        kwargs : dict | {}
+            Additional arguments sent to the detection function.
+        """
+        self.cancel()
+        chans = [int(k) for k in chans]
+        with self._lock:
+            self._generation += 1
+            self._cancel = cancel = threading.Event()
+            self._n_todo, self._n_done = len(chans), 0
+            if chans:
+                self._done.clear()
+            args = (self._generation, method, chans, kwargs, cancel)
+        if chans:
+            self._thread = threading.Thread(target=self._dispatch, args=args,
+                                            daemon=True)
+            self._thread.start()
+
+    def cancel(self):
+        """Cancel the running detection.
+
+        Results of the canceled detection that have not been polled yet are
+        dropped.
+        """
+        with self._lock:
+            self._cancel.set()
+            self._generation += 1
+            self._done.set()
+        # Drop results of the canceled detection :
+        self.poll()
+
+    def wait(self, timeout=None):
+        """Wait until the detection is over.
+
+        Parameters
+        ----------
+        timeout : float | None
+            Maximum time to wait (in seconds).
+
+        Returns
+        -------
+        done : bool
+            True if the detection is over.
+        """
+        return self._done.wait(timeout)
+
+    def poll(self):
+        """Get the available results, without blocking.
+
+        Returns
+        -------
+        results : list
+            List of (chan, index, number, density) for each channel processed
+            since the last call. index is None if the detection failed on
+            this channel.
+        """
+        out = []
+        while True:
+            try:
+                out.append(self._results.get_nowait())
+            except Empty:
+                break
+        with self._lock:
+            return [k[1:] for k in out if k[0] == self._generation]
+
+    def results(self):
+        """Iterate over the results of the detection as they come.
+
+        Returns
+        -------
+        results : generator
+            Generator of (chan, index, number, density).
+        """
+        while True:
+            done = self._done.is_set()
+            for k in self.poll():
+                yield k
+            if done:
+                return
+            self._done.wait(.05)
+
+    def _dispatch(self, generation, method, chans, kwargs, cancel):
+        """Read the channels and send them to the pool."""
+        n_jobs = self.n_jobs or os.cpu_count() or 1
+        pool = (ThreadPoolExecutor if self.backend == 'thread' else
+                ProcessPoolExecutor)(n_jobs)
+        # Limit the number of channels loaded in memory :
+        slots = threading.BoundedSemaphore(2 * n_jobs)
+        # Workers of a process pool do not share the cache :
+        cache = self.cache if self.backend == 'thread' else None
+
+        def _on_done(future, chan):
+            slots.release()
+            if future.cancelled():
+                return self._finish(generation, chan, None)
+            try:
+                _, chan, (index, number, density) = future.result()
+            except Exception as e:
+                logger.warning("%s detection failed on channel %i (%s)" % (
+                    method, chan, e))
+                index, number, density = None, 0, 0.
+            self._finish(generation, chan, (index, number, density))
+
+        futures = []
+        for chan in chans:
+            while not slots.acquire(timeout=.1):
+                if cancel.is_set():
+                    break
+            if cancel.is_set():
+                break
+            try:
+                x = np.asarray(self._data[chan, :])
+                future = pool.submit(_detect_task, generation, chan, method, x,
+                                     self._sf, self._hypno, self._time, cache,
+                                     kwargs)
+            except Exception as e:
+                slots.release()
+                logger.warning("%s detection failed on channel %i (%s)" % (
+                    method, chan, e))
+                self._finish(generation, chan, (None, 0, 0.))
+                continue
+            future.add_done_callback(lambda f, c=chan: _on_done(f, c))
+            futures.append(future)
+        if cancel.is_set():
+            for future in futures:
+                future.cancel()
+        pool.shutdown(wait=False)
+
+    def _finish(self, generation, chan, result):
+        """Send the result of a channel."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._n_done += 1
+            if result is not None:
+                self._results.put((generation, chan) + tuple(result))
+            if self._n_done >= self._n_todo:
+                self._done.set()
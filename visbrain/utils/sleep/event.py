@@ -1,11 +1,22 @@
-"""Goup of functions for index / event managment."""
+"""Goup of functions for index / event managment.
+
+Events can either be described by :
+- A continuous vector of indices (e.g. [10, 11, 12, 20, 21]).
+- A 2D array of (start, end) indices (e.g. [[10, 12], [20, 21]]).
+- Intervals, i.e a 2D array of (start, stop) indices where the stop index is
+  excluded (e.g. [[10, 13], [20, 22]]). Detections work on intervals so that
+  the memory and the time do not scale with the duration of events.
+"""
 
 import numpy as np
 from scipy.signal import hilbert
 
 __all__ = ('_events_duration', '_events_removal', '_events_distance_fill',
-           '_events_mean_freq', '_events_amplitude', '_events_to_index',
-           '_index_to_events')
+           '_events_mean_freq', '_events_amplitude', '_events_proximity',
+           '_events_to_index', '_index_to_events', '_events_to_intervals',
+           '_intervals_to_events', '_mask_to_intervals', '_intervals_to_mask',
+           '_intervals_merge', '_intervals_duration', '_intervals_amplitude',
+           '_intervals_extrema', '_intervals_mean')
 
 
 def _events_duration(index, sf):
@@ -60,17 +71,11 @@ def _events_removal(idx_start, idx_stop, good_dur):
         Row vector containing the extending version of indices.
     """
     # Get where good duration start / end :
-    start = idx_start[good_dur]
-    stop = idx_stop[good_dur]
+    start = np.asarray(idx_start)[good_dur]
+    stop = np.asarray(idx_stop)[good_dur]
 
     # Extend each spindle duration (start -> stop) :
-    extend = np.array([np.arange(i, j) for i, j in zip(start, stop)])
-
-    # Get it as a flatten array :
-    if extend.size:
-        return np.hstack(extend.flat)
-    else:
-        return np.array([], dtype=int)
+    return _intervals_to_events(np.c_[start, stop])
 
 
 def _events_distance_fill(index, min_distance_ms, sf):
@@ -91,19 +96,11 @@ def _events_distance_fill(index, min_distance_ms, sf):
     f_index : array_like
         Filled (corrected) Indices of supra-threshold events
     """
-    # Convert min_distance_ms
-    min_distance = min_distance_ms / 1000. * sf
-    idx_diff = np.diff(index)
-    condition = idx_diff > 1
-    idx_distance = np.where(condition)[0]
-    distance = idx_diff[condition]
-    bad = idx_distance[np.where(distance < min_distance)[0]]
+    intervals = _events_to_intervals(index)
+    merged = _intervals_merge(intervals, min_distance_ms, sf)
     # Fill gap between events separated with less than min_distance_ms
-    if len(bad) > 0:
-        fill = np.hstack([np.arange(index[j] + 1, index[j + 1])
-                          for i, j in enumerate(bad)])
-        f_index = np.sort(np.append(index, fill))
-        return f_index
+    if len(merged) < len(intervals):
+        return _intervals_to_events(merged)
     else:
         return index
 
@@ -184,6 +181,43 @@ def _events_amplitude(x, idx_sup_thr, idx_start, idx_stop, sf):
     return amp_range, distance_ms
 
 
+def _events_proximity(x, index, step):
+    """Find if events are located around some time points.
+
+    Parameters
+    ----------
+    x : array_like
+        Sorted indices of events (e.g. spindles).
+    index : array_like
+        Time points (e.g. starting indices of K-complexes).
+    step : float
+        Half-length of the window. An event is found around a time point t if
+        one of its indices is in [t - step, t + step).
+
+    Returns
+    -------
+    is_close : array_like
+        Boolean array of shape (len(index),).
+    """
+    index = np.asarray(index)
+    x = np.asarray(x)
+    if not x.size:
+        return np.zeros(index.shape, dtype=bool)
+    # (start, end) of each event :
+    intervals = _events_to_intervals(x)
+    ev_start, ev_end = intervals[:, 0], intervals[:, 1] - 1
+    # Window of each time point :
+    lo = np.ceil(index - step)
+    hi = np.ceil(index + step)
+    # First event that ends after the window start, then check that it
+    # starts before the end of the window :
+    first = np.searchsorted(ev_end, lo, side='left')
+    found = first < len(ev_end)
+    is_close = np.zeros(index.shape, dtype=bool)
+    is_close[found] = ev_start[first[found]] < hi[found]
+    return is_close
+
+
 def _events_to_index(x):
     """Convert a continuous vector of indices into an 2D array (start, end).
 
@@ -198,10 +232,9 @@ def _events_to_index(x):
         An array of shape (n_events, 2) where the dimension 2 refer to the
         indices where each event start and finish.
     """
-    # Split indices where it stopped :
-    sp = np.split(x, np.where(np.diff(x) != 1)[0] + 1)
+    intervals = _events_to_intervals(x)
     # Return (start, end) :
-    return np.array([[k[0], k[-1]] for k in sp]).astype(int)
+    return np.c_[intervals[:, 0], intervals[:, 1] - 1]
 
 
 def _index_to_events(x):
@@ -217,7 +250,245 @@ def _index_to_events(x):
     index : array_like
         Continuous array of indicies.
     """
-    index = np.array([])
-    for k in range(x.shape[0]):
-        index = np.append(index, np.arange(x[k, 0], x[k, 1] + 1))
-    return index.astype(int)
+    x = np.asarray(x, dtype=int).reshape(-1, 2)
+    return _intervals_to_events(np.c_[x[:, 0], x[:, 1] + 1])
+
+
+###############################################################################
+# INTERVALS
+###############################################################################
+
+
+def _events_to_intervals(x):
+    """Convert a continuous vector of indices into intervals.
+
+    Parameters
+    ----------
+    x : array_like
+        Sorted array of indices.
+
+    Returns
+    -------
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+    """
+    x = np.asarray(x, dtype=int).ravel()
+    if not x.size:
+        return np.zeros((0, 2), dtype=int)
+    bool_break = np.diff(x) != 1
+    return np.c_[x[np.r_[True, bool_break]], x[np.r_[bool_break, True]] + 1]
+
+
+def _intervals_to_events(intervals):
+    """Convert intervals into a continuous vector of indices.
+
+    Parameters
+    ----------
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+
+    Returns
+    -------
+    index : array_like
+        Continuous array of indices.
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    length = np.maximum(intervals[:, 1] - intervals[:, 0], 0)
+    # Shift a range of indices by the start of each event :
+    offset = np.cumsum(length) - length
+    return np.arange(length.sum()) + np.repeat(intervals[:, 0] - offset,
+                                               length)
+
+
+def _mask_to_intervals(mask):
+    """Get the intervals where a boolean vector is True.
+
+    Parameters
+    ----------
+    mask : array_like
+        Boolean vector of shape (n_points,).
+
+    Returns
+    -------
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+    """
+    mask = np.asarray(mask, dtype=bool).ravel()
+    edges = np.flatnonzero(np.diff(np.r_[False, mask, False].astype(np.int8)))
+    return edges.reshape(-1, 2)
+
+
+def _intervals_to_mask(intervals, n):
+    """Get a boolean vector that is True inside intervals.
+
+    Parameters
+    ----------
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+    n : int
+        Length of the boolean vector.
+
+    Returns
+    -------
+    mask : array_like
+        Boolean vector of shape (n,).
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    edges = np.zeros((n + 1,), dtype=int)
+    np.add.at(edges, intervals[:, 0], 1)
+    np.add.at(edges, intervals[:, 1], -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def _intervals_merge(intervals, min_distance_ms, sf):
+    """Merge events that are too close.
+
+    Parameters
+    ----------
+    intervals : array_like
+        Sorted array of shape (n_events, 2) with the (start, stop) indices
+        of each event (stop excluded).
+    min_distance_ms : float
+        Minimum distance (ms) between two events to consider them as two
+        distinct events. The distance is measured between the last index of
+        an event and the first index of the next one.
+    sf : float
+        Sampling frequency of the data (Hz)
+
+    Returns
+    -------
+    intervals : array_like
+        Merged intervals.
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    if len(intervals) < 2:
+        return intervals
+    min_distance = min_distance_ms / 1000. * sf
+    distance = intervals[1:, 0] - intervals[:-1, 1] + 1
+    keep = distance >= min_distance
+    start = intervals[np.r_[True, keep], 0]
+    stop = intervals[np.r_[keep, True], 1]
+    return np.c_[start, stop]
+
+
+def _intervals_duration(intervals, sf):
+    """Get the duration of events.
+
+    Parameters
+    ----------
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+    sf : float
+        Sampling frequency of the data (Hz)
+
+    Returns
+    -------
+    duration_ms : array_like
+        Duration (ms) of each event.
+    """
+    intervals = np.asarray(intervals).reshape(-1, 2)
+    return (intervals[:, 1] - intervals[:, 0]) * (1000. / sf)
+
+
+def _intervals_reduce(ufunc, x, intervals):
+    """Reduce x inside each (non-empty) interval."""
+    # Interleave (start, stop) and use a sentinel for stop == len(x) :
+    x = np.r_[x, x[-1:]]
+    bounds = np.clip(np.asarray(intervals, dtype=int).ravel(), 0, len(x) - 1)
+    return ufunc.reduceat(x, bounds)[::2]
+
+
+def _intervals_amplitude(x, intervals, sf, get_distance=True):
+    """Find amplitude range of events.
+
+    Parameters
+    ----------
+    x : array_like
+        Array of data of shape (N,)
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+    sf : float
+        Sampling frequency of the data (Hz)
+    get_distance : bool | True
+        Get the distance between the min and the max of each event.
+
+    Returns
+    -------
+    amp_range : array_like
+        Amplitude range (max - min) of each event
+    distance_ms : array_like | None
+        Distance (ms) between min and max
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    if not len(intervals):
+        return np.array([]), np.array([]) if get_distance else None
+    if not get_distance:
+        x = np.asarray(x)
+        x_max = _intervals_reduce(np.maximum, x, intervals)
+        x_min = _intervals_reduce(np.minimum, x, intervals)
+        return x_max - x_min, None
+    x_max, i_max, x_min, i_min = _intervals_extrema(x, intervals)
+    return x_max - x_min, np.abs(i_max - i_min) / sf * 1000.
+
+
+def _intervals_extrema(x, intervals):
+    """Find the maximum and the minimum of x inside each event.
+
+    Parameters
+    ----------
+    x : array_like
+        Array of data of shape (N,)
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        (non-empty) event (stop excluded).
+
+    Returns
+    -------
+    x_max, i_max, x_min, i_min : array_like
+        Maximum / minimum of each event and their first location (relative
+        to the start of the event).
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    x = np.asarray(x)
+    x_max = _intervals_reduce(np.maximum, x, intervals)
+    x_min = _intervals_reduce(np.minimum, x, intervals)
+    # First location of the max / min inside each event :
+    index = _intervals_to_events(intervals)
+    length = intervals[:, 1] - intervals[:, 0]
+    offset = np.cumsum(length) - length
+
+    def _first(extremum):
+        is_ext = np.flatnonzero(x[index] == np.repeat(extremum, length))
+        return is_ext[np.searchsorted(is_ext, offset)] - offset
+
+    return x_max, _first(x_max), x_min, _first(x_min)
+
+
+def _intervals_mean(x, intervals):
+    """Mean of x inside each event.
+
+    Parameters
+    ----------
+    x : array_like
+        Array of data of shape (N,)
+    intervals : array_like
+        Array of shape (n_events, 2) with the (start, stop) indices of each
+        event (stop excluded).
+
+    Returns
+    -------
+    mean : array_like
+        Mean of x inside each event.
+    """
+    intervals = np.asarray(intervals, dtype=int).reshape(-1, 2)
+    if not len(intervals):
+        return np.array([])
+    length = intervals[:, 1] - intervals[:, 0]
+    return _intervals_reduce(np.add, np.asarray(x, dtype=float),
+                             intervals) / length
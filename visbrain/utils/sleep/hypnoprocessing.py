@@ -2,7 +2,238 @@
 
 import numpy as np
 
-__all__ = ('transient', 'sleepstats')
+__all__ = ('HypnoRuns', 'transient', 'sleepstats')
+
+
+class HypnoRuns(object):
+    """Run-length encoded hypnogram.
+
+    The hypnogram is described by a list of runs (onset, duration, stage),
+    where onset and duration are expressed in samples. Consecutive runs
+    always have different stages.
+
+    A HypnoRuns can be used as a (read-only) hypnogram vector : len(),
+    integer indexing, slicing and np.asarray() are supported. Use the
+    to_array method to get the per-sample vector (e.g. to build a mask for
+    a detection).
+
+    Parameters
+    ----------
+    onset : array_like
+        First sample of each run.
+    duration : array_like
+        Number of samples of each run.
+    stage : array_like
+        Stage of each run.
+    """
+
+    def __init__(self, onset, duration, stage):
+        """Init."""
+        onset = np.asarray(onset, dtype=np.int64).ravel()
+        duration = np.asarray(duration, dtype=np.int64).ravel()
+        stage = np.asarray(stage, dtype=np.int64).ravel()
+        if not len(onset) == len(duration) == len(stage):
+            raise ValueError("onset, duration and stage must have the same "
+                             "length.")
+        # Drop empty runs and merge consecutive runs with the same stage :
+        keep = duration > 0
+        onset, duration, stage = onset[keep], duration[keep], stage[keep]
+        first = np.r_[True, stage[1:] != stage[:-1]][:len(stage)]
+        self.onset = onset[first]
+        self.stage = stage[first]
+        self.duration = np.diff(np.r_[self.onset, onset[-1:] + duration[-1:]])
+        self._array = None
+
+    @classmethod
+    def from_array(cls, hypno):
+        """Get the runs of a hypnogram vector.
+
+        Parameters
+        ----------
+        hypno : array_like
+            The hypnogram vector of shape (n_pts,).
+        """
+        if isinstance(hypno, HypnoRuns):
+            return hypno.copy()
+        hypno = np.asarray(hypno).ravel()
+        onset = np.r_[0, np.flatnonzero(hypno[1:] != hypno[:-1]) + 1]
+        onset = onset[onset < len(hypno)]
+        duration = np.diff(np.r_[onset, len(hypno)])
+        return cls(onset, duration, hypno[onset])
+
+    @classmethod
+    def from_epochs(cls, hypno, n, step=1):
+        """Get the runs of a hypnogram scored by epochs.
+
+        This is equivalent to oversample_hypno(hypno, n)[::step], without
+        building the oversampled vector.
+
+        Parameters
+        ----------
+        hypno : array_like
+            Stage of each epoch, of shape (n_epochs,) with n_epochs <= n.
+        n : int
+            The number of samples of the oversampled hypnogram.
+        step : int | 1
+            Down-sampling factor.
+        """
+        hypno = np.asarray(hypno).ravel()
+        rep = int(n // len(hypno))
+        if rep < 1:
+            raise ValueError("The length of the hypnogram vector must be "
+                             "lower than %i (currently %i)" % (n, len(hypno)))
+        # Epoch boundaries (the last epoch is extended up to n) :
+        bounds = np.r_[np.arange(len(hypno)) * rep, n]
+        # Boundaries after down-sampling :
+        bounds = -(-bounds // int(step))
+        return cls(bounds[:-1], np.diff(bounds), hypno.astype(int))
+
+    @classmethod
+    def zeros(cls, n):
+        """Get an empty (wake only) hypnogram of n samples."""
+        return cls([0], [n], [0])
+
+    def __len__(self):
+        """Return the number of samples."""
+        return int(self.duration.sum())
+
+    def __repr__(self):
+        """Represent the runs."""
+        return "HypnoRuns(n_runs=%i, n_pts=%i)" % (len(self.onset), len(self))
+
+    def __getitem__(self, key):
+        """Get the stage of one or several samples."""
+        n = len(self)
+        if isinstance(key, slice):
+            index = np.arange(*key.indices(n))
+        elif np.ndim(key) == 0:
+            key = int(key)
+            if not -n <= key < n:
+                raise IndexError("Index %i is out of bounds." % key)
+            return self.stage[np.searchsorted(self.onset, key % n,
+                                              side='right') - 1]
+        else:
+            index = np.arange(n)[key]
+        return self.values_at(index)
+
+    def __array__(self, dtype=None, copy=None):
+        """Get the per-sample hypnogram vector (read-only unless copied)."""
+        arr = self.to_array(dtype=dtype)
+        return arr.copy() if copy else arr
+
+    @property
+    def shape(self):
+        """Get the shape of the per-sample hypnogram vector."""
+        return (len(self),)
+
+    @property
+    def stop(self):
+        """Get the last (excluded) sample of each run."""
+        return self.onset + self.duration
+
+    def copy(self):
+        """Get a copy of the runs."""
+        return HypnoRuns(self.onset, self.duration, self.stage)
+
+    def values_at(self, index):
+        """Get the stages of several samples.
+
+        Parameters
+        ----------
+        index : array_like
+            Sample indices.
+
+        Returns
+        -------
+        stages : array_like
+            The stage of each sample.
+        """
+        run = np.searchsorted(self.onset, index, side='right') - 1
+        return self.stage[run]
+
+    def to_array(self, dtype=np.float32):
+        """Get the per-sample hypnogram vector.
+
+        The vector is cached until the hypnogram is modified. The float32
+        vector is the cached one, and is therefore read-only : use set_stage
+        to edit the hypnogram.
+
+        Parameters
+        ----------
+        dtype : type | np.float32
+            Data type of the vector.
+        """
+        if self._array is None:
+            self._array = np.repeat(self.stage, self.duration).astype(
+                np.float32)
+            self._array.flags.writeable = False
+        return self._array if dtype in (None, np.float32) else \
+            self._array.astype(dtype)
+
+    def set_stage(self, start, stop, stage):
+        """Set the stage of a time interval.
+
+        Parameters
+        ----------
+        start : int
+            First sample of the interval.
+        stop : int
+            Last (excluded) sample of the interval.
+        stage : int
+            The stage.
+        """
+        n = len(self)
+        start, stop = max(int(start), 0), min(int(stop), n)
+        if start >= stop:
+            return
+        onset, end = self.onset, self.stop
+        # Runs before / after the interval (possibly cut) :
+        bef = onset < start
+        aft = end > stop
+        onset_a = np.maximum(onset[aft], stop)
+        new = HypnoRuns(np.r_[onset[bef], start, onset_a],
+                        np.r_[np.minimum(end[bef], start) - onset[bef],
+                              stop - start, end[aft] - onset_a],
+                        np.r_[self.stage[bef], int(stage), self.stage[aft]])
+        self.onset, self.duration, self.stage = (new.onset, new.duration,
+                                                 new.stage)
+        self._array = None
+
+    def map(self, mapping, default=0):
+        """Convert the stages.
+
+        Parameters
+        ----------
+        mapping : dict
+            Dictionary {old_stage: new_stage}.
+        default : int | 0
+            Stage used for stages that are not in mapping.
+
+        Returns
+        -------
+        runs : HypnoRuns
+            The converted hypnogram.
+        """
+        stage = np.array([mapping.get(int(k), default) for k in self.stage],
+                         dtype=np.int64)
+        return HypnoRuns(self.onset, self.duration, stage)
+
+    def decimate(self, step):
+        """Down-sample the hypnogram.
+
+        This is equivalent to HypnoRuns.from_array(self.to_array()[::step]).
+
+        Parameters
+        ----------
+        step : int
+            Down-sampling factor.
+        """
+        step = int(step)
+        if step < 1:
+            raise ValueError("The down-sampling factor must be a positive "
+                             "integer (got %s)." % step)
+        onset, end = -(-self.onset // step), -(-self.stop // step)
+        return HypnoRuns(onset, end - onset, self.stage)
 
 
 def transient(data, xvec=None):
@@ -10,7 +241,7 @@ def transient(data, xvec=None):
 
     Parameters
     ----------
-    data : array_like
+    data : array_like | HypnoRuns
         The hypnogram data.
     xvec : array_like | None
         The time vector to use. If None, np.arange(len(data)) will be used
@@ -26,14 +257,15 @@ def transient(data, xvec=None):
     stages : array_like
         The stages for each segment.
     """
+    runs = HypnoRuns.from_array(data)
     # Transient detection :
-    t = list(np.nonzero(np.abs(data[:-1] - data[1:]))[0])
+    t = runs.onset[1:] - 1
     # Add first and last points :
-    idx = np.vstack((np.array([-1] + t) + 1, np.array(t + [len(data) - 1]))).T
+    idx = np.c_[runs.onset, runs.stop - 1]
     # Get stages :
-    stages = data[idx[:, 0]]
+    stages = runs.stage
     # Convert (if needed) :
-    if (xvec is not None) and (len(xvec) == len(data)):
+    if (xvec is not None) and (len(xvec) == len(runs)):
         st = idx.copy().astype(float)
         st[:, 0] = xvec[idx[:, 0]]
         st[:, 1] = xvec[idx[:, 1]]
@@ -74,7 +306,7 @@ def sleepstats(hypno, sf_hyp):
 
     Parameters
     ----------
-    hypno : array_like
+    hypno : array_like | HypnoRuns
         Hypnogram vector
     sf_hyp : float
         The sampling frequency of the hypnogram
@@ -88,31 +320,27 @@ def sleepstats(hypno, sf_hyp):
     tov = np.nan
 
     # Downsample to 1 value per second
-    hypno = hypno[::int(sf_hyp)]
+    runs = HypnoRuns.from_array(hypno).decimate(int(sf_hyp))
+    onset, stop, stage = runs.onset, runs.stop, runs.stage
 
-    stats['TIB'] = len(hypno)
-    stats['TDT'] = np.where(hypno != 0)[0].max() if np.nonzero(
-        hypno)[0].size else tov
+    stats['TIB'] = len(runs)
+    stats['TDT'] = stop[stage != 0].max() - 1 if any(stage != 0) else tov
 
     # Duration of each sleep stages
-    stats['Art'] = hypno[hypno == -1].size
-    stats['W'] = hypno[hypno == 0].size
-    stats['N1'] = hypno[hypno == 1].size
-    stats['N2'] = hypno[hypno == 2].size
-    stats['N3'] = hypno[hypno == 3].size
-    stats['REM'] = hypno[hypno == 4].size
+    for name, k in zip(['Art', 'W', 'N1', 'N2', 'N3', 'REM'], range(-1, 5)):
+        stats[name] = runs.duration[stage == k].sum()
 
     # Sleep stage latencies
-    stats['LatN1'] = np.where(hypno == 1)[0].min() if 1 in hypno else tov
-    stats['LatN2'] = np.where(hypno == 2)[0].min() if 2 in hypno else tov
-    stats['LatN3'] = np.where(hypno == 3)[0].min() if 3 in hypno else tov
-    stats['LatREM'] = np.where(hypno == 4)[0].min() if 4 in hypno else tov
+    for name, k in zip(['LatN1', 'LatN2', 'LatN3', 'LatREM'], range(1, 5)):
+        stats[name] = onset[stage == k].min() if k in stage else tov
 
     if not np.isnan(stats['LatN1']) and not np.isnan(stats['TDT']):
-        hypno_s = hypno[stats['LatN1']:stats['TDT']]
-
-        stats['SPT'] = hypno_s.size
-        stats['WASO'] = hypno_s[hypno_s == 0].size
+        sta, end = stats['LatN1'], stats['TDT']
+        stats['SPT'] = max(end - sta, 0)
+        # Wake periods within [LatN1, TDT[ :
+        wake = stage == 0
+        overlap = np.minimum(stop[wake], end) - np.maximum(onset[wake], sta)
+        stats['WASO'] = overlap[overlap > 0].sum()
         stats['TST'] = stats['SPT'] - stats['WASO']
     else:
         stats['SPT'] = tov
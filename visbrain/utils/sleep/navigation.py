@@ -0,0 +1,219 @@
+"""Navigation through long sleep recordings.
+
+This file contains :
+- time_to_index : O(1) conversion of a time into the closest time index
+- WindowCache : LRU cache of prepared time windows, with a background thread
+  to prefetch the windows around the current one.
+"""
+import logging
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+logger = logging.getLogger('visbrain')
+
+__all__ = ('time_to_index', 'WindowCache')
+
+
+def time_to_index(x, time):
+    """Get the index of the closest time point of a regular time vector.
+
+    This is equivalent to np.abs(time - x).argmin() without scanning the
+    time vector.
+
+    Parameters
+    ----------
+    x : float | array_like
+        Time (or times) to convert.
+    time : array_like
+        Regularly sampled time vector.
+
+    Returns
+    -------
+    index : int | array_like
+        Index (or indices) of the closest time point.
+    """
+    n = len(time)
+    if n < 2:
+        return 0 if np.isscalar(x) else np.zeros(np.shape(x), dtype=int)
+    step = (float(time[-1]) - float(time[0])) / (n - 1)
+    index = np.clip(np.round((np.asarray(x) - float(time[0])) / step), 0,
+                    n - 1).astype(int)
+    return int(index) if index.ndim == 0 else index
+
+
+class WindowCache(object):
+    """LRU cache of prepared time windows, with background prefetching.
+
+    Windows are computed by a function fcn(*args) and stored with a key
+    that identifies them (e.g. the time window, the visible channels and the
+    preprocessing settings). Windows can be computed ahead of time by a
+    worker thread (see the prefetch method).
+
+    Parameters
+    ----------
+    fcn : function
+        Function that computes a window.
+    max_size : int | 16
+        Maximum number of windows kept in the cache.
+    """
+
+    def __init__(self, fcn, max_size=16):
+        """Init."""
+        self._fcn = fcn
+        self.max_size = max(int(max_size), 1)
+        self._windows = OrderedDict()
+        self._pending = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._generation = 0
+        self._thread = None
+        self.hits, self.misses = 0, 0
+
+    def __len__(self):
+        """Return the number of windows in the cache."""
+        return len(self._windows)
+
+    def __contains__(self, key):
+        """Return if a window is in the cache."""
+        return key in self._windows
+
+    @property
+    def busy(self):
+        """Get the busy value (True if windows are being prefetched)."""
+        with self._lock:
+            return self._busy()
+
+    def _busy(self):
+        """Get if windows are being prefetched (lock acquired)."""
+        return bool(self._queue) or bool(self._pending)
+
+    def _done(self, key, event):
+        """Release a window that was being computed (lock acquired)."""
+        self._pending.pop(key)
+        event.set()
+        if not self._busy():
+            self._idle.notify_all()
+
+    def _store(self, key, value, generation):
+        """Store a window (if the cache has not been cleared meanwhile)."""
+        with self._lock:
+            if generation == self._generation:
+                self._windows[key] = value
+                self._windows.move_to_end(key)
+                while len(self._windows) > self.max_size:
+                    self._windows.popitem(last=False)
+
+    def get(self, key, *args):
+        """Get a window (computed with fcn(*args) if not cached).
+
+        Parameters
+        ----------
+        key : tuple
+            Hashable key of the window.
+        args : tuple
+            Arguments passed to fcn.
+
+        Returns
+        -------
+        window : object
+            The output of fcn(*args).
+        """
+        with self._lock:
+            if key in self._windows:
+                self._windows.move_to_end(key)
+                self.hits += 1
+                return self._windows[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                # Computed here, so it must not be prefetched again :
+                for item in [i for i in self._queue if i[0] == key]:
+                    self._queue.remove(item)
+                event = self._pending[key] = threading.Event()
+            generation = self._generation
+        # The window is being computed by another thread, wait for it :
+        if pending is not None:
+            pending.wait()
+            with self._lock:
+                if key in self._windows:
+                    self.hits += 1
+                    return self._windows[key]
+            return self.get(key, *args)
+        self.misses += 1
+        try:
+            value = self._fcn(*args)
+            self._store(key, value, generation)
+        finally:
+            with self._lock:
+                self._done(key, event)
+        return value
+
+    def wait(self, timeout=None):
+        """Wait until every queued window has been prefetched.
+
+        Parameters
+        ----------
+        timeout : float | None
+            Maximum waiting time (in seconds).
+
+        Returns
+        -------
+        idle : bool
+            False if the timeout expired before the end of the prefetching.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._busy(), timeout)
+
+    def prefetch(self, items):
+        """Compute windows in a background thread.
+
+        Parameters
+        ----------
+        items : list
+            List of (key, args) tuples, in the order in which they have to be
+            computed. Windows that are still waiting to be prefetched from a
+            previous call are dropped.
+        """
+        with self._lock:
+            self._queue.clear()
+            self._queue.extend([(k, a) for k, a in items
+                                if k not in self._windows])
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _worker(self):
+        """Prefetch the queued windows."""
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._queue:
+                    self._wake.clear()
+                    if not self._busy():
+                        self._idle.notify_all()
+                    continue
+                key, args = self._queue.popleft()
+                if (key in self._windows) or (key in self._pending):
+                    continue
+                event = self._pending[key] = threading.Event()
+                generation = self._generation
+            try:
+                self._store(key, self._fcn(*args), generation)
+            except Exception as e:
+                logger.debug("Window prefetching failed (%s)" % e)
+            finally:
+                with self._lock:
+                    self._done(key, event)
+
+    def clear(self):
+        """Remove every window (e.g. because the data changed)."""
+        with self._lock:
+            self._windows.clear()
+            self._queue.clear()
+            self._generation += 1
+            if not self._busy():
+                self._idle.notify_all()
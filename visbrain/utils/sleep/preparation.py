@@ -0,0 +1,299 @@
+"""Whole-recording preparation of sleep data.
+
+This file contains :
+- prepare_recording : demean / detrend / filter / wavelet decomposition of
+  a whole channel, chunk by chunk.
+- PreparedRecording : cache of prepared channels, built in a background
+  thread.
+"""
+import logging
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+from scipy.signal import lfilter, filtfilt
+
+from ..filtering import _filt_coefs, _morlet_wlt, morlet_bank, PrepareData
+
+logger = logging.getLogger('visbrain')
+
+__all__ = ('prepare_recording', 'PreparedRecording')
+
+
+def _settings_key(prep):
+    """Get the cache key of the preparation settings of a PrepareData."""
+    settings = prep.settings
+    settings.pop('axis')
+    # Drop the parameters that have no effect :
+    if not prep.filt:
+        to_drop = ('fstart', 'fend', 'forder', 'way', 'filt_meth', 'btype',
+                   'dispas')
+    elif prep.dispas != 'filter':
+        to_drop = ('forder', 'way', 'filt_meth', 'btype')
+    else:
+        to_drop = ()
+    for k in to_drop:
+        settings.pop(k)
+    return tuple(sorted(settings.items()))
+
+
+def _filtfilt_overlap(b, a, tol=1e-7):
+    """Get the number of samples after which the impulse response vanishes."""
+    radius = np.abs(np.roots(a)).max() if len(a) > 1 else 0.
+    if radius <= 0.:
+        return len(b)
+    if radius >= 1.:
+        raise ValueError("The filter is unstable.")
+    return int(np.ceil(np.log(tol) / np.log(radius))) + len(b)
+
+
+def prepare_recording(sf, x, prep, chunk=2 ** 20, cancel=None):
+    """Prepare a whole channel, chunk by chunk.
+
+    The mean and the linear trend are computed over the whole recording.
+    Chunks are filtered with enough overlap (impulse response of the filter
+    or length of the wavelet) to avoid transients at their borders. With
+    the 'lfilter' way, the state of the filter is carried from one chunk to
+    the next, which gives exactly the output of lfilter on the whole
+    channel.
+
+    Parameters
+    ----------
+    sf : float
+        The sampling frequency.
+    x : array_like
+        Data of a single channel of shape (n_points,). Can be a row of a
+        LazySleepData.
+    prep : PrepareData
+        The preparation settings.
+    chunk : int | 2 ** 20
+        Number of time points prepared at once.
+    cancel : threading.Event | None
+        Event used to stop the preparation.
+
+    Returns
+    -------
+    xprep : array_like | None
+        The prepared channel of shape (n_points,) (float32). None if the
+        preparation has been canceled.
+    """
+    n_pts, chunk = x.shape[-1], max(int(chunk), 1)
+
+    # ============= DEMEAN / DETREND =============
+    offset, slope = 0., 0.
+    if prep.demean or prep.detrend:
+        s_x, s_tx = 0., 0.
+        for k in range(0, n_pts, chunk):
+            block = np.asarray(x[k:k + chunk], dtype=np.float64)
+            s_x += block.sum()
+            s_tx += np.dot(np.arange(k, k + len(block)), block)
+        offset = s_x / n_pts
+        if prep.detrend and n_pts > 1:
+            t_mean = (n_pts - 1) / 2.
+            slope = (s_tx - t_mean * s_x) / (n_pts * (n_pts ** 2 - 1) / 12.)
+            offset -= slope * t_mean
+
+    # ============= FILTERING =============
+    overlap = 0
+    if prep.filt and prep.dispas == 'filter':
+        b, a = _filt_coefs(sf, np.array([prep.fstart, prep.fend]),
+                           prep.btype, prep.forder, prep.filt_meth)
+        if prep.way == 'lfilter':
+            zi = [np.zeros(max(len(a), len(b)) - 1)]
+
+            def fcn(block):
+                y, zi[0] = lfilter(b, a, block, zi=zi[0])
+                return y
+        else:
+            overlap = _filtfilt_overlap(b, a)
+
+            def fcn(block):
+                return filtfilt(b, a, block)
+    elif prep.filt:
+        # Wavelet decomposition :
+        f = np.mean([prep.fstart, prep.fend])
+        overlap = len(_morlet_wlt(sf, f))
+
+        def fcn(block):
+            return morlet_bank(block, sf, [f], get=prep.dispas)[0]
+    else:
+        fcn = None
+
+    # ============= CHUNKS =============
+    xprep = np.empty((n_pts,), dtype=np.float32)
+    for k in range(0, n_pts, chunk):
+        if (cancel is not None) and cancel.is_set():
+            return None
+        start, stop = max(k - overlap, 0), min(k + chunk + overlap, n_pts)
+        block = np.asarray(x[start:stop], dtype=np.float64)
+        if offset or slope:
+            block = block - (offset + slope * np.arange(start, stop))
+        if fcn is not None:
+            block = fcn(block)
+        end = min(chunk, n_pts - k)
+        xprep[k:k + end] = block[k - start:k - start + end]
+    return xprep
+
+
+class PreparedRecording(object):
+    """Cache of whole-recording prepared channels.
+
+    Channels are prepared with prepare_recording in a background thread and
+    stored with a key made of the channel index and of the preparation
+    settings. Changing the settings (or the prepared channels) therefore
+    only rebuilds the channels that are missing.
+
+    Parameters
+    ----------
+    sf : float
+        The sampling frequency.
+    data : array_like
+        Array-like of shape (n_channels, n_points). Can be a LazySleepData.
+    max_size : int | None
+        Maximum number of prepared channels kept in memory. By default, twice
+        the number of channels.
+    chunk : int | 2 ** 20
+        Number of time points prepared at once.
+    """
+
+    def __init__(self, sf, data, max_size=None, chunk=2 ** 20):
+        """Init."""
+        self._sf = sf
+        self._chunk = chunk
+        self._channels = OrderedDict()
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._cancel = threading.Event()
+        self._thread = None
+        self.set_data(data, max_size)
+
+    def __len__(self):
+        """Return the number of prepared channels."""
+        return len(self._channels)
+
+    def set_data(self, data, max_size=None):
+        """Set the data (e.g. after a re-referencing) and clear the cache.
+
+        Parameters
+        ----------
+        data : array_like
+            Array-like of shape (n_channels, n_points).
+        max_size : int | None
+            Maximum number of prepared channels kept in memory.
+        """
+        with self._lock:
+            self._cancel.set()
+            self._data = data
+            n_chan = data.shape[0]
+            self.max_size = 2 * n_chan if max_size is None else max_size
+            self._channels.clear()
+            self._queue.clear()
+
+    def request(self, prep, chan):
+        """Ask for prepared channels.
+
+        Parameters
+        ----------
+        prep : PrepareData
+            The preparation settings.
+        chan : array_like
+            Indices of the channels.
+
+        Returns
+        -------
+        ready : bool
+            True if every channel is already prepared. Otherwise, missing
+            channels are prepared in a background thread.
+        """
+        key = _settings_key(prep)
+        with self._lock:
+            missing = [(int(c), key) for c in np.atleast_1d(chan)
+                       if (int(c), key) not in self._channels]
+            if not missing:
+                return True
+            todo = [k for k in missing if k not in self._queue]
+            if not todo:
+                return False
+            self._queue.extend(todo)
+            self._idle.clear()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        self._wake.set()
+        return False
+
+    def get(self, prep, chan, start, stop):
+        """Get a time window of prepared channels.
+
+        Parameters
+        ----------
+        prep : PrepareData
+            The preparation settings.
+        chan : array_like
+            Indices of the channels.
+        start, stop : int
+            First and last (excluded) time indices of the window.
+
+        Returns
+        -------
+        data : array_like | None
+            The prepared data of shape (len(chan), stop - start). None if one
+            of the channels is not prepared yet.
+        """
+        key = _settings_key(prep)
+        with self._lock:
+            out = []
+            for c in np.atleast_1d(chan):
+                xprep = self._channels.get((int(c), key))
+                if xprep is None:
+                    return None
+                self._channels.move_to_end((int(c), key))
+                out.append(xprep[start:stop])
+        return np.array(out)
+
+    def wait(self, timeout=None):
+        """Wait until every requested channel is prepared.
+
+        Parameters
+        ----------
+        timeout : float | None
+            Maximum time to wait (in seconds).
+
+        Returns
+        -------
+        ready : bool
+            True if every requested channel is prepared.
+        """
+        return self._idle.wait(timeout)
+
+    def _worker(self):
+        """Prepare the queued channels."""
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._queue:
+                    self._wake.clear()
+                    self._idle.set()
+                    continue
+                chan, key = self._queue[0]
+                data, cancel = self._data, threading.Event()
+                self._cancel = cancel
+            try:
+                prep = PrepareData(**dict(key))
+                xprep = prepare_recording(self._sf, data[chan, :], prep,
+                                          self._chunk, cancel)
+            except Exception as e:
+                logger.warning("Preparation of channel %i failed (%s)" % (
+                    chan, e))
+                xprep = None
+            with self._lock:
+                if self._queue and self._queue[0] == (chan, key):
+                    self._queue.popleft()
+                if (xprep is None) or cancel.is_set():
+                    continue
+                self._channels[(chan, key)] = xprep
+                while len(self._channels) > self.max_size:
+                    self._channels.popitem(last=False)
@@ -0,0 +1,159 @@
+"""Multi-resolution min / max envelope of sleep data.
+
+This file contains :
+- MinMaxPyramid : per-channel min / max pyramid used to display long time
+  windows with a bounded number of points.
+"""
+import threading
+
+import numpy as np
+
+__all__ = ('MinMaxPyramid',)
+
+
+class MinMaxPyramid(object):
+    """Per-channel min / max pyramid of sleep data.
+
+    The level k of the pyramid contains the minimum and the maximum of each
+    channel over consecutive bins of factor ** (k + 1) samples. The envelope
+    of any time window can then be obtained with a number of points which
+    only depends on the requested resolution (and not on the window length).
+
+    Parameters
+    ----------
+    data : array_like
+        Array-like of shape (n_channels, n_points). Can be a LazySleepData.
+    factor : int | 4
+        Number of bins of a level that are merged into a single bin of the
+        next level.
+    chunk : int | 2 ** 20
+        Number of time points read at once to build the first level.
+    background : bool | False
+        Build the pyramid in a background thread. Until the pyramid is built,
+        the envelope method returns None.
+    """
+
+    def __init__(self, data, factor=4, chunk=2 ** 20, background=False):
+        """Init."""
+        if factor < 2:
+            raise ValueError("The factor of the pyramid must be at least 2.")
+        self._data = data
+        self.shape = tuple(data.shape)
+        self.factor = int(factor)
+        self._chunk = max(int(chunk) // self.factor, 1) * self.factor
+        self.levels = []
+        self._ready = threading.Event()
+        self._cancel = threading.Event()
+        if background:
+            self._thread = threading.Thread(target=self.build, daemon=True)
+            self._thread.start()
+        else:
+            self._thread = None
+            self.build()
+
+    def __len__(self):
+        """Return the number of levels."""
+        return len(self.levels)
+
+    def build(self):
+        """Build every level of the pyramid."""
+        n_pts, f = self.shape[1], self.factor
+        n_bins = -(-n_pts // f)
+        mn = np.empty((self.shape[0], n_bins), dtype=np.float32)
+        mx = np.empty_like(mn)
+        # First level, built chunk by chunk :
+        for k in range(0, n_pts, self._chunk):
+            if self._cancel.is_set():
+                return
+            block = np.asarray(self._data[:, k:k + self._chunk])
+            idx = np.arange(0, block.shape[1], f)
+            sl = slice(k // f, k // f + len(idx))
+            mn[:, sl] = np.minimum.reduceat(block, idx, axis=1)
+            mx[:, sl] = np.maximum.reduceat(block, idx, axis=1)
+        levels = [(mn, mx)]
+        # Next levels :
+        while levels[-1][0].shape[1] > 1:
+            mn, mx = levels[-1]
+            idx = np.arange(0, mn.shape[1], f)
+            levels.append((np.minimum.reduceat(mn, idx, axis=1),
+                           np.maximum.reduceat(mx, idx, axis=1)))
+        self.levels = levels
+        self._ready.set()
+
+    def cancel(self):
+        """Stop building the pyramid (e.g. because the data changed)."""
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        """Wait until the pyramid is built.
+
+        Parameters
+        ----------
+        timeout : float | None
+            Maximum time to wait (in seconds).
+
+        Returns
+        -------
+        ready : bool
+            True if the pyramid is built.
+        """
+        return self._ready.wait(timeout)
+
+    def envelope(self, chan, start, stop, n_max):
+        """Get the min / max envelope of a time window.
+
+        Parameters
+        ----------
+        chan : array_like
+            Indices of the channels.
+        start, stop : int
+            First and last (excluded) time indices of the window.
+        n_max : int
+            Maximum number of points to return per channel.
+
+        Returns
+        -------
+        index : array_like | None
+            Time indices of the returned points, of shape (n_pts,), with
+            n_pts <= n_max. Each bin of the envelope gives two consecutive
+            points (minimum then maximum) located at the first sample of the
+            bin. None if the window contains less than n_max points or if the
+            pyramid is not built yet (the raw data should be used instead).
+        data : array_like | None
+            The envelope of shape (len(chan), n_pts).
+        """
+        chan = np.atleast_1d(chan)
+        start, stop = max(int(start), 0), min(int(stop), self.shape[1])
+        n_pts = stop - start
+        if (n_pts <= n_max) or not self._ready.is_set():
+            return None, None
+        # Finest level with at most n_max / 2 bins (including the two
+        # partial bins at the edges of the window) :
+        for num, (mn, mx) in enumerate(self.levels):
+            size = self.factor ** (num + 1)
+            if n_pts // size + 2 <= n_max // 2:
+                break
+        # Bins edges (only the bins at the edges of the window can be
+        # partial) :
+        first, last = -(-start // size), stop // size
+        full = np.arange(first, max(first, last + 1)) * size
+        edges = np.unique(np.r_[start, full, stop])
+        is_full = np.diff(edges) == size
+        # Full bins come from the pyramid, partial bins from the data :
+        env_min = np.empty((len(chan), len(is_full)), dtype=np.float32)
+        env_max = np.empty_like(env_min)
+        env_min[:, is_full] = mn[chan, first:last]
+        env_max[:, is_full] = mx[chan, first:last]
+        for k in np.flatnonzero(~is_full):
+            part = np.asarray(self._data[chan, edges[k]:edges[k + 1]])
+            env_min[:, k], env_max[:, k] = part.min(1), part.max(1)
+        # Interleave min / max :
+        index = np.repeat(edges[:-1], 2)
+        data = np.empty((len(chan), len(index)), dtype=np.float32)
+        data[:, 0::2], data[:, 1::2] = env_min, env_max
+        return index, data
+
+    @property
+    def ready(self):
+        """Get the ready value (True if the pyramid is built)."""
+        return self._ready.is_set()
@@ -10,7 +10,7 @@ import vispy.visuals.transforms as vist
 from vispy.scene.visuals import Image
 
 from ..visuals import CbarBase
-from ..utils import (morlet, array2colormap, vispy_array, averaging,
+from ..utils import (morlet_bank, array2colormap, vispy_array, averaging,
                      normalization)
 
 
@@ -85,15 +85,30 @@ class TFmapsMesh(CbarBase):
         assert isinstance(f_step, (int, float))
         # assert isinstance(baseline)
 
-        # ======================= PRE-ALLOCATION =======================
-        self._n = len(data)
+        freqs, tf = self.compute_tf(data, sf, f_min, f_max, f_step, baseline,
+                                    norm, n_window, overlap, window)
+        self.set_tf(tf, freqs, sf, len(data), contrast=contrast, **kwargs)
+
+    def compute_tf(self, data, sf, f_min=1., f_max=160., f_step=1.,
+                   baseline=None, norm=3, n_window=None, overlap=0.,
+                   window='flat'):
+        """Compute the time-frequency map (without any display).
+
+        See set_data for the description of the parameters.
+
+        Returns
+        -------
+        freqs : array_like
+            The frequency vector.
+        tf : array_like
+            The (normalized, averaged and down-sampled) time-frequency map
+            of shape (n_freqs, n_times).
+        """
         freqs = np.arange(f_min, f_max, f_step)  # frequency vector
-        time = np.arange(len(self)) / sf
-        tf = np.zeros((len(freqs), len(self)), dtype=data.dtype)
 
         # ======================= COMPUTE TF =======================
-        for i, k in enumerate(freqs):
-            tf[i, :] = np.square(np.abs(morlet(data, sf, k)))
+        tf = morlet_bank(data, sf, freqs, get='power')
+        tf = tf.astype(data.dtype, copy=False)
 
         # ======================= NORMALIZATION =======================
         normalization(tf, norm=norm, baseline=baseline, axis=1)
@@ -108,6 +123,26 @@ class TFmapsMesh(CbarBase):
         if tf.shape[1] > self._n_limits:
             downsample = int(np.round(tf.shape[1] / self._n_limits))
             tf = tf[:, ::downsample]
+        return freqs, tf
+
+    def set_tf(self, tf, freqs, sf, n_pts, contrast=.1, **kwargs):
+        """Display a time-frequency map computed with compute_tf.
+
+        Parameters
+        ----------
+        tf : array_like
+            The time-frequency map of shape (n_freqs, n_times).
+        freqs : array_like
+            The frequency vector.
+        sf : float
+            The sampling frequency.
+        n_pts : int
+            Number of time points of the data.
+        contrast : float | .1
+            Contrast of the colormap.
+        """
+        self._n = n_pts
+        time = np.arange(len(self)) / sf
 
         # ======================= CLIM // CMAP =======================
         # Get contrast (if defined) :
@@ -136,7 +171,7 @@ class TFmapsMesh(CbarBase):
         self._image.transform.translate = tr
 
         # ======================= CAMERA =======================
-        self.rect = (time[0], f_min, t_max - t_min, fr_max - fr_min)
+        self.rect = (time[0], freqs[0], t_max - t_min, fr_max - fr_min)
         self.freqs = freqs
 
     def update(self):
@@ -166,4 +201,3 @@ class TFmapsMesh(CbarBase):
         """Set interpolation value."""
         self._interpolation = value
         self._image.interpolation = value
-